@@ -0,0 +1,83 @@
+"""
+
+   Per-request latency of Product API calls with and without a pooled
+   keep-alive session
+
+   Run from the directory containing this component:
+       python -m <component>.benchmarks.bench_session [requests]
+
+   The stub API listens on plain HTTP on localhost, so the numbers only
+   include the TCP handshake; against the real API every new connection
+   additionally pays a TLS handshake.
+
+"""
+import statistics
+import sys
+import time
+from unittest.mock import Mock
+
+import requests
+
+from ..proxy import DeploymentProxy
+from .stub_api import StubProductAPI
+
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    return {
+        "p50": samples[len(samples) // 2] * 1000,
+        "p99": samples[int(len(samples) * 0.99) - 1] * 1000,
+        "mean": statistics.mean(samples) * 1000,
+    }
+
+
+def _time(fn, count):
+    samples = []
+    for _ in range(count):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def run(count=500):
+    api = StubProductAPI().start()
+    api.set_desired("instance", "config", "version", "deployment")
+    manager = Mock(api_key="key", instance_id="instance")
+    url = "{}/instances/instance/configuration".format(api.url)
+    headers = {"authorization": "apikey key",
+               "content-type": "application/json"}
+    results = {}
+    try:
+        connections = api.connections
+        results["requests.get (before)"] = (
+            _time(lambda: requests.get(url, headers=headers).json(), count),
+            api.connections - connections)
+
+        proxy = DeploymentProxy(api.url, manager, keep_alive=False)
+        connections = api.connections
+        results["proxy, keep_alive=False"] = (
+            _time(proxy.get_instance_config_ids, count),
+            api.connections - connections)
+        proxy.close()
+
+        proxy = DeploymentProxy(api.url, manager)
+        connections = api.connections
+        results["proxy, pooled session (after)"] = (
+            _time(proxy.get_instance_config_ids, count),
+            api.connections - connections)
+        proxy.close()
+    finally:
+        api.stop()
+
+    print("{} requests per mode".format(count))
+    for name, (samples, connections) in results.items():
+        stats = _percentiles(samples)
+        print("{:<32} p50 {:.3f}ms  p99 {:.3f}ms  mean {:.3f}ms  "
+              "connections {}".format(name, stats["p50"], stats["p99"],
+                                      stats["mean"], connections))
+    return results
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
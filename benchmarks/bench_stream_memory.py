@@ -0,0 +1,110 @@
+"""
+
+   Peak memory and time of downloading a large configuration, decoded all
+   at once versus streamed
+
+   Run from the directory containing this component:
+       python -m <component>.benchmarks.bench_stream_memory [blocks]
+
+   Each mode runs in its own process so that its peak RSS can be measured,
+   Python heap peak is measured through tracemalloc in a separate run since
+   tracing itself adds to RSS.
+
+"""
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from unittest.mock import Mock
+
+from ..proxy import DeploymentProxy
+from .configurations import synthetic_configuration
+from .stub_api import StubProductAPI
+
+MODES = ("full", "stream", "stream_gzip")
+
+
+def _peak_rss_mb():
+    """ Peak RSS of this process
+
+    ru_maxrss survives exec on Linux, holding the peak of the parent
+    process, the high water mark in /proc does not
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def child(mode, url, trace=False):
+    """ Downloads configuration in given mode and prints peak memory """
+    proxy = DeploymentProxy(url, Mock(api_key="key", instance_id="instance"))
+    if trace:
+        tracemalloc.start()
+    baseline = _peak_rss_mb()
+    start = time.perf_counter()
+    if mode == "full":
+        configuration = proxy.get_configuration("config", "version")
+        configuration_data = json.loads(configuration["configuration_data"])
+    else:
+        configuration_data = proxy.stream_configuration(
+            "config", "version")["configuration_data"]
+    elapsed = time.perf_counter() - start
+    if trace:
+        current, peak = tracemalloc.get_traced_memory()
+        print(json.dumps({"heap_mb": current / 2 ** 20,
+                          "heap_peak_mb": peak / 2 ** 20}))
+        return
+    print(json.dumps({
+        "mode": mode,
+        "blocks": len(configuration_data["blocks"]),
+        "seconds": elapsed,
+        "peak_rss_mb": _peak_rss_mb() - baseline
+    }))
+
+
+def _run_child(mode, url, trace):
+    command = [sys.executable, "-m", __spec__.name, "--child", mode, url]
+    if trace:
+        command.append("--trace")
+    output = subprocess.check_output(
+        command, env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def run(blocks=50000):
+    configuration = synthetic_configuration(blocks)
+    results = []
+    for mode in MODES:
+        api = StubProductAPI(compress=mode.endswith("gzip")).start()
+        api.add_configuration("config", "version", configuration)
+        try:
+            result = _run_child(mode, api.url, False)
+            result["bytes_sent"] = api.bytes_sent
+            result.update(_run_child(mode, api.url, True))
+        finally:
+            api.stop()
+        results.append(result)
+
+    print("configuration with {} blocks".format(blocks))
+    for result in results:
+        print("{mode:<12} peak RSS growth {peak_rss_mb:7.1f}MB  "
+              "heap peak {heap_peak_mb:7.1f}MB (decoded {heap_mb:5.1f}MB)  "
+              "time {seconds:5.2f}s  bytes sent {bytes_sent}".format(
+                  **result))
+    return results
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--child"]:
+        child(sys.argv[2], sys.argv[3], "--trace" in sys.argv)
+    else:
+        run(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
@@ -0,0 +1,99 @@
+"""
+
+   Transfer size and time of receiving configurations in each wire format
+
+   Run from the directory containing this component:
+       python -m <component>.benchmarks.bench_wire_format [blocks ...]
+
+   Each configuration is received as the component would, through
+   DeploymentProxy.get_configuration, and decoded into a dict. Formats whose
+   packages are not installed (msgpack, cbor2, zstd) are skipped.
+
+"""
+import json
+import statistics
+import sys
+import time
+from unittest.mock import Mock
+
+from ..proxy import DeploymentProxy
+from ..wire import ACCEPT_ENCODING, CBOR, DECODERS, JSON, MSGPACK
+from .configurations import synthetic_configuration
+from .stub_api import StubProductAPI
+
+# (name, media type, content encoding)
+FORMATS = (
+    ("json", JSON, None),
+    ("json+gzip", JSON, "gzip"),
+    ("json+zstd", JSON, "zstd"),
+    ("msgpack", MSGPACK, None),
+    ("msgpack+zstd", MSGPACK, "zstd"),
+    ("cbor", CBOR, None),
+    ("cbor+zstd", CBOR, "zstd"),
+)
+
+
+def _available(media_type, encoding):
+    return (media_type == JSON or media_type in DECODERS) and \
+        (encoding is None or encoding in ACCEPT_ENCODING)
+
+
+def _receive(proxy):
+    configuration_data = proxy.get_configuration(
+        "config", "version")["configuration_data"]
+    if isinstance(configuration_data, str):
+        configuration_data = json.loads(configuration_data)
+    return configuration_data
+
+
+def run(sizes=(10, 100, 1000, 10000, 50000), repeat=5):
+    results = []
+    for blocks in sizes:
+        configuration = synthetic_configuration(blocks)
+        for name, media_type, encoding in FORMATS:
+            if not _available(media_type, encoding):
+                continue
+            api = StubProductAPI(compress=encoding or False,
+                                 compact=media_type != JSON and media_type)
+            api.add_configuration("config", "version", configuration)
+            api.start()
+            proxy = DeploymentProxy(
+                api.url, Mock(api_key="key", instance_id="instance"),
+                compact_encoding=media_type != JSON)
+            try:
+                # first request encodes the response on the stub
+                _receive(proxy)
+                sent = api.bytes_sent
+                samples = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    _receive(proxy)
+                    samples.append(time.perf_counter() - start)
+            finally:
+                proxy.close()
+                api.stop()
+            results.append({
+                "blocks": blocks,
+                "format": name,
+                "bytes": sent,
+                "ms": statistics.median(samples) * 1000
+            })
+
+    skipped = [name for name, media_type, encoding in FORMATS
+               if not _available(media_type, encoding)]
+    if skipped:
+        print("not available: {}".format(", ".join(skipped)))
+    for blocks in sizes:
+        print("configuration with {} blocks".format(blocks))
+        rows = [result for result in results if result["blocks"] == blocks]
+        for result in rows:
+            print("  {format:<14} {bytes:>12} bytes  "
+                  "receive+decode {ms:9.2f}ms".format(**result))
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        run(tuple(int(arg) for arg in sys.argv[1:]))
+    else:
+        run()
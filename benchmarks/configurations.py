@@ -0,0 +1,54 @@
+"""
+
+   Synthetic configurations used by benchmarks
+
+"""
+
+
+def synthetic_configuration(blocks, blocks_per_service=5, version=0):
+    """ Builds a configuration with given number of blocks
+
+    Every `blocks_per_service` blocks are executed by one service, changing
+    `version` changes the name of the first block only.
+    """
+    configuration = {
+        "blockTypes": {
+            "blocks.logger.Logger": {
+                "name": "Logger",
+                "properties": {"log_level": {"default": "INFO"}}
+            }
+        },
+        "blocks": {},
+        "services": {}
+    }
+    for index in range(blocks):
+        block_id = "block_{}".format(index)
+        configuration["blocks"][block_id] = {
+            "id": block_id,
+            "name": "Block {}".format(index),
+            "type": "blocks.logger.Logger",
+            "log_level": "INFO",
+            "log_at": "{{ $timestamp }}",
+            "version": "1.0.0",
+            "properties": {"enabled": True, "count": index, "ratio": 0.5}
+        }
+    if blocks:
+        configuration["blocks"]["block_0"]["name"] = \
+            "Block 0 v{}".format(version)
+    block_ids = list(configuration["blocks"])
+    for index in range(0, blocks, blocks_per_service):
+        service_id = "service_{}".format(index // blocks_per_service)
+        execution = block_ids[index:index + blocks_per_service]
+        configuration["services"][service_id] = {
+            "id": service_id,
+            "name": service_id,
+            "auto_start": True,
+            "execution": [
+                {"id": block_id,
+                 "receivers": {"__default_terminal_value": [
+                     {"id": receiver, "input": "__default_terminal_value"}
+                     for receiver in execution[position + 1:position + 2]]}}
+                for position, block_id in enumerate(execution)
+            ]
+        }
+    return configuration
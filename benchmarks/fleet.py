@@ -0,0 +1,474 @@
+"""
+
+   Fleet simulation, many DeploymentManager instances polling a local stub
+   of the Product API from one process
+
+   Run from the directory containing this component:
+       python -m <component>.benchmarks.fleet [--instances 100]
+           [--duration 30] [--poll-interval 2] [--blocks 500] [--json]
+
+   Every instance runs the actual DeploymentManager, with its own proxy,
+   executor, outbox and cache, against a FakeConfigurationManager. Polls
+   are run by a FleetScheduler standing in for nio's scheduler, settings
+   are provided by FleetSettings and nothing is persisted.
+
+   Measured are the poll request rate, deployment latency percentiles from
+   a version being made desired until its success or failure is reported,
+   apply latency from acceptance until then, memory held per instance once
+   deployed and bytes sent by the API.
+
+"""
+import argparse
+import heapq
+import itertools
+import json
+import logging
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from unittest.mock import patch
+
+from niocore.core.context import CoreContext
+
+from ..diff import SECTIONS
+from ..manager import DeploymentManager
+from ..outbox import ReportOutbox
+from ..state import DeploymentState
+from .configurations import synthetic_configuration
+from .stub_api import StubProductAPI
+
+
+class FakeConfigurationManager(object):
+    """ Stand-in for the core ConfigurationManager and ServiceManager
+
+    Args:
+        update_time (float): seconds each update takes
+        object_time (float): additional seconds per object handed over
+        error_rate (float): share of objects failing to be installed
+        rand (callable): provides random numbers in [0, 1)
+        service_time (float): seconds restarting a service takes, half of
+            it stopping and half starting it
+    """
+
+    def __init__(self, update_time=0.0, object_time=0.0, error_rate=0.0,
+                 rand=random.random, service_time=0.0):
+        super().__init__()
+        self._update_time = update_time
+        self._object_time = object_time
+        self._error_rate = error_rate
+        self._rand = rand
+        self._service_time = service_time
+        self.updates = 0
+
+    def update(self, configuration, start_stop_services, delete_missing):
+        result = {}
+        count = 0
+        for section in SECTIONS:
+            objects = configuration.get(section) or {}
+            count += len(objects)
+            errors = [obj for obj in objects.values()
+                      if self._error_rate and self._rand() < self._error_rate]
+            result[section] = {
+                "added": [object_id for object_id in objects],
+                "error": errors
+            }
+        if start_stop_services:
+            # services handed over are restarted one after another
+            restart_time = len(configuration.get("services") or {}) * \
+                self._service_time
+        else:
+            restart_time = 0
+        time.sleep(self._update_time + count * self._object_time +
+                   restart_time)
+        self.updates += 1
+        return result
+
+    def start_service(self, service_id):
+        time.sleep(self._service_time / 2)
+
+    def stop_service(self, service_id):
+        time.sleep(self._service_time / 2)
+
+
+class FleetSettings(object):
+    """ Settings stand-in providing component settings from a dict """
+
+    def __init__(self, values):
+        super().__init__()
+        self._values = values
+
+    def get(self, section, option, fallback=None):
+        return self._values.get(option, fallback)
+
+    getint = getfloat = getboolean = get
+
+
+class _NullPersistence(object):
+    """ Persistence stand-in, instances share a process so nothing is kept
+    """
+
+    def save(self, value, key):
+        pass
+
+    def load(self, key, default=None):
+        return default
+
+
+class FleetScheduler(object):
+    """ Runs the jobs of all instances from one timer thread and a pool
+
+    Provides `job` with the signature of nio's Job
+    """
+
+    def __init__(self, workers=32):
+        super().__init__()
+        self._jobs = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._pool = ThreadPoolExecutor(workers)
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def job(self, target, delta, repeatable, *args, **kwargs):
+        job = _FleetJob(self, target, delta.total_seconds(), repeatable,
+                        args, kwargs)
+        self.add(job)
+        return job
+
+    def add(self, job):
+        with self._condition:
+            heapq.heappush(self._jobs, (time.monotonic() + job.interval,
+                                        next(self._sequence), job))
+            self._condition.notify()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._pool.shutdown(wait=True)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped and (
+                        not self._jobs or
+                        self._jobs[0][0] > time.monotonic()):
+                    self._condition.wait(
+                        self._jobs[0][0] - time.monotonic()
+                        if self._jobs else None)
+                if self._stopped:
+                    return
+                _, _, job = heapq.heappop(self._jobs)
+            if not job.cancelled:
+                self._pool.submit(job.run)
+
+
+class _FleetJob(object):
+
+    def __init__(self, scheduler, target, interval, repeatable, args,
+                 kwargs):
+        super().__init__()
+        self._scheduler = scheduler
+        self._target = target
+        self.interval = interval
+        self._repeatable = repeatable
+        self._args = args
+        self._kwargs = kwargs
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        try:
+            self._target(*self._args, **self._kwargs)
+        finally:
+            if self._repeatable and not self.cancelled:
+                self._scheduler.add(self)
+
+
+class _RESTManager(object):
+
+    def add_web_handler(self, handler):
+        pass
+
+    def remove_web_handler(self, handler):
+        pass
+
+
+class _APIKeyManager(object):
+
+    def __init__(self, instance_id):
+        super().__init__()
+        self.api_key = "key-{}".format(instance_id)
+        self.instance_id = instance_id
+
+
+class FleetSimulation(object):
+    """ Runs a fleet of DeploymentManager instances against a stub API
+
+    Args:
+        instances (int): number of instances
+        blocks (int): blocks of the deployed configuration
+        poll_interval (float): seconds between polls of each instance
+        settings (dict): component settings overriding the defaults
+        configuration_manager (dict): FakeConfigurationManager arguments
+        workers (int): threads running polls
+        compress (bool): whether the stub API gzips configurations
+        patches (bool): whether the stub API provides JSON patches
+        fingerprints (bool): whether the stub API provides fingerprints of
+            desired configurations
+    """
+
+    def __init__(self, instances=100, blocks=500, poll_interval=2,
+                 settings=None, configuration_manager=None, workers=32,
+                 compress=False, patches=True, fingerprints=True):
+        super().__init__()
+        self._instances = instances
+        self._blocks = blocks
+        self._poll_interval = poll_interval
+        self._settings = settings or {}
+        self._configuration_manager = configuration_manager or {}
+        self._workers = workers
+        self._compress = compress
+        self._patches = patches
+        self._fingerprints = fingerprints
+
+        self._lock = threading.Lock()
+        self._desired_at = {}
+        self._accepted_at = {}
+        self._latencies = []
+        self._apply_latencies = []
+        self._failures = 0
+
+    def run(self, duration=30, rollouts=2):
+        """ Deploys a first version then `rollouts` more over `duration`
+
+        Returns:
+            results (dict)
+        """
+        api = StubProductAPI(compress=self._compress,
+                             patches=self._patches,
+                             fingerprints=self._fingerprints).start()
+        api.on_report = self._on_report
+        for version in range(rollouts + 1):
+            api.add_configuration(
+                "config", "v{}".format(version),
+                synthetic_configuration(self._blocks, version=version))
+            # encoded responses are kept by the stub, not the instances
+            api._configuration_body("config", "v{}".format(version))
+        scheduler = FleetScheduler(self._workers)
+        cache_dir = tempfile.TemporaryDirectory()
+        managers = []
+        results = {"instances": self._instances, "blocks": self._blocks,
+                   "poll_interval": self._poll_interval}
+        try:
+            with ExitStack() as stack:
+                module = DeploymentManager.__module__
+                stack.enter_context(patch(module + ".Job", scheduler.job))
+                stack.enter_context(patch(
+                    DeploymentState.__module__ + ".Persistence",
+                    _NullPersistence))
+                stack.enter_context(patch(
+                    ReportOutbox.__module__ + ".Persistence",
+                    _NullPersistence))
+
+                try:
+                    self._run(api, managers, cache_dir.name, duration,
+                              rollouts, results)
+                finally:
+                    for manager in managers:
+                        manager.stop()
+        finally:
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+            scheduler.stop()
+            api.stop()
+            cache_dir.cleanup()
+        return results
+
+    def _run(self, api, managers, cache_dir, duration, rollouts, results):
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        self._rollout(api, 0)
+        for index in range(self._instances):
+            managers.append(self._start_instance(api, index, cache_dir))
+        self._wait(timeout=max(60, duration))
+        results["memory_per_instance"] = \
+            (tracemalloc.get_traced_memory()[0] - baseline) / self._instances
+        tracemalloc.stop()
+
+        # steady state, measured once first version is deployed
+        with self._lock:
+            self._latencies.clear()
+            self._apply_latencies.clear()
+            self._failures = 0
+        routes = dict(api.routes)
+        bytes_sent = api.bytes_sent
+        start = time.monotonic()
+        for version in range(1, rollouts + 1):
+            time.sleep(duration / (rollouts + 1))
+            self._rollout(api, version)
+        time.sleep(duration / (rollouts + 1))
+        self._wait(timeout=duration)
+        elapsed = time.monotonic() - start
+
+        results["duration"] = elapsed
+        results["requests"] = {route: count - routes.get(route, 0)
+                               for route, count in api.routes.items()}
+        results["poll_rate"] = results["requests"].get("poll", 0) / elapsed
+        results["bytes_sent"] = api.bytes_sent - bytes_sent
+        results["bytes_per_deployment"] = \
+            results["bytes_sent"] / max(self._instances * rollouts, 1)
+        with self._lock:
+            results["deployments"] = len(self._latencies)
+            results["pending"] = len(self._desired_at)
+            results["failures"] = self._failures
+            results["deployment_latency"] = _percentiles(self._latencies)
+            results["apply_latency"] = _percentiles(self._apply_latencies)
+
+    def _start_instance(self, api, index, cache_dir):
+        instance_id = "instance-{}".format(index)
+        settings = {
+            "config_api_url_prefix": api.url,
+            "config_poll_interval": self._poll_interval,
+            "config_cache_dir": "{}/{}".format(cache_dir, instance_id)
+        }
+        settings.update(self._settings)
+        configuration_manager = FakeConfigurationManager(
+            **self._configuration_manager)
+        dependencies = {
+            "RESTManager": _RESTManager(),
+            "ConfigurationManager": configuration_manager,
+            "ServiceManager": configuration_manager,
+            "APIKeyManager": _APIKeyManager(instance_id)
+        }
+        manager = DeploymentManager()
+        manager.get_dependency = dependencies.get
+        with patch(DeploymentManager.__module__ + ".Settings",
+                   FleetSettings(settings)):
+            manager.configure(CoreContext([], []))
+        manager.start()
+        return manager
+
+    def _rollout(self, api, version):
+        now = time.monotonic()
+        for index in range(self._instances):
+            deployment_id = "deployment-{}-{}".format(version, index)
+            with self._lock:
+                self._desired_at[deployment_id] = now
+            api.set_desired("instance-{}".format(index), "config",
+                            "v{}".format(version), deployment_id)
+
+    def _on_report(self, body):
+        now = time.monotonic()
+        deployment_id = body.get("deployment_id")
+        with self._lock:
+            if body.get("status") == "accepted":
+                self._accepted_at[deployment_id] = now
+            elif body.get("status") in ("success", "failure") and \
+                    deployment_id in self._desired_at:
+                self._latencies.append(
+                    now - self._desired_at.pop(deployment_id))
+                if deployment_id in self._accepted_at:
+                    self._apply_latencies.append(
+                        now - self._accepted_at.pop(deployment_id))
+                if body["status"] == "failure":
+                    self._failures += 1
+
+    def _wait(self, timeout):
+        """ Waits for all desired versions to be deployed """
+        end = time.monotonic() + timeout
+        while time.monotonic() < end:
+            with self._lock:
+                if not self._desired_at:
+                    return True
+            time.sleep(0.05)
+        return False
+
+
+def _percentiles(samples):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return {
+        "p50": samples[len(samples) // 2],
+        "p90": samples[max(int(len(samples) * 0.9) - 1, 0)],
+        "p99": samples[max(int(len(samples) * 0.99) - 1, 0)],
+        "max": samples[-1]
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--instances", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--rollouts", type=int, default=2)
+    parser.add_argument("--poll-interval", type=float, default=2)
+    parser.add_argument("--blocks", type=int, default=500)
+    parser.add_argument("--update-time", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--service-time", type=float, default=0.0,
+                        help="seconds restarting a service takes")
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--compress", action="store_true")
+    parser.add_argument("--no-patches", action="store_true")
+    parser.add_argument("--no-fingerprints", action="store_true")
+    parser.add_argument("--setting", action="append", default=[],
+                        metavar="NAME=JSON",
+                        help="component setting, e.g. config_poll_wait=20")
+    parser.add_argument("--json", action="store_true",
+                        help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    settings = {}
+    for setting in args.setting:
+        name, value = setting.split("=", 1)
+        settings[name] = json.loads(value)
+    # deployments of every instance are logged otherwise
+    logging.disable(logging.INFO)
+    results = FleetSimulation(
+        instances=args.instances,
+        blocks=args.blocks,
+        poll_interval=args.poll_interval,
+        settings=settings,
+        configuration_manager={"update_time": args.update_time,
+                               "error_rate": args.error_rate,
+                               "service_time": args.service_time},
+        workers=args.workers,
+        compress=args.compress,
+        patches=not args.no_patches,
+        fingerprints=not args.no_fingerprints).run(
+            args.duration, args.rollouts)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return results
+    print("{instances} instances, {blocks} blocks, polling every "
+          "{poll_interval}s for {duration:.1f}s".format(**results))
+    print("poll rate            {:.1f}/s".format(results["poll_rate"]))
+    print("requests             {}".format(results["requests"]))
+    print("deployments          {deployments} ({failures} failed, {pending} "
+          "pending)".format(**results))
+    for name in ("deployment_latency", "apply_latency"):
+        stats = results[name]
+        if stats:
+            print("{:<20} p50 {:.3f}s  p90 {:.3f}s  p99 {:.3f}s  max "
+                  "{:.3f}s".format(name.replace("_", " "), stats["p50"],
+                                   stats["p90"], stats["p99"],
+                                   stats["max"]))
+    print("memory per instance  {:.1f}KB".format(
+        results["memory_per_instance"] / 1024))
+    print("bytes sent           {} ({:.0f} per deployment)".format(
+        results["bytes_sent"], results["bytes_per_deployment"]))
+    return results
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
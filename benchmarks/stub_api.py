@@ -0,0 +1,427 @@
+"""
+
+   Local stub of the Product API used by benchmarks
+
+"""
+import hashlib
+import json
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from ..patch import checksum
+from ..proxy import desired_fingerprint
+from ..wire import ENCODERS, JSON, compress as compress_body, zstd
+
+
+class StubProductAPI(object):
+    """ In-process HTTP server answering the Product API routes used by
+    DeploymentProxy
+
+    Desired configuration ids are set per instance through
+    `set_desired`, configurations are registered with
+    `add_configuration`. Every request is counted so callers can derive
+    request rates and bytes transferred. Setting `status_override` answers
+    every request with that status, e.g. to simulate an outage. With
+    `patches` JSON Patch requests between registered versions are answered,
+    with `fingerprints` HEAD requests for the desired configuration are
+    answered with its fingerprint, HEAD requests for a configuration
+    version with its checksum. Desired configuration ids of several
+    instances are answered at once by `instances/configurations?ids=a,b`.
+    Deployment events are streamed by `instances/{id}/events` as
+    Server-Sent Events. Configurations are compressed with `compress`,
+    True for the best encoding accepted ("zstd" or "gzip") or the name of
+    one, and sent in a compact encoding accepted with `compact`, True or
+    the media type of one, see `wire`.
+    `on_report`, when set, is invoked with each reported status body.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, compress=False,
+                 patches=False, fingerprints=False, compact=False):
+        self._desired = {}
+        self._configurations = {}
+        self._bodies = {}
+        self._compress = compress
+        self._patches = patches
+        self._fingerprints = fingerprints
+        self._compact = compact
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self.status_override = None
+        self.requests = 0
+        self.bytes_sent = 0
+        # requests per route: poll, configuration, patch, report,
+        # fingerprint, checksum, events, other
+        self.routes = Counter()
+        self.reported = []
+        self.on_report = None
+        self.connections = 0
+        # seconds between keep-alive comments of event streams
+        self.push_keepalive = 15
+        self._event_ids = Counter()
+        self._push_generation = 0
+        self._closed = False
+
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._lock:
+            self._closed = True
+            self._changed.notify_all()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def set_desired(self, instance_id, config_id, config_version_id,
+                    deployment_id):
+        with self._lock:
+            self._desired[instance_id] = {
+                "instance_configuration_id": config_id,
+                "instance_configuration_version_id": config_version_id,
+                "deployment_id": deployment_id
+            }
+            self._event_ids[instance_id] += 1
+            self._changed.notify_all()
+
+    def disconnect_push(self):
+        """ Ends open event streams, as a dropped connection would """
+        with self._lock:
+            self._push_generation += 1
+            self._changed.notify_all()
+
+    def add_configuration(self, config_id, config_version_id,
+                          configuration_data):
+        with self._lock:
+            self._configurations[(config_id, config_version_id)] = \
+                configuration_data
+            self._bodies = {key: body for key, body in self._bodies.items()
+                            if key[:2] != (config_id, config_version_id)}
+
+    def _configuration_body(self, config_id, config_version_id,
+                            media_type=JSON, encoding=None):
+        """ Provides encoded configuration response, kept for next requests
+        """
+        key = (config_id, config_version_id, media_type, encoding)
+        with self._lock:
+            if key not in self._bodies:
+                data = self._configurations.get(key[:2])
+                if data is None:
+                    return None
+                envelope = {
+                    "message": "Found Instance Configuration",
+                    "status": 200,
+                    "uuid": config_version_id,
+                }
+                if media_type == JSON:
+                    envelope["configuration_data"] = json.dumps(data)
+                    body = json.dumps(envelope).encode()
+                else:
+                    envelope["configuration_data"] = data
+                    body = ENCODERS[media_type](envelope)
+                if encoding:
+                    body = compress_body(body, encoding)
+                self._bodies[key] = body
+            return self._bodies[key]
+
+    def _negotiate(self, headers):
+        """ Provides media type and content encoding of a configuration
+        response, as accepted by the request and enabled
+        """
+        accept = headers.get("accept", "")
+        media_type = JSON
+        for compact in ENCODERS:
+            if self._compact in (True, compact) and compact in accept:
+                media_type = compact
+                break
+        accept_encoding = headers.get("accept-encoding", "")
+        encoding = None
+        for name in ("zstd", "gzip"):
+            if self._compress in (True, name) and \
+                    name in accept_encoding and \
+                    (name != "zstd" or zstd is not None):
+                encoding = name
+                break
+        return media_type, encoding
+
+    def handle_get(self, path, headers, query=None):
+        """ Returns (status, headers, body) for a GET request """
+        query = query or {}
+        if self.status_override:
+            return self.status_override, {}, {"message": "Overridden"}
+        parts = path.strip("/").split("/")
+        if len(parts) >= 2 and parts[-2] == "instances" and \
+                parts[-1] == "configurations":
+            instance_ids = query.get("ids", [""])[0].split(",")
+            with self._lock:
+                return 200, {}, {"instances": {
+                    instance_id: self._desired.get(instance_id)
+                    for instance_id in instance_ids if instance_id}}
+        if len(parts) >= 5 and parts[-5] == "instance_configurations" and \
+                parts[-3] == "versions" and parts[-1] == "patch":
+            return self._patch(parts[-4], query.get("from", [None])[0],
+                               parts[-2])
+        if len(parts) >= 3 and parts[-3] == "instances" and \
+                parts[-1] == "configuration":
+            return self._instance_configuration(
+                parts[-2], headers, float(query.get("wait", [0])[0]))
+        if len(parts) >= 4 and parts[-4] == "instance_configurations" and \
+                parts[-2] == "versions":
+            media_type, encoding = self._negotiate(headers)
+            body = self._configuration_body(
+                parts[-3], parts[-1], media_type, encoding)
+            if body is None:
+                return 404, {}, {"message": "Configuration not found"}
+            response_headers = {"Content-Type": media_type}
+            if encoding:
+                response_headers["Content-Encoding"] = encoding
+            return 200, response_headers, body
+        return 404, {}, {"message": "Not found"}
+
+    def handle_head(self, path, headers):
+        """ Returns (status, headers) for a HEAD request """
+        if self.status_override:
+            return self.status_override, {}
+        parts = path.strip("/").split("/")
+        if len(parts) >= 3 and parts[-3] == "instances" and \
+                parts[-1] == "configuration":
+            with self._lock:
+                desired = self._desired.get(parts[-2])
+            if desired is None:
+                return 404, {}
+            response_headers = {"ETag": self._etag(desired)}
+            if self._fingerprints:
+                response_headers["X-Configuration-Fingerprint"] = \
+                    desired_fingerprint(
+                        desired["instance_configuration_id"],
+                        desired["instance_configuration_version_id"],
+                        desired["deployment_id"],
+                        desired.get("staged_configuration_id"),
+                        desired.get("staged_configuration_version_id"))
+            return 200, response_headers
+        if len(parts) >= 4 and parts[-4] == "instance_configurations" and \
+                parts[-2] == "versions":
+            with self._lock:
+                data = self._configurations.get((parts[-3], parts[-1]))
+            if data is None:
+                return 404, {}
+            return 200, {"X-Configuration-Checksum": checksum(data)}
+        return 404, {}
+
+    def events(self, instance_id, last_event_id=None):
+        """ Yields the pieces of an instance's deployment event stream
+
+        The desired configuration ids are sent when connecting unless the
+        last event received was the latest one, then each time they change.
+        The stream ends when the stub stops or `disconnect_push` is called.
+        """
+        with self._lock:
+            generation = self._push_generation
+        sent = last_event_id
+        while True:
+            with self._lock:
+                def pending():
+                    return self._closed or \
+                        self._push_generation != generation or \
+                        (instance_id in self._desired and
+                         str(self._event_ids[instance_id]) != sent)
+                if not self._changed.wait_for(pending, self.push_keepalive):
+                    piece = ": keep-alive\n\n"
+                elif self._closed or self._push_generation != generation:
+                    return
+                else:
+                    sent = str(self._event_ids[instance_id])
+                    piece = "id: {}\nevent: deployment\ndata: {}\n\n".format(
+                        sent, json.dumps(self._desired[instance_id]))
+            yield piece
+
+    def _patch(self, config_id, from_version_id, to_version_id):
+        """ Answers a JSON Patch between versions when patches are enabled
+        """
+        with self._lock:
+            source = self._configurations.get((config_id, from_version_id))
+            target = self._configurations.get((config_id, to_version_id))
+        if not self._patches or source is None or target is None:
+            return 404, {}, {"message": "Patch not available"}
+        return 200, {}, {
+            "patch": self._diff(source, target),
+            "checksum": checksum(target)
+        }
+
+    @staticmethod
+    def _diff(source, target):
+        """ Builds patch operations, replacing objects within sections """
+        def pointer(*tokens):
+            return "".join("/" + token.replace("~", "~0").replace("/", "~1")
+                           for token in tokens)
+
+        operations = []
+        for key in source:
+            if key not in target:
+                operations.append({"op": "remove", "path": pointer(key)})
+        for key, value in target.items():
+            if key not in source:
+                operations.append(
+                    {"op": "add", "path": pointer(key), "value": value})
+            elif isinstance(value, dict) and isinstance(source[key], dict):
+                for name in source[key]:
+                    if name not in value:
+                        operations.append(
+                            {"op": "remove", "path": pointer(key, name)})
+                for name, obj in value.items():
+                    if name not in source[key] or \
+                       source[key][name] != obj:
+                        operations.append({"op": "add",
+                                           "path": pointer(key, name),
+                                           "value": obj})
+            elif value != source[key]:
+                operations.append(
+                    {"op": "replace", "path": pointer(key), "value": value})
+        return operations
+
+    def _instance_configuration(self, instance_id, headers, wait):
+        with self._lock:
+            desired = self._desired.get(instance_id)
+            etag = self._etag(desired)
+            if wait and headers.get("if-none-match") == etag:
+                # long-poll, hold request until desired configuration
+                # changes or wait expires
+                self._changed.wait_for(
+                    lambda: self._etag(self._desired.get(instance_id)) !=
+                    etag, wait)
+                desired = self._desired.get(instance_id)
+                etag = self._etag(desired)
+        if desired is None:
+            return 404, {}, {"message": "No desired configuration"}
+        if headers.get("if-none-match") == etag:
+            return 304, {"ETag": etag}, b""
+        return 200, {"ETag": etag}, desired
+
+    @staticmethod
+    def _etag(desired):
+        return '"{}"'.format(hashlib.sha1(json.dumps(
+            desired, sort_keys=True).encode()).hexdigest())
+
+    def handle_post(self, path, headers, body):
+        """ Returns (status, headers, body) for a POST request """
+        if self.status_override:
+            return self.status_override, {}, {"message": "Overridden"}
+        with self._lock:
+            self.reported.append(body)
+        if self.on_report:
+            self.on_report(body)
+        return 200, {}, {"message": "Reported"}
+
+    @staticmethod
+    def _route(method, path):
+        parts = urlparse(path).path.strip("/").split("/")
+        if method == "POST":
+            return "report"
+        if parts[-1] == "events":
+            return "events"
+        if method == "HEAD":
+            if len(parts) >= 4 and parts[-4] == "instance_configurations":
+                return "checksum"
+            return "fingerprint"
+        if parts[-1] == "patch":
+            return "patch"
+        if len(parts) >= 3 and parts[-3] == "instances" or \
+                len(parts) >= 2 and parts[-2] == "instances":
+            return "poll"
+        if len(parts) >= 4 and parts[-4] == "instance_configurations":
+            return "configuration"
+        return "other"
+
+    def _count(self, route, sent):
+        with self._lock:
+            self.requests += 1
+            self.routes[route] += 1
+            self.bytes_sent += sent
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with api._lock:
+                    api.connections += 1
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if api._route(self.command, self.path) == "events" and \
+                        not api.status_override:
+                    return self._stream(url.path.strip("/").split("/")[-2])
+                self._respond(*api.handle_get(
+                    url.path, self.headers, parse_qs(url.query)))
+
+            def do_HEAD(self):
+                status, headers = api.handle_head(
+                    urlparse(self.path).path, self.headers)
+                self._respond(status, headers, b"")
+
+            def do_POST(self):
+                length = int(self.headers.get("content-length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                self._respond(*api.handle_post(
+                    urlparse(self.path).path, self.headers, body))
+
+            def _respond(self, status, headers, body):
+                if isinstance(body, (dict, list)):
+                    body = json.dumps(body).encode()
+                headers.setdefault("Content-Type", "application/json")
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                if self.close_connection:
+                    # as asked by the client
+                    self.send_header("Connection", "close")
+                # counted before sending so that a client having received
+                # the response finds it counted, headers are sent by
+                # end_headers
+                api._count(api._route(self.command, self.path), len(body))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(body)
+
+            def _stream(self, instance_id):
+                """ Sends an event stream, chunked """
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                api._count("events", 0)
+                self.close_connection = True
+                try:
+                    for piece in api.events(
+                            instance_id, self.headers.get("last-event-id")):
+                        data = piece.encode()
+                        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                        self.wfile.flush()
+                        with api._lock:
+                            api.bytes_sent += len(data)
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,196 @@
+"""
+
+   Deployment configuration cache
+
+"""
+import hashlib
+import os
+import threading
+
+from nio.util.logging import get_nio_logger
+
+
+class ConfigurationCache(object):
+    """ On-disk cache of downloaded instance configurations
+
+    Entries are keyed by (config_id, config_version_id) and hold the raw
+    `configuration_data` text in a data file next to a checksum file, an
+    entry whose content does not match its checksum is discarded. Once the
+    total size of all entries exceeds `max_bytes` the least recently used
+    entries are evicted, except the pinned one, the running configuration.
+    """
+
+    def __init__(self, path, max_bytes):
+        super().__init__()
+        self.logger = get_nio_logger("DeploymentManager")
+
+        self._path = path
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._pinned = None
+
+    def get(self, config_id, config_version_id):
+        """ Retrieves a cached configuration
+
+        Args:
+            config_id (str): instance configuration id
+            config_version_id (str): instance configuration version id
+
+        Returns:
+            configuration_data (str) or None when not cached
+        """
+        file_name = self._file_name(config_id, config_version_id)
+        with self._lock:
+            try:
+                with open(file_name + ".sha256", encoding="utf-8") as f:
+                    checksum = f.read().strip()
+                with open(file_name, encoding="utf-8", newline="") as f:
+                    configuration_data = f.read()
+            except FileNotFoundError:
+                self._remove(file_name)
+                return None
+            except (OSError, ValueError):
+                self.logger.exception(
+                    "Discarding unreadable cache entry: {}".format(file_name))
+                self._remove(file_name)
+                return None
+
+            if checksum != self.checksum(configuration_data):
+                self.logger.warning(
+                    "Discarding corrupted cache entry: {}".format(file_name))
+                self._remove(file_name)
+                return None
+            # mark entry as most recently used
+            os.utime(file_name)
+            return configuration_data
+
+    def put(self, config_id, config_version_id, configuration_data):
+        """ Stores a configuration and evicts least recently used entries
+
+        Args:
+            config_id (str): instance configuration id
+            config_version_id (str): instance configuration version id
+            configuration_data (str): configuration as received
+        """
+        writer = self.writer(config_id, config_version_id)
+        writer.write(configuration_data)
+        writer.commit()
+
+    def pin(self, config_id, config_version_id):
+        """ Keeps a configuration from being evicted, in place of the one
+        pinned before
+        """
+        with self._lock:
+            self._pinned = self._file_name(config_id, config_version_id)
+
+    def writer(self, config_id, config_version_id):
+        """ Provides a writer storing a configuration received in pieces
+
+        Nothing is stored until the writer is committed
+        """
+        return _CacheWriter(
+            self, self._file_name(config_id, config_version_id))
+
+    @staticmethod
+    def checksum(configuration_data):
+        return hashlib.sha256(configuration_data.encode()).hexdigest()
+
+    def _commit(self, file_name, tmp_file_name, checksum):
+        with self._lock:
+            with open(file_name + ".sha256", "w", encoding="utf-8") as f:
+                f.write(checksum)
+            os.replace(tmp_file_name, file_name)
+            self._evict()
+
+    def _file_name(self, config_id, config_version_id):
+        key = "{}/{}".format(config_id, config_version_id)
+        return os.path.join(
+            self._path,
+            "{}.json".format(hashlib.sha256(key.encode()).hexdigest()))
+
+    def _evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self._path):
+            if not name.endswith(".json"):
+                continue
+            file_name = os.path.join(self._path, name)
+            try:
+                stat = os.stat(file_name)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, file_name))
+            total += stat.st_size
+
+        # oldest entries first, always keep the most recent entry
+        entries.sort()
+        for _, size, file_name in entries[:-1]:
+            if total <= self._max_bytes:
+                break
+            if file_name == self._pinned:
+                continue
+            self.logger.debug("Evicting cache entry: {}".format(file_name))
+            self._remove(file_name)
+            total -= size
+
+    def _remove(self, file_name):
+        for name in (file_name, file_name + ".sha256"):
+            try:
+                os.remove(name)
+            except OSError:
+                pass
+
+
+class _CacheWriter(object):
+    """ Writes a cache entry as its pieces are received
+
+    Failing to write only disables caching of the entry
+    """
+
+    def __init__(self, cache, file_name):
+        super().__init__()
+        self._cache = cache
+        self._file_name = file_name
+        self._tmp_file_name = "{}.{}.tmp".format(
+            file_name, threading.get_ident())
+        self._checksum = hashlib.sha256()
+        self._file = None
+        self._failed = False
+
+    def write(self, text):
+        if self._failed:
+            return
+        try:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self._file_name), exist_ok=True)
+                self._file = open(self._tmp_file_name, "w", encoding="utf-8",
+                                  newline="")
+            self._file.write(text)
+            self._checksum.update(text.encode())
+        except OSError:
+            self._cache.logger.exception("Failed to cache configuration")
+            self.discard()
+            self._failed = True
+
+    def commit(self):
+        if self._failed:
+            return
+        try:
+            if self._file is None:
+                self.write("")
+                if self._failed:
+                    return
+            self._file.close()
+            self._cache._commit(self._file_name, self._tmp_file_name,
+                                self._checksum.hexdigest())
+        except OSError:
+            self._cache.logger.exception("Failed to cache configuration")
+            self.discard()
+
+    def discard(self):
+        if self._file is not None:
+            self._file.close()
+        try:
+            os.remove(self._tmp_file_name)
+        except OSError:
+            pass
@@ -0,0 +1,139 @@
+"""
+
+   Configuration diffing
+
+"""
+import hashlib
+import json
+
+# configuration sections holding objects keyed by id
+SECTIONS = ("blockTypes", "blocks", "services")
+
+
+def fingerprint(obj):
+    """ Provides a stable hash of a configuration object """
+    return hashlib.sha1(json.dumps(
+        obj, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+def configuration_fingerprints(configuration_data):
+    """ Provides fingerprints of configuration objects
+
+    Returns:
+        fingerprints (dict): as {section: {id: fingerprint}}
+    """
+    return {section: {key: fingerprint(value) for key, value in
+                      (configuration_data.get(section) or {}).items()}
+            for section in SECTIONS}
+
+
+def service_blocks(service, blocks):
+    """ Provides ids of blocks a service executes
+
+    Execution entries may reference a block by id or by name
+
+    Args:
+        service (dict): service configuration
+        blocks (dict): blocks configuration keyed by id
+
+    Returns:
+        set of block ids
+    """
+    names = {block.get("name"): block_id
+             for block_id, block in blocks.items()
+             if isinstance(block, dict) and block.get("name")}
+    block_ids = set()
+    for entry in service.get("execution") or []:
+        if not isinstance(entry, dict):
+            continue
+        for ref in (entry.get("id"), entry.get("name")):
+            if ref in blocks:
+                block_ids.add(ref)
+            elif ref in names:
+                block_ids.add(names[ref])
+    return block_ids
+
+
+class ConfigurationDiff(object):
+    """ Structural diff of a configuration against the fingerprints of the
+    last applied configuration
+
+    Args:
+        configuration_data (dict): incoming configuration
+        previous (dict): fingerprints of last applied configuration as
+            {section: {id: fingerprint}}, None when unknown
+        fingerprints (dict): optional, fingerprints of incoming
+            configuration when already computed
+    """
+
+    def __init__(self, configuration_data, previous=None, fingerprints=None):
+        self._configuration_data = configuration_data
+        self._previous = previous
+
+        self.fingerprints = fingerprints or \
+            configuration_fingerprints(configuration_data)
+        self.added = {}
+        self.changed = {}
+        self.removed = {}
+        for section in SECTIONS:
+            current = self.fingerprints[section]
+            if previous is None:
+                continue
+            last = previous.get(section, {})
+            self.added[section] = [key for key in current if key not in last]
+            self.changed[section] = [
+                key for key in current
+                if key in last and last[key] != current[key]]
+            self.removed[section] = [key for key in last
+                                     if key not in current]
+
+        # services to be restarted, those whose own definition or the
+        # definition of a block they execute changed
+        services = configuration_data.get("services") or {}
+        if previous is None:
+            self.restart = list(services)
+        else:
+            blocks = configuration_data.get("blocks") or {}
+            changed_blocks = set(self.changed["blocks"])
+            self.restart = [
+                service_id for service_id, service in services.items()
+                if service_id in self.added["services"] or
+                service_id in self.changed["services"] or
+                (isinstance(service, dict) and
+                 service_blocks(service, blocks) & changed_blocks)]
+
+    @property
+    def is_full(self):
+        """ True when there is no previous configuration to diff against """
+        return self._previous is None
+
+    @property
+    def has_removals(self):
+        return any(self.removed.values())
+
+    def count(self, changes):
+        return sum(len(keys) for keys in changes.values())
+
+    def delta(self):
+        """ Provides a configuration holding only added and changed objects
+
+        Entries other than blocks, services and blockTypes are kept as is
+        """
+        if self.is_full:
+            return self._configuration_data
+
+        delta = {}
+        for key, value in self._configuration_data.items():
+            if key not in SECTIONS:
+                delta[key] = value
+                continue
+            value = value or {}
+            object_ids = self.added[key] + self.changed[key]
+            if key == "services":
+                # services executing a changed block are handed over so
+                # that they are restarted
+                object_ids = self.restart
+            delta[key] = {
+                object_id: value[object_id] for object_id in object_ids
+            }
+        return delta
@@ -0,0 +1,111 @@
+"""
+
+   Update result errors
+
+"""
+import json
+from collections import OrderedDict
+
+# error properties identifying the object that failed
+_IDENTIFIERS = ("id", "name")
+
+
+class UpdateErrors(object):
+    """ Aggregates the errors of a ConfigurationManager update result
+
+    Errors are grouped by section (blocks, services, blockTypes) and kind,
+    the kind of an error being its "kind" or "type" property, "error" for
+    other error objects and "message" for errors given as text. Each group
+    keeps its error count and a sample of at most `sample_size` errors.
+    """
+
+    def __init__(self, result, sample_size=5):
+        """ Scans an update result
+
+        Args:
+            result (dict): ConfigurationManager update result
+            sample_size (int): number of errors kept for each group
+        """
+        super().__init__()
+        self.count = 0
+        self._groups = OrderedDict()
+        for section, section_result in result.items():
+            if not isinstance(section_result, dict):
+                continue
+            errors = section_result.get("error")
+            if not errors:
+                continue
+            self.count += len(errors)
+            for error in errors:
+                if isinstance(error, dict):
+                    kind = error.get("kind") or error.get("type") or "error"
+                else:
+                    kind = "message"
+                group = self._groups.get((section, str(kind)))
+                if group is None:
+                    group = self._groups[(section, str(kind))] = {
+                        "section": section,
+                        "kind": str(kind),
+                        "count": 0,
+                        "sample": []
+                    }
+                group["count"] += 1
+                if len(group["sample"]) < sample_size:
+                    group["sample"].append(error)
+
+    def __bool__(self):
+        return self.count > 0
+
+    @property
+    def groups(self):
+        """ Error groups, in the order they were first found
+
+        Returns:
+            list of dicts with format
+                {
+                    "section": "blocks",
+                    "kind": "Counter",
+                    "count": 1000,
+                    "sample": [{"id": "..", "name": "..", ...}, ...]
+                }
+        """
+        return list(self._groups.values())
+
+    def summary(self, max_length=2000):
+        """ Describes errors in a message of at most `max_length` characters
+
+        Example:
+            "1002 errors, blocks Counter (1000): counter1, counter2 (+998),
+            blockTypes message (2): Failed to load dependency for block X,
+            Failed to load dependency for block Y"
+        """
+        parts = ["{} error{}".format(self.count, "" if self.count == 1
+                                     else "s")]
+        length = len(parts[0])
+        groups = self.groups
+        for index, group in enumerate(groups):
+            sample = ", ".join(
+                self._describe(error) for error in group["sample"])
+            if group["count"] > len(group["sample"]):
+                sample += " (+{})".format(
+                    group["count"] - len(group["sample"]))
+            part = "{} {} ({}): {}".format(
+                group["section"], group["kind"], group["count"], sample)
+            # unless last, room is kept to mention the groups left out
+            room = max_length if index == len(groups) - 1 \
+                else max_length - 20
+            if length + 2 + len(part) > room:
+                parts.append("(+{} more)".format(len(groups) - index))
+                break
+            parts.append(part)
+            length += 2 + len(part)
+        return ", ".join(parts)[:max_length]
+
+    @staticmethod
+    def _describe(error, max_length=200):
+        if isinstance(error, dict):
+            for identifier in _IDENTIFIERS:
+                if error.get(identifier):
+                    return str(error[identifier])[:max_length]
+            return json.dumps(error)[:max_length]
+        return str(error)[:max_length]
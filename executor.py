@@ -0,0 +1,123 @@
+"""
+
+   Deployment Executor
+
+"""
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Condition, Thread, current_thread
+
+from nio.util.logging import get_nio_logger
+
+
+class DeploymentExecutor(object):
+    """ Runs deployments one at a time
+
+    Deployments waiting to run are kept per config id, a deployment for a
+    config id which already has one waiting supersedes it: the waiting
+    deployment is dropped and `on_superseded` is invoked for it.
+    """
+
+    def __init__(self, run, on_superseded):
+        """ Create an executor
+
+        Args:
+            run (callable): performs a deployment, invoked with
+                (config_id, config_version_id, deployment_id)
+            on_superseded (callable): invoked with (config_id,
+                config_version_id, deployment_id, superseded_by) for each
+                dropped deployment
+        """
+        super().__init__()
+        self.logger = get_nio_logger("DeploymentManager")
+
+        self._run = run
+        self._on_superseded = on_superseded
+
+        self._pending = OrderedDict()
+        self._running = None
+        self._condition = Condition()
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        self._stopped = False
+        self._thread = Thread(target=self._work, name="DeploymentExecutor",
+                              daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            pending = list(self._pending.values())
+            self._pending.clear()
+            self._condition.notify_all()
+        for _, _, _, future in pending:
+            future.cancel()
+
+    @property
+    def in_worker(self):
+        """ True when called from within a running deployment """
+        return current_thread() is self._thread
+
+    def submit(self, config_id, config_version_id, deployment_id):
+        """ Queues a deployment
+
+        Returns:
+            Future: resolves to the deployment result, or to a dict holding
+                the superseding deployment id under "superseded_by"
+        """
+        superseded = None
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError("Deployment executor is stopped")
+            waiting = self._pending.get(config_id)
+            for deployment in (waiting, self._running):
+                # same deployment is already waiting or running
+                if deployment and deployment[:3] == \
+                   (config_id, config_version_id, deployment_id):
+                    return deployment[3]
+            if waiting:
+                superseded = self._pending.pop(config_id)
+            future = Future()
+            self._pending[config_id] = \
+                (config_id, config_version_id, deployment_id, future)
+            self._condition.notify()
+
+        if superseded:
+            self._supersede(superseded, deployment_id)
+        return future
+
+    def _supersede(self, deployment, superseded_by):
+        config_id, config_version_id, deployment_id, future = deployment
+        self.logger.info(
+            "Deployment {} of config ID {} version {} superseded by "
+            "deployment {}".format(deployment_id, config_id,
+                                   config_version_id, superseded_by))
+        try:
+            self._on_superseded(
+                config_id, config_version_id, deployment_id, superseded_by)
+        except Exception:
+            self.logger.exception("Failed to report superseded deployment")
+        future.set_result({"superseded_by": superseded_by})
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                _, self._running = self._pending.popitem(last=False)
+            config_id, config_version_id, deployment_id, future = \
+                self._running
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(self._run(
+                        config_id, config_version_id, deployment_id))
+                except Exception as e:
+                    self.logger.exception(
+                        "Deployment {} failed".format(deployment_id))
+                    future.set_exception(e)
+            with self._condition:
+                self._running = None
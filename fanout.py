@@ -0,0 +1,228 @@
+"""
+
+   Deployments fanned out to co-located instances
+
+"""
+import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from nio.util.logging import get_nio_logger
+
+
+def fanout_instances(setting):
+    """ Parses the instances configurations are fanned out to
+
+    Args:
+        setting (str): comma separated "instance_id=url" entries, url being
+            the root of the instance REST API, e.g.
+            "a=http://127.0.0.1:8181, b=http://127.0.0.1:8182"
+
+    Returns:
+        instances (OrderedDict): REST API url by instance id
+    """
+    instances = OrderedDict()
+    for entry in (setting or "").split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        instance_id, _, url = entry.partition("=")
+        if not instance_id.strip() or not url.strip():
+            raise ValueError(
+                "Invalid fan-out instance: '{}', expected "
+                "instance_id=url".format(entry))
+        instances[instance_id.strip()] = url.strip().rstrip("/")
+    return instances
+
+
+class FanOut(object):
+    """ Deploys configurations to several co-located instances
+
+    Desired configuration ids of all instances are polled in one request,
+    each distinct configuration version is fetched, decoded and encoded
+    once and handed to every instance that should run it through its local
+    `PUT /config/update` endpoint, configuration included so that instances
+    do not fetch it. Requests to the Product API and memory grow with the
+    number of distinct versions rather than the number of instances.
+
+    Deployments handed over are kept in memory, an instance failing to
+    take a deployment gets it again on next poll. Until an instance reports
+    its deployment succeeded, its `GET /config/deployments/[id]` status is
+    checked on each poll and a deployment that failed or that the instance
+    does not know of is handed over again.
+    """
+
+    def __init__(self, proxy, get_configuration, instances, auth=None,
+                 workers=4, timeout=(10, 60)):
+        """ Create a fan-out
+
+        Args:
+            proxy (DeploymentProxy): Product API proxy
+            get_configuration (callable): provides decoded configuration
+                data given a configuration id and version id
+            instances (dict): REST API url by instance id
+            auth (tuple): optional user and password authenticating
+                requests to the instances
+            workers (int): number of instances handed a deployment at once
+            timeout (tuple): connect and read timeouts of requests to the
+                instances, in seconds
+        """
+        super().__init__()
+        self.logger = get_nio_logger("DeploymentManager")
+
+        self._proxy = proxy
+        self._get_configuration = get_configuration
+        self._instances = instances
+        self._workers = max(workers, 1)
+        self._timeout = timeout
+        # deployment handed over, as (config_id, config_version_id,
+        # deployment_id), and whether the instance reported it succeeded,
+        # by instance id
+        self._deployed = {}
+
+        self._session = requests.Session()
+        self._session.auth = auth
+
+    def close(self):
+        """ Closes connections to the instances """
+        self._session.close()
+
+    def poll(self):
+        """ Checks for the configuration each instance should be running
+        and hands it the new ones
+
+        Returns:
+            results (dict): by instance id, {"status": 200} or
+                {"error": ".."} when the instance failed to take the
+                deployment, None when no instance needed an update
+        """
+        desired = self._get_desired()
+        self._check_deployed(desired)
+        versions = OrderedDict()
+        for instance_id, ids in desired.items():
+            if not ids:
+                continue
+            deployment = _deployment(ids)
+            if self._deployed.get(instance_id, (None,))[0] == deployment:
+                continue
+            versions.setdefault(deployment[:2], []).append(
+                (instance_id, deployment[2]))
+        if not versions:
+            self.logger.debug("No instance configuration changed")
+            return
+
+        results = {}
+        for (config_id, config_version_id), targets in versions.items():
+            self.logger.info(
+                "Deploying config ID {} version {} to {} instances".format(
+                    config_id, config_version_id, len(targets)))
+            try:
+                configuration = json.dumps(self._get_configuration(
+                    config_id, config_version_id)).encode()
+            except Exception as e:
+                self.logger.exception(
+                    "Failed to get config ID {} version {}".format(
+                        config_id, config_version_id))
+                for instance_id, _ in targets:
+                    results[instance_id] = {
+                        "error": str(e) or type(e).__name__}
+                continue
+            with ThreadPoolExecutor(self._workers) as pool:
+                outcomes = pool.map(
+                    lambda target: self._hand_over(
+                        target[0], config_id, config_version_id,
+                        target[1], configuration),
+                    targets)
+                for (instance_id, _), outcome in zip(targets, outcomes):
+                    results[instance_id] = outcome
+        return results
+
+    def _get_desired(self):
+        """ Provides desired configuration ids by instance id, asking for
+        each instance when batched requests are not answered
+        """
+        instance_ids = list(self._instances)
+        desired = self._proxy.get_instances_config_ids(instance_ids)
+        if desired is None:
+            self.logger.debug(
+                "Batched requests not available, polling each instance")
+            desired = {
+                instance_id: self._proxy.get_instance_config_ids(
+                    instance_id=instance_id)
+                for instance_id in instance_ids}
+        return desired
+
+    def _check_deployed(self, desired):
+        """ Asks instances how the desired deployment handed to them went,
+        forgetting failed ones so that they are handed over again
+        """
+        checks = [
+            (instance_id, deployed[0])
+            for instance_id, deployed in self._deployed.items()
+            if not deployed[1] and desired.get(instance_id) and
+            deployed[0] == _deployment(desired[instance_id])]
+        if not checks:
+            return
+        with ThreadPoolExecutor(self._workers) as pool:
+            statuses = list(pool.map(
+                lambda check: self._deployment_status(
+                    check[0], check[1][2]),
+                checks))
+        for (instance_id, deployment), status in zip(checks, statuses):
+            if status == "success":
+                self._deployed[instance_id] = (deployment, True)
+            elif status not in ("started", "accepted", "in_progress"):
+                self.logger.warning(
+                    "Deployment {} of instance {} has status {}, handing it "
+                    "over again".format(deployment[2], instance_id, status))
+                del self._deployed[instance_id]
+
+    def _deployment_status(self, instance_id, deployment_id):
+        """ Provides the status of a deployment on an instance, None when
+        the instance does not know of it or cannot be reached
+        """
+        try:
+            response = self._session.get(
+                "{}/config/deployments/{}".format(
+                    self._instances[instance_id], deployment_id),
+                timeout=self._timeout)
+            response.raise_for_status()
+            return response.json().get("status")
+        except Exception:
+            self.logger.exception(
+                "Failed to get status of deployment {} of instance "
+                "{}".format(deployment_id, instance_id))
+            return None
+
+    def _hand_over(self, instance_id, config_id, config_version_id,
+                   deployment_id, configuration):
+        """ Sends a deployment to an instance, configuration encoded """
+        body = json.dumps({
+            "instance_configuration_id": config_id,
+            "instance_configuration_version_id": config_version_id,
+            "deployment_id": deployment_id
+        })[:-1].encode()
+        body += b', "configuration_data": ' + configuration + b"}"
+        try:
+            response = self._session.put(
+                "{}/config/update".format(self._instances[instance_id]),
+                data=body,
+                headers={"content-type": "application/json"},
+                timeout=self._timeout)
+            response.raise_for_status()
+        except Exception as e:
+            self.logger.exception(
+                "Failed to deploy to instance {}".format(instance_id))
+            return {"error": str(e) or type(e).__name__}
+        self._deployed[instance_id] = (
+            (config_id, config_version_id, deployment_id), False)
+        return {"status": response.status_code}
+
+
+def _deployment(ids):
+    """ Provides the deployment of desired configuration ids """
+    return (ids.get("instance_configuration_id"),
+            ids.get("instance_configuration_version_id"),
+            ids.get("deployment_id"))
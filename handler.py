@@ -21,7 +21,54 @@ class DeploymentHandler(RESTHandler):
         self.logger = get_nio_logger("DeploymentManager")
 
     def on_get(self, request, response, *args, **kwargs):
-        raise NotImplementedError
+        """ API endpoint for deployment status
+
+        Example:
+            http://[host]:[port]/config/deployments
+            http://[host]:[port]/config/deployments/[deployment_id]
+            http://[host]:[port]/config/metrics
+            http://[host]:[port]/config/versions/[config_id]/[version_id]
+
+        """
+        # Ensure instance "read" access
+        ensure_access("instance", "read")
+
+        path = self._get_path(request)
+        self.logger.debug("on_get, path: {}".format(path))
+
+        if not (path[:1] == ['deployments'] and len(path) <= 2 or
+                path == ['metrics'] or
+                path[:1] == ['versions'] and len(path) == 3):
+            msg = "Invalid path: {} in 'config'".format("/".join(path))
+            self.logger.warning(msg)
+            raise ValueError(msg)
+
+        if path[0] == 'versions':
+            # cached configuration, served to peers as received
+            configuration_data = self._manager.get_cached_configuration(
+                path[1], path[2])
+            if configuration_data is None:
+                msg = "Configuration: {} version {} not found".format(
+                    path[1], path[2])
+                self.logger.warning(msg)
+                raise ValueError(msg)
+            response.set_header('Content-Type', 'application/json')
+            response.set_body(configuration_data)
+            return
+
+        if path == ['metrics']:
+            result = self._manager.get_metrics()
+        elif len(path) == 2:
+            result = self._manager.get_deployment(path[1])
+            if result is None:
+                msg = "Deployment: {} not found".format(path[1])
+                self.logger.warning(msg)
+                raise ValueError(msg)
+        else:
+            result = self._manager.get_deployments()
+
+        response.set_header('Content-Type', 'application/json')
+        response.set_body(json.dumps(result))
 
     def on_put(self, request, response, *args, **kwargs):
         """ API endpoint for configuration component
@@ -57,13 +104,40 @@ class DeploymentHandler(RESTHandler):
             self.logger.error(msg)
             raise ValueError(msg)
 
-        # get configuration and update running instance
-        result = self._manager.update_configuration(
-            instance_configuration_id,
-            instance_configuration_version_id,
-            deployment_id,
-        )
+        configuration_data = body.get('configuration_data')
+        if configuration_data is not None:
+            # configuration handed over with the deployment, e.g. by a
+            # component fanning out deployments, is not fetched
+            self._manager.provide_configuration(
+                instance_configuration_id,
+                instance_configuration_version_id,
+                deployment_id,
+                configuration_data,
+            )
+
+        if self._manager.async_deployments:
+            # queue update and let caller follow it through
+            # /config/deployments/[deployment_id]
+            result = self._manager.queue_deployment(
+                instance_configuration_id,
+                instance_configuration_version_id,
+                deployment_id,
+            )
+            response.set_status(202)
+        else:
+            # get configuration and update running instance
+            result = self._manager.update_configuration(
+                instance_configuration_id,
+                instance_configuration_version_id,
+                deployment_id,
+            )
 
         # provide response
         response.set_header('Content-Type', 'application/json')
         response.set_body(json.dumps(result))
+
+    @staticmethod
+    def _get_path(request):
+        """ Provides path segments following '/config/' """
+        identifier = request.get_identifier() or ""
+        return [segment for segment in identifier.split("/") if segment]
@@ -4,20 +4,37 @@
 
 """
 import json
+import time
+from collections import OrderedDict
 from datetime import timedelta
 from enum import Enum
+from threading import Lock
 
 from nio.util.versioning.dependency import DependsOn
 from nio import discoverable
 
 from nio.modules.settings import Settings
-from nio.modules.persistence import Persistence
 from nio.modules.scheduler.job import Job
 
 from niocore.core.component import CoreComponent
 
+from .cache import ConfigurationCache
+from .diff import ConfigurationDiff, SECTIONS, configuration_fingerprints
+from .errors import UpdateErrors
+from .executor import DeploymentExecutor
+from .fanout import FanOut, fanout_instances
 from .handler import DeploymentHandler
-from .proxy import DeploymentProxy
+from .metrics import DeploymentMetrics, DeploymentTimer
+from .outbox import ReportOutbox
+from .patch import apply_patch, checksum
+from .proxy import DeploymentProxy, desired_fingerprint
+from .push import PushChannel
+from .restarts import ServiceRestarter, service_dependencies
+from .scheduler import PollScheduler
+from .staging import ConfigurationStager, StagedConfiguration
+from .state import DeploymentState
+from .transaction import ConfigurationTransaction
+from .validation import ConfigurationValidator
 
 
 @DependsOn('niocore.components.rest')
@@ -32,27 +49,82 @@ class DeploymentManager(CoreComponent):
         in_progress = 3
         success = 4
         failure = 5
+        superseded = 6
 
     _name = "DeploymentManager"
 
+    # number of deployments whose status is kept for the REST API
+    _max_deployments = 100
+    # max length of error summaries reported and logged
+    _error_summary_length = 2000
+
     def __init__(self):
         super().__init__()
         self._rest_manager = None
         self._config_handler = None
         self._api_proxy = None
+        self._outbox = None
         self._configuration_manager = None
+        self._cache = None
+        # configurations handed over with deployments, as (config_id,
+        # config_version_id, configuration_data) by deployment id
+        self._provided = {}
+        self._provided_lock = Lock()
+        # running configuration ids, fingerprints of its objects and what
+        # was last polled
+        self._state = DeploymentState()
 
         self._config_api_url_prefix = None
-        self._config_id = None
-        self._config_version_id = None
+        self._api_pool_size = None
+        self._api_connect_timeout = None
+        self._api_read_timeout = None
+        self._api_keep_alive = None
+        self._peers = None
+        self._peer_credentials = None
+        self._compact_encoding = None
+        self._report_outbox = None
+        self._state_write_delay = None
 
         self._poll_job = None
         self._poll = None
         self._poll_interval = None
         self._poll_on_start = None
+        self._poll_jitter = None
+        self._poll_max_interval = None
+        self._poll_fast_interval = None
+        self._poll_fast_polls = None
+        self._poll_wait = None
+        self._poll_fingerprint = None
+        self._poll_scheduler = None
+        self._push_enabled = None
+        self._push_max_retry_interval = None
+        self._push = None
 
         self._start_stop_services = None
+        self._restarter = None
+        self._service_manager = None
+        self._rolling_batch_size = None
+        self._rolling_settle_time = None
         self._delete_missing = None
+        self._rollback = None
+        self._stream_downloads = None
+        self._patch_downloads = None
+        self._validate = None
+        self._staging = None
+        self._stager = None
+        # last configuration rejected by validation, not deployed again
+        # when polled, one failing to be applied is retried
+        self._rejected = None
+
+        self._async_deployments = None
+        self._executor = None
+        self._fanout_instances = None
+        self._fanout_credentials = None
+        self._fanout_workers = None
+        self._fanout = None
+        self._deployments = OrderedDict()
+        self._deployments_lock = Lock()
+        self._metrics = DeploymentMetrics()
 
     def configure(self, context):
         """ Configures component
@@ -76,22 +148,97 @@ class DeploymentManager(CoreComponent):
         self._config_api_url_prefix = \
             Settings.get("configuration", "config_api_url_prefix",
                          fallback="https://api.n.io/v1")
+        self._api_pool_size = Settings.getint(
+            "configuration", "config_api_pool_size", fallback=2)
+        self._api_connect_timeout = Settings.getfloat(
+            "configuration", "config_api_connect_timeout", fallback=10)
+        self._api_read_timeout = Settings.getfloat(
+            "configuration", "config_api_read_timeout", fallback=60)
+        self._api_keep_alive = Settings.getboolean(
+            "configuration", "config_api_keep_alive", fallback=True)
+        self._compact_encoding = Settings.getboolean(
+            "configuration", "config_compact_encoding", fallback=True)
+        self._peers = [peer.strip() for peer in Settings.get(
+            "configuration", "config_peers", fallback="").split(",")
+            if peer.strip()]
+        self._peer_credentials = Settings.get(
+            "configuration", "config_peer_credentials", fallback=None)
+        self._report_outbox = Settings.getboolean(
+            "configuration", "config_report_outbox", fallback=True)
 
-        self._config_id = Persistence().load(
-            "configuration_id",
-            default=Settings.get("configuration", "config_id"))
-        self._config_version_id = Persistence().load(
-            "configuration_version_id",
-            default=Settings.get("configuration", "config_version_id"))
+        self._state_write_delay = Settings.getfloat(
+            "configuration", "config_state_write_delay", fallback=1)
+        self._state = DeploymentState(self._state_write_delay)
+        self._state.load(
+            Settings.get("configuration", "config_id"),
+            Settings.get("configuration", "config_version_id"))
 
         self._start_stop_services = Settings.getboolean(
             "configuration", "start_stop_services", fallback=True)
+        restart_workers = Settings.getint(
+            "configuration", "config_restart_workers", fallback=0)
+        self._service_manager = self.get_dependency('ServiceManager')
+        if restart_workers > 0:
+            self._restarter = ServiceRestarter(
+                self._service_manager, restart_workers)
         self._delete_missing = Settings.getboolean(
             "configuration", "delete_missing", fallback=True)
+        self._rollback = Settings.getboolean(
+            "configuration", "config_rollback", fallback=True)
+        self._rolling_batch_size = Settings.getint(
+            "configuration", "config_rolling_batch_size", fallback=0)
+        self._rolling_settle_time = Settings.getfloat(
+            "configuration", "config_rolling_settle_time", fallback=5)
         self._poll_interval = Settings.getint(
             "configuration", "config_poll_interval", fallback=0)
         self._poll_on_start = Settings.getboolean(
             "configuration", "config_poll_on_start", fallback=False)
+        self._poll_jitter = Settings.getfloat(
+            "configuration", "config_poll_jitter", fallback=0.1)
+        self._poll_max_interval = Settings.getint(
+            "configuration", "config_poll_max_interval", fallback=0)
+        self._poll_fast_interval = Settings.getint(
+            "configuration", "config_poll_fast_interval", fallback=30)
+        self._poll_fast_polls = Settings.getint(
+            "configuration", "config_poll_fast_polls", fallback=3)
+        self._poll_wait = Settings.getint(
+            "configuration", "config_poll_wait", fallback=0)
+        self._push_enabled = Settings.getboolean(
+            "configuration", "config_push", fallback=False)
+        self._push_max_retry_interval = Settings.getfloat(
+            "configuration", "config_push_max_retry_interval", fallback=60)
+        self._poll_fingerprint = Settings.getboolean(
+            "configuration", "config_poll_fingerprint", fallback=True)
+        self._stream_downloads = Settings.getboolean(
+            "configuration", "config_stream_downloads", fallback=False)
+        self._patch_downloads = Settings.getboolean(
+            "configuration", "config_patch_downloads", fallback=True)
+        self._validate = Settings.getboolean(
+            "configuration", "config_validate", fallback=True)
+        self._staging = Settings.getboolean(
+            "configuration", "config_staging", fallback=True)
+        self._async_deployments = Settings.getboolean(
+            "configuration", "config_async_deployments", fallback=False)
+
+        self._fanout_instances = fanout_instances(Settings.get(
+            "configuration", "config_fanout_instances", fallback=""))
+        self._fanout_credentials = Settings.get(
+            "configuration", "config_fanout_credentials", fallback=None)
+        self._fanout_workers = Settings.getint(
+            "configuration", "config_fanout_workers", fallback=4)
+        self._metrics = DeploymentMetrics(Settings.getint(
+            "configuration", "config_metrics_window", fallback=100))
+
+        cache_max_bytes = Settings.getint(
+            "configuration", "config_cache_max_bytes", fallback=52428800)
+        if cache_max_bytes > 0:
+            self._cache = ConfigurationCache(
+                Settings.get("configuration", "config_cache_dir",
+                             fallback="deployment_cache"),
+                cache_max_bytes)
+            # running configuration is kept for failed updates to be rolled
+            # back to
+            self._cache.pin(self.config_id, self.config_version_id)
 
     def start(self):
         """ Starts component
@@ -100,14 +247,50 @@ class DeploymentManager(CoreComponent):
         Begins polling job if it is set
         """
         super().start()
-        self._api_proxy = DeploymentProxy(self._config_api_url_prefix, self)
+        self._api_proxy = DeploymentProxy(
+            self._config_api_url_prefix, self,
+            pool_size=self._api_pool_size or 2,
+            connect_timeout=self._api_connect_timeout or 10,
+            read_timeout=self._api_read_timeout or 60,
+            keep_alive=self._api_keep_alive is not False,
+            peers=self._peers,
+            compact_encoding=self._compact_encoding is not False,
+            peer_auth=_credentials(self._peer_credentials))
+        if self._report_outbox:
+            self._outbox = ReportOutbox(
+                self._api_proxy.set_reported_configuration,
+                save_delay=self._state_write_delay or 0)
+            self._outbox.start()
+        self._executor = DeploymentExecutor(
+            self._deploy, self._report_superseded)
+        self._executor.start()
+        if self._staging:
+            self._stager = ConfigurationStager(self._prepare)
         self._config_handler = DeploymentHandler(self)
         self._rest_manager.add_web_handler(self._config_handler)
+        if self._fanout_instances:
+            self._fanout = FanOut(
+                self._api_proxy, self._get_configuration,
+                self._fanout_instances,
+                auth=_credentials(self._fanout_credentials),
+                workers=self._fanout_workers or 4,
+                timeout=(self._api_connect_timeout or 10,
+                         self._api_read_timeout or 60))
 
+        if self._push_enabled:
+            self._push = PushChannel(
+                self._api_proxy.open_event_stream,
+                self._on_pushed_deployment,
+                max_retry_interval=self._push_max_retry_interval or 60)
+            self._push.start()
         if self._poll_interval:
-            self._poll_job = Job(self._run_config_update,
-                                 timedelta(seconds=self._poll_interval),
-                                 True)
+            self._poll_scheduler = PollScheduler(
+                self._poll_interval,
+                jitter=self._poll_jitter or 0,
+                max_interval=self._poll_max_interval,
+                fast_interval=self._poll_fast_interval,
+                fast_polls=self._poll_fast_polls or 0)
+            self._schedule_poll()
         if self._poll_on_start:
             self._run_config_update()
 
@@ -120,6 +303,32 @@ class DeploymentManager(CoreComponent):
             self._poll_job.cancel()
             self._poll_job = None
 
+        if self._push:
+            self._push.stop(timeout=self._api_connect_timeout or 10)
+            self._push = None
+
+        if self._executor:
+            self._executor.stop()
+            self._executor = None
+
+        if self._stager:
+            self._stager.stop()
+            self._stager = None
+        self._state.flush()
+
+        if self._fanout:
+            self._fanout.close()
+            self._fanout = None
+
+        if self._outbox:
+            # reports not sent by then are sent once started again
+            self._outbox.stop(timeout=self._api_connect_timeout or 10)
+            self._outbox = None
+
+        if self._api_proxy:
+            self._api_proxy.close()
+            self._api_proxy = None
+
         super().stop()
 
     @property
@@ -130,26 +339,108 @@ class DeploymentManager(CoreComponent):
     def instance_id(self):
         return self._api_key_manager.instance_id
 
+    @property
+    def async_deployments(self):
+        return bool(self._async_deployments)
+
+    def _schedule_poll(self):
+        self._poll_job = Job(
+            self._poll_config_update,
+            timedelta(seconds=self._poll_scheduler.next_delay()),
+            False)
+
+    def _poll_config_update(self):
+        """ Polling job callback, runs update and schedules next poll """
+        try:
+            if self._push and self._push.connected:
+                # deployments are pushed, polls are a fallback
+                self.logger.debug("Push channel connected, skipping poll")
+            elif self._run_config_update() is not None:
+                self._poll_scheduler.deployed()
+            self._poll_scheduler.success()
+        except Exception:
+            self._poll_scheduler.failure()
+            self.logger.exception(
+                "Failed to check for latest configuration, {} consecutive "
+                "failures".format(self._poll_scheduler.errors))
+        finally:
+            # polling is over once component is stopped
+            if self._poll_job:
+                self._schedule_poll()
+
     def _run_config_update(self):
-        """Callback function to run update at each polling interval """
+        """ Checks for latest configuration and updates to it
+
+        Returns:
+            result (dict): The result of the instance update call, None when
+                no update was needed
+        """
         self.logger.debug("Checking for latest configuration")
 
+        if self._fanout:
+            results = self._fanout.poll()
+            if results is not None:
+                self.logger.info(
+                    "Configurations were fanned out: {}".format(results))
+            return results
+
+        if self._desired_fingerprint_unchanged():
+            self.logger.debug(
+                "Desired configuration fingerprint did not change, "
+                "skipping")
+            return
+
         # Poll the product api for config ids this instance
-        # should be running
-        ids = self._api_proxy.get_instance_config_ids()
+        # should be running, validators are only sent when they were issued
+        # for the configuration currently running
+        validators = self._get_request_validators()
+        ids = self._api_proxy.get_instance_config_ids(
+            validators, wait=self._poll_wait or 0)
         if ids is None:
-            # It didn't report any IDs to update to, so ignore
+            # It didn't report any IDs to update to or they did not change
+            # since last poll, so ignore
             return
 
         self.logger.debug("Desired configuration: {}".format(ids))
+        result = self._deploy_desired(ids)
+        self._set_validators(
+            ids.get("instance_configuration_id"),
+            ids.get("instance_configuration_version_id"),
+            validators)
+        self._set_desired_fingerprint(ids)
+        return result
+
+    def _on_pushed_deployment(self, ids):
+        """ Push channel callback, updates to the configuration pushed """
+        self.logger.debug("Pushed configuration: {}".format(ids))
+        result = self._deploy_desired(ids)
+        self._set_desired_fingerprint(ids)
+        return result
+
+    def _deploy_desired(self, ids):
+        """ Updates to the desired configuration unless already running it
+        or it was rejected
+
+        Args:
+            ids (dict): desired configuration ids, as polled
+
+        Returns:
+            result (dict): The result of the instance update call, None when
+                no update was needed
+        """
         config_id = ids.get("instance_configuration_id")
         config_version_id = ids.get("instance_configuration_version_id")
+        self._stage(ids)
 
         if config_id == self.config_id and \
            config_version_id == self.config_version_id:
             self.logger.debug(
                 "No change detected from current version, skipping")
             return
+        if (config_id, config_version_id) == self._rejected:
+            self.logger.debug(
+                "Configuration was rejected before, skipping")
+            return
 
         self.logger.info(
             "New configuration detected...updating to config ID {} "
@@ -159,6 +450,112 @@ class DeploymentManager(CoreComponent):
             config_id, config_version_id, deployment_id)
 
         self.logger.info("Configuration was updated: {}".format(result))
+        return result
+
+    def _desired_fingerprint_unchanged(self):
+        """ Checks the fingerprint of the desired configuration ids
+
+        Getting the fingerprint takes a HEAD request, which is cheaper than
+        getting the ids. It is not checked when long-polling, which already
+        keeps steady-state polls cheap.
+
+        Returns:
+            True when desired configuration is the one handled last and the
+            instance is still running what it ran then
+        """
+        stored = self._state.desired_fingerprint
+        if not self._poll_fingerprint or self._poll_wait or not stored or \
+                stored.get("config_id") != self.config_id or \
+                stored.get("config_version_id") != self.config_version_id:
+            return False
+        fingerprint = self._api_proxy.get_desired_fingerprint()
+        if fingerprint is None:
+            self.logger.info(
+                "Product API does not provide configuration fingerprints, "
+                "polling configuration ids instead")
+            self._poll_fingerprint = False
+            return False
+        # no configuration desired, ids are polled as usual
+        return bool(fingerprint) and fingerprint == stored.get("fingerprint")
+
+    def _set_desired_fingerprint(self, ids):
+        """ Persists the fingerprint of desired configuration once handled,
+        that is running or rejected, a failed update is retried when polled
+        """
+        desired = (ids.get("instance_configuration_id"),
+                   ids.get("instance_configuration_version_id"))
+        if not self._poll_fingerprint or desired not in (
+                (self.config_id, self.config_version_id), self._rejected):
+            return
+        fingerprint = {
+            "config_id": self.config_id,
+            "config_version_id": self.config_version_id,
+            "fingerprint": desired_fingerprint(
+                ids.get("instance_configuration_id"),
+                ids.get("instance_configuration_version_id"),
+                ids.get("deployment_id"),
+                ids.get("staged_configuration_id"),
+                ids.get("staged_configuration_version_id"))
+        }
+        self._state.update(desired_fingerprint=fingerprint)
+
+    def _stage(self, ids):
+        """ Stages the upcoming configuration announced by a poll, if any
+        """
+        if not self._stager:
+            return
+        staged = (ids.get("staged_configuration_id"),
+                  ids.get("staged_configuration_version_id"))
+        if not all(staged) or staged in (
+                (self.config_id, self.config_version_id),
+                (ids.get("instance_configuration_id"),
+                 ids.get("instance_configuration_version_id"))):
+            return
+        self._stager.stage(*staged)
+
+    def _prepare(self, config_id, config_version_id):
+        """ Downloads, decodes and validates a configuration to be staged
+
+        Returns:
+            StagedConfiguration
+        """
+        configuration_data = self._get_configuration(
+            config_id, config_version_id)
+        errors = self._validate_configuration(configuration_data)
+        return StagedConfiguration(
+            configuration_data, errors,
+            None if errors else configuration_fingerprints(
+                configuration_data))
+
+    def _get_request_validators(self):
+        """ Provides conditional request validators for the running config
+
+        Returns:
+            dict with "etag" and "last_modified" entries, these are None
+            when no validators were stored for the running configuration
+        """
+        validators = {"etag": None, "last_modified": None}
+        stored = self._state.validators
+        if stored and \
+           stored.get("config_id") == self.config_id and \
+           stored.get("config_version_id") == self.config_version_id:
+            validators["etag"] = stored.get("etag")
+            validators["last_modified"] = stored.get("last_modified")
+        return validators
+
+    def _set_validators(self, config_id, config_version_id, validators):
+        """ Persists response validators once a desired config was handled
+        """
+        if not (validators.get("etag") or validators.get("last_modified")):
+            return
+        # persisted next to configuration ids so that conditional requests
+        # remain valid when component starts again
+        self._state.update(validators={
+            "config_id": config_id,
+            "config_version_id": config_version_id,
+            "etag": validators.get("etag"),
+            "last_modified": validators.get("last_modified")
+        })
 
     def update_configuration(
             self, config_id, config_version_id, deployment_id):
@@ -169,108 +566,731 @@ class DeploymentManager(CoreComponent):
             config_version_id: The version ID of the instance config
             deployment_id: The deployment ID to set the status for
 
+        Deployments are serialized, when superseded by a newer deployment
+        for the same config ID before it started, the result holds the
+        superseding deployment ID under "superseded_by".
+
         Returns:
             result (dict): The result of the instance update call
         """
-        # grab new configuration
-        configuration = self._api_proxy.get_configuration(
-            config_id, config_version_id)
-        if configuration is None or "configuration_data" not in configuration:
-            msg = "configuration_data entry missing in nio API return"
-            self.logger.error(msg)
-            raise RuntimeError(msg)
+        if self._executor and not self._executor.in_worker:
+            return self._executor.submit(
+                config_id, config_version_id, deployment_id).result()
+        return self._deploy(config_id, config_version_id, deployment_id)
 
-        configuration_data = json.loads(configuration["configuration_data"])
-        # notify configuration acceptance
-        self._api_proxy.set_reported_configuration(
-            config_id,
-            config_version_id,
-            deployment_id,
-            self.Status.accepted.name,
-            "Services and Blocks configuration was accepted, "
-            "proceeding with update")
-
-        # perform update
-        result = self._configuration_manager.update(
-            configuration_data,
-            self._start_stop_services,
-            self._delete_missing)
-
-        # instance is now running this configuration so persist this fact
-        self.config_id = config_id
-        self.config_version_id = config_version_id
-
-        error_messages = self._get_potential_errors_messages(result)
-        if error_messages:
-            # notify failure
+    def get_cached_configuration(self, config_id, config_version_id):
+        """ Provides a configuration from the local cache, as received
+
+        Args:
+            config_id: The ID of the instance configuration
+            config_version_id: The version ID of the instance config
+
+        Returns:
+            configuration_data (str), None when not cached
+        """
+        if not self._cache:
+            return None
+        try:
+            return self._cache.get(config_id, config_version_id)
+        except OSError:
+            self.logger.exception("Failed to read configuration cache")
+            return None
+
+    def provide_configuration(self, config_id, config_version_id,
+                              deployment_id, configuration_data):
+        """ Provides the configuration of a deployment, not fetched then
+
+        The configuration is kept in memory until that deployment finished
+        or was superseded, it is not verified against the Product API and
+        so is neither cached nor used by other deployments
+
+        Args:
+            config_id: The ID of the instance configuration
+            config_version_id: The version ID of the instance config
+            deployment_id: The deployment ID the configuration is for
+            configuration_data (dict or str): configuration, decoded or
+                encoded
+        """
+        if isinstance(configuration_data, str):
+            configuration_data = json.loads(configuration_data)
+        with self._provided_lock:
+            self._provided[deployment_id] = (
+                config_id, config_version_id, configuration_data)
+
+    def _discard_provided(self, deployment_id):
+        """ Drops the configuration provided with a deployment, if any """
+        with self._provided_lock:
+            self._provided.pop(deployment_id, None)
+
+    def _deploy(self, config_id, config_version_id, deployment_id):
+        self._set_deployment_status(
+            deployment_id, self.Status.started, "Deployment started",
+            config_id=config_id, config_version_id=config_version_id)
+        timer = DeploymentTimer()
+        try:
+            return self._update_configuration(
+                config_id, config_version_id, deployment_id, timer)
+        except Exception as e:
+            self._set_deployment_status(
+                deployment_id, self.Status.failure, str(e))
+            raise
+        finally:
+            # including configuration provided for a deployment which ran
+            # already when it was handed over again
+            self._discard_provided(deployment_id)
+            self._metrics.record(timer)
+            # deployment state is written once per deployment
+            self._state.flush()
+
+    def queue_deployment(self, config_id, config_version_id, deployment_id):
+        """ Queues an update to be performed in the background
+
+        Args:
+            config_id: The ID of the instance configuration to use
+            config_version_id: The version ID of the instance config
+            deployment_id: The deployment ID to set the status for
+
+        Returns:
+            deployment (dict): deployment status, see `get_deployment`
+        """
+        self._set_deployment_status(
+            deployment_id, self.Status.started, "Deployment queued",
+            config_id=config_id, config_version_id=config_version_id)
+        self._executor.submit(config_id, config_version_id, deployment_id)
+        return self.get_deployment(deployment_id)
+
+    def _report_superseded(self, config_id, config_version_id,
+                           deployment_id, superseded_by):
+        """ Reports a deployment dropped in favor of a newer one """
+        self._discard_provided(deployment_id)
+        message = "Superseded by deployment {}".format(superseded_by)
+        self._set_deployment_status(
+            deployment_id, self.Status.superseded, message)
+        self._report(config_id, config_version_id, deployment_id,
+                     self.Status.superseded, message)
+
+    def _report(self, config_id, config_version_id, deployment_id, status,
+                message):
+        """ Reports deployment status to the Product API
+
+        Reports go through the outbox when enabled so that deployments do
+        not wait on, nor fail because of, the Product API
+        """
+        if self._outbox:
+            self._outbox.put(config_id, config_version_id, deployment_id,
+                             status.name, message)
+        else:
             self._api_proxy.set_reported_configuration(
                 config_id,
                 config_version_id,
                 deployment_id,
-                self.Status.failure.name,
-                "Failed to update, these errors were encountered: {}".format(
-                    error_messages))
+                status.name,
+                message)
+
+    def get_deployment(self, deployment_id):
+        """ Provides the status of a deployment
+
+        Returns:
+            deployment (dict): with format
+                {
+                    "deployment_id": "deployment_id...",
+                    "instance_configuration_id": "uuid..",
+                    "instance_configuration_version_id": "uuid..",
+                    "status": "in_progress",
+                    "message": "...",
+                    "updated": 1500000000.0
+                }
+            or None when deployment is not known
+        """
+        with self._deployments_lock:
+            deployment = self._deployments.get(deployment_id)
+            return dict(deployment) if deployment else None
+
+    def get_deployments(self):
+        """ Provides the status of all known deployments, oldest first """
+        with self._deployments_lock:
+            return [dict(deployment)
+                    for deployment in self._deployments.values()]
+
+    def get_metrics(self):
+        """ Provides timings and counters of recent deployments
+
+        Returns:
+            metrics (dict): see `DeploymentMetrics.snapshot`
+        """
+        return self._metrics.snapshot()
+
+    def _set_deployment_status(self, deployment_id, status, message,
+                               config_id=None, config_version_id=None,
+                               **kwargs):
+        with self._deployments_lock:
+            deployment = self._deployments.pop(deployment_id, None)
+            if deployment is None or config_id is not None:
+                deployment = {
+                    "deployment_id": deployment_id,
+                    "instance_configuration_id": config_id,
+                    "instance_configuration_version_id": config_version_id
+                }
+            deployment.update(kwargs)
+            deployment["status"] = status.name
+            deployment["message"] = message
+            deployment["updated"] = time.time()
+            self._deployments[deployment_id] = deployment
+            while len(self._deployments) > self._max_deployments:
+                self._deployments.popitem(last=False)
+
+    def _update_configuration(
+            self, config_id, config_version_id, deployment_id, timer):
+        # grab new configuration, prepared already when it was staged
+        staged = None
+        if self._stager:
+            with timer.phase("fetch"):
+                staged = self._stager.take(config_id, config_version_id)
+        if staged:
+            self.logger.info(
+                "Using staged configuration for config ID {} version "
+                "{}".format(config_id, config_version_id))
+            configuration_data, validation_errors, fingerprints = staged
+        else:
+            configuration_data = self._get_configuration(
+                config_id, config_version_id, timer, deployment_id)
+            with timer.phase("validate"):
+                validation_errors = self._validate_configuration(
+                    configuration_data)
+            fingerprints = None
+        if validation_errors:
+            return self._reject(config_id, config_version_id,
+                                deployment_id, validation_errors, timer)
+        # notify configuration acceptance
+        with timer.phase("accept_report"):
+            self._report(config_id, config_version_id, deployment_id,
+                         self.Status.accepted,
+                         "Services and Blocks configuration was accepted, "
+                         "proceeding with update")
+        self._set_deployment_status(
+            deployment_id, self.Status.accepted,
+            "Services and Blocks configuration was accepted")
+
+        # perform update, only changes from last applied configuration are
+        # handed over unless objects need to be deleted
+        diff = ConfigurationDiff(
+            configuration_data, self._state.fingerprints, fingerprints)
+        if diff.is_full or (diff.has_removals and self._delete_missing):
+            update_data = configuration_data
+            delete_missing = self._delete_missing
+        else:
+            self.logger.debug(
+                "Applying changes only, added: {}, changed: {}".format(
+                    diff.count(diff.added), diff.count(diff.changed)))
+            update_data = diff.delta()
+            delete_missing = False
+        self._set_deployment_status(
+            deployment_id, self.Status.in_progress,
+            "Updating services and blocks")
+        timer.add("objects_applied", sum(
+            len(update_data.get(section) or {}) for section in SECTIONS))
+        # services are stopped before the update and started after it by
+        # the restarter rather than one after another during the update,
+        # a rolling update stops and starts each batch of services
+        rolling = bool(self._rolling_batch_size) and not delete_missing
+        restarter = self._restarter if self._start_stop_services else None
+        restarts = {}
+        stopped = []
+        started = None
+        if restarter:
+            stop_ids, start_ids = self._plan_restarts(
+                diff, configuration_data, delete_missing)
+            dependencies = service_dependencies(
+                configuration_data.get("services") or {},
+                configuration_data.get("blocks") or {})
+        if restarter and not rolling:
+            # a service failing to stop is not a deployment failure, it may
+            # not have been running
+            with timer.phase("restart"):
+                stopped, _ = self._restart(
+                    restarter, "stop", stop_ids, dependencies, restarts)
+        snapshot = None
+        if self._rollback:
+            snapshot = self._get_snapshot()
+            if snapshot is None:
+                self.logger.warning(
+                    "Running configuration is not known, a failed update "
+                    "to config ID {} version {} cannot be rolled "
+                    "back".format(config_id, config_version_id))
+        transaction = ConfigurationTransaction(
+            self._configuration_manager.update, snapshot,
+            self._start_stop_services and not restarter)
+        with timer.phase("apply"):
+            if rolling:
+                started = []
+
+                def before_batch(service_ids):
+                    if restarter:
+                        stopped.extend(self._restart(
+                            restarter, "stop",
+                            [service_id for service_id in service_ids
+                             if service_id in stop_ids],
+                            dependencies, restarts)[0])
+
+                def after_batch(service_ids, index, count):
+                    failures = []
+                    if restarter:
+                        succeeded, failures = self._restart(
+                            restarter, "start",
+                            [service_id for service_id in service_ids
+                             if service_id in start_ids],
+                            dependencies, restarts)
+                        started.extend(succeeded)
+                    self._batch_applied(
+                        config_id, config_version_id, deployment_id,
+                        index, count, timer)
+                    return {"services": {"error": failures}}
+
+                result = transaction.apply(
+                    update_data, delete_missing, self._rolling_batch_size,
+                    before_batch, after_batch)
+            elif self._rollback:
+                result = transaction.apply(update_data, delete_missing)
+            else:
+                result = self._configuration_manager.update(
+                    update_data,
+                    self._start_stop_services and not restarter,
+                    delete_missing)
+
+        with timer.phase("result_scan"):
+            errors = self._get_errors(result)
+        if restarter and not rolling and \
+                (not errors or not transaction.can_rollback):
+            with timer.phase("restart"):
+                started, failures = self._restart(
+                    restarter, "start", start_ids, dependencies, restarts)
+            if failures:
+                services_result = dict(result.get("services") or {})
+                services_result["error"] = \
+                    list(services_result.get("error") or []) + failures
+                result["services"] = services_result
+                with timer.phase("result_scan"):
+                    errors = self._get_errors(result)
+        if not errors:
+            # instance is now running this configuration so persist this
+            # fact
+            self._state.update(
+                config_id=config_id,
+                config_version_id=config_version_id,
+                deployment_id=deployment_id,
+                fingerprints=diff.fingerprints)
+            if self._cache:
+                self._cache.pin(config_id, config_version_id)
+        else:
+            # instance keeps reporting the configuration it ran before
+            if transaction.can_rollback:
+                if restarter and started:
+                    # services started with their new definitions
+                    with timer.phase("restart"):
+                        self._restart(
+                            restarter, "stop", started, dependencies, {})
+                with timer.phase("rollback"):
+                    result["rollback"] = self._roll_back(transaction)
+                if restarter:
+                    # services stopped for the update run again
+                    with timer.phase("restart"):
+                        self._restart(
+                            restarter, "start", stopped, dependencies, {})
+            # instance state is unknown unless wholly rolled back, next
+            # update then hands over the whole configuration
+            if not result.get("rollback", {}).get("success"):
+                self._state.update(fingerprints=None)
+        if self._start_stop_services:
+            services = configuration_data.get("services") or {}
+            result["restarts"] = {
+                "services": diff.restart,
+                "avoided": len(services) - len(diff.restart)
+            }
+            if restarter:
+                result["restarts"]["timings"] = restarts
+        if errors:
+            # notify failure, full errors are part of deployment status
+            message = "Failed to update, these errors were encountered: " \
+                "{}".format(errors.summary(self._error_summary_length))
+            if "rollback" in result:
+                message = "{}. {}".format(
+                    result["rollback"]["message"], message)
+            with timer.phase("final_report"):
+                self._report(config_id, config_version_id, deployment_id,
+                             self.Status.failure, message)
+            self._set_deployment_status(
+                deployment_id, self.Status.failure, message, result=result,
+                errors=errors.groups)
         else:
             # report success and new instance config ids
-            self._api_proxy.set_reported_configuration(
-                config_id,
-                config_version_id,
-                deployment_id,
-                self.Status.success.name,
-                "Successfully updated services and blocks")
+            with timer.phase("final_report"):
+                self._report(config_id, config_version_id, deployment_id,
+                             self.Status.success,
+                             "Successfully updated services and blocks")
+            self._set_deployment_status(
+                deployment_id, self.Status.success,
+                "Successfully updated services and blocks", result=result)
             self.logger.info("Configuration was updated, {}".format(result))
 
         return result
 
-    def _get_potential_errors_messages(self, result):
-        """Return any error messages contained in a result"""
-        messages = []
-        for key in result.keys():
-            errors = result.get(key, {}).get("error", [])
+    def _batch_applied(self, config_id, config_version_id, deployment_id,
+                       index, count, timer):
+        """ Reports progress of a rolling update and lets the instance
+        settle before the next batch
+        """
+        message = "Updated batch {} of {} of services".format(
+            index + 1, count)
+        self.logger.info(message)
+        timer.add("batches", 1)
+        if index == count - 1:
+            return
+        self._report(config_id, config_version_id, deployment_id,
+                     self.Status.in_progress, message)
+        self._set_deployment_status(
+            deployment_id, self.Status.in_progress, message)
+        if self._rolling_settle_time:
+            time.sleep(self._rolling_settle_time)
+
+    def _plan_restarts(self, diff, configuration_data, delete_missing):
+        """ Provides the services to stop before an update and to start
+        after it
+
+        Returns:
+            tuple of lists of service ids, to stop and to start
+        """
+        services = configuration_data.get("services") or {}
+        if diff.is_full:
+            # running services are not known
+            stop_ids = list(diff.restart)
+        else:
+            running = self._state.fingerprints.get("services") or {}
+            stop_ids = [service_id for service_id in diff.restart
+                        if service_id in running]
+            if delete_missing:
+                stop_ids += diff.removed["services"]
+        start_ids = [service_id for service_id in diff.restart
+                     if isinstance(services.get(service_id), dict) and
+                     services[service_id].get("auto_start")]
+        return stop_ids, start_ids
+
+    def _restart(self, restarter, action, service_ids, dependencies,
+                 timings):
+        """ Stops or starts services, keeping their timings
+
+        Args:
+            restarter (ServiceRestarter): runs the services action
+            action (str): "stop" or "start"
+            service_ids (list): ids of services to stop or start
+            dependencies (dict): dependencies between services
+            timings (dict): timings by service id, receives the time
+                taken by the action
+
+        Returns:
+            tuple: ids of services the action succeeded for and failures,
+                in update result error format
+        """
+        if action == "stop":
+            outcomes = restarter.stop(service_ids, dependencies)
+        else:
+            outcomes = restarter.start(service_ids, dependencies)
+        succeeded = []
+        failures = []
+        for service_id in service_ids:
+            outcome = outcomes[service_id]
+            timings.setdefault(service_id, {})[action] = outcome["time"]
+            if "error" in outcome:
+                failures.append({
+                    "id": service_id,
+                    "kind": "{}_failed".format(action),
+                    "message": outcome["error"]
+                })
+            else:
+                succeeded.append(service_id)
+        return succeeded, failures
+
+    def _get_snapshot(self):
+        """ Provides the running configuration, encoded, for a failed update
+        to be rolled back
+
+        Returns:
+            configuration (str), None when running configuration is not
+                cached or instance is not known to run it
+        """
+        if not self._cache or self._state.fingerprints is None or \
+                not self.config_id or not self.config_version_id:
+            return None
+        try:
+            return self._cache.get(self.config_id, self.config_version_id)
+        except OSError:
+            self.logger.exception("Failed to read configuration cache")
+            return None
+
+    def _roll_back(self, transaction):
+        """ Rolls back a failed update
+
+        Objects the update added are left in place, the rollback is then
+        partial and services among them are stopped
+
+        Returns:
+            rollback (dict): with format
+                {
+                    "success": True,
+                    "objects": 10,
+                    "message": "Rolled back 10 objects to config ID ..",
+                    # objects left in place, by section, when partial
+                    "added": {"services": [".."]}
+                }
+        """
+        try:
+            errors = UpdateErrors(transaction.rollback())
+        except Exception:
+            self.logger.exception("Failed to roll back update")
+            errors = None
+        added = {section: object_ids
+                 for section, object_ids in transaction.added.items()
+                 if object_ids}
+        if added.get("services") and self._start_stop_services and \
+                not self._restarter:
+            # started by the update, services are otherwise started by the
+            # restarter once the update succeeded
+            self._stop_added(added["services"])
+        if errors is None or errors:
+            message = "Failed to roll back to config ID {} version " \
+                "{}".format(self.config_id, self.config_version_id)
             if errors:
-                message = "Failed to install {}".format(key)
-                for error in errors:
-                    if isinstance(error, dict):
-                        message += ", {}".format(json.dumps(error))
-                    # providing API should send errors as dicts but just in
-                    # case it does not, at least attempt to convert to str
-                    else:
-                        message += ", " + str(error)
-                messages.append(message)
-                # do not let errors go unnoticed
-                self.logger.error("{} error: {}".format(key, errors))
-
-        str_messages = ",".join(messages)
-        if messages:
+                message = "{}, {}".format(message, errors.summary(200))
+        else:
+            message = "{} {} objects to config ID {} version {}".format(
+                "Partially rolled back" if added else "Rolled back",
+                transaction.restored, self.config_id,
+                self.config_version_id)
+        if added:
+            message = "{}, objects added were left in place: {}".format(
+                message, "; ".join(
+                    "{} {}".format(section, ", ".join(object_ids[:10]))
+                    for section, object_ids in added.items()))
+        self.logger.warning(message)
+        rollback = {
+            "success": errors is not None and not errors and not added,
+            "objects": transaction.restored,
+            "message": message
+        }
+        if added:
+            rollback["added"] = added
+        return rollback
+
+    def _stop_added(self, service_ids):
+        """ Stops services a rolled back update added """
+        if not self._service_manager:
+            return
+        for service_id in service_ids:
+            try:
+                self._service_manager.stop_service(service_id)
+            except Exception:
+                self.logger.exception(
+                    "Failed to stop service {} added by the update".format(
+                        service_id))
+
+    def _validate_configuration(self, configuration_data):
+        """ Validates a configuration unless validation is disabled
+
+        Returns:
+            errors (dict): validation errors, empty when valid
+        """
+        if not self._validate:
+            return {}
+        # blocks missing from configuration are kept on the instance unless
+        # missing objects are deleted
+        return ConfigurationValidator().validate(
+            configuration_data, allow_missing_blocks=not self._delete_missing)
+
+    def _reject(self, config_id, config_version_id, deployment_id,
+                validation_errors, timer):
+        """ Reports an invalid configuration, instance is left untouched
+
+        Returns:
+            result (dict): validation errors, in update result format
+        """
+        self._rejected = (config_id, config_version_id)
+        errors = UpdateErrors(validation_errors)
+        message = "Configuration was rejected, these errors were found: " \
+            "{}".format(errors.summary(self._error_summary_length))
+        self.logger.error(message)
+        with timer.phase("final_report"):
+            self._report(config_id, config_version_id, deployment_id,
+                         self.Status.failure, message)
+        self._set_deployment_status(
+            deployment_id, self.Status.failure, message,
+            result=validation_errors, errors=errors.groups)
+        return validation_errors
+
+    def _get_configuration(self, config_id, config_version_id, timer=None,
+                           deployment_id=None):
+        """ Provides configuration data from local cache or nio API
+
+        Args:
+            config_id (str): instance configuration id
+            config_version_id (str): instance configuration version id
+            timer (DeploymentTimer): optional, times fetch and decode,
+                a streamed download is decoded while fetched
+            deployment_id (str): optional, deployment the configuration
+                is for, which may have been provided with it
+
+        Returns:
+            configuration_data (dict): decoded configuration
+        """
+        timer = timer or DeploymentTimer()
+        with self._provided_lock:
+            provided = self._provided.pop(deployment_id, None)
+        if provided and provided[:2] == (config_id, config_version_id):
+            return provided[2]
+        if self._cache:
+            with timer.phase("fetch"):
+                try:
+                    configuration_data = self._cache.get(
+                        config_id, config_version_id)
+                except OSError:
+                    self.logger.exception(
+                        "Failed to read configuration cache")
+                    configuration_data = None
+            if configuration_data is not None:
+                self.logger.debug(
+                    "Using cached configuration for config ID {} "
+                    "version {}".format(config_id, config_version_id))
+                with timer.phase("decode"):
+                    return json.loads(configuration_data)
+
+        configuration_data = self._get_patched_configuration(
+            config_id, config_version_id, timer)
+        if configuration_data is not None:
+            return configuration_data
+
+        writer = None
+        if self._cache:
+            writer = self._cache.writer(config_id, config_version_id)
+        bytes_received = self._api_proxy.received_bytes()
+        try:
+            with timer.phase("fetch"):
+                if self._stream_downloads:
+                    configuration = self._api_proxy.stream_configuration(
+                        config_id, config_version_id,
+                        sink=writer.write if writer else None)
+                else:
+                    configuration = self._api_proxy.get_configuration(
+                        config_id, config_version_id)
+            if configuration is None or \
+               "configuration_data" not in configuration:
+                msg = "configuration_data entry missing in nio API return"
+                self.logger.error(msg)
+                raise RuntimeError(msg)
+            configuration_data = configuration["configuration_data"]
+            if isinstance(configuration_data, str):
+                if writer:
+                    writer.write(configuration_data)
+                with timer.phase("decode"):
+                    configuration_data = json.loads(configuration_data)
+            elif writer and not self._stream_downloads:
+                # received decoded, in a compact encoding
+                writer.write(json.dumps(configuration_data))
+        except Exception:
+            if writer:
+                writer.discard()
+            raise
+        finally:
+            timer.add("bytes_downloaded",
+                      self._api_proxy.received_bytes() - bytes_received)
+        if writer:
+            writer.commit()
+        return configuration_data
+
+    def _get_patched_configuration(self, config_id, config_version_id,
+                                   timer):
+        """ Builds a configuration by patching the running configuration
+
+        The running configuration is read from cache and the patch to the
+        requested version is requested from the nio API, the result must
+        match the checksum provided along with the patch.
+
+        Returns:
+            configuration_data (dict): decoded configuration or None when
+                it could not be patched
+        """
+        if not (self._patch_downloads and self._cache) or \
+           config_id != self.config_id or not self.config_version_id:
+            return None
+        bytes_received = self._api_proxy.received_bytes()
+        try:
+            with timer.phase("fetch"):
+                running = self._cache.get(config_id, self.config_version_id)
+                if running is None:
+                    return None
+                patch = self._api_proxy.get_configuration_patch(
+                    config_id, self.config_version_id, config_version_id)
+            if patch is None:
+                return None
+            with timer.phase("decode"):
+                configuration_data = apply_patch(
+                    json.loads(running), patch.get("patch"))
+                patched = checksum(configuration_data) == \
+                    patch.get("checksum")
+        except Exception:
+            self.logger.exception(
+                "Failed to patch configuration, downloading it instead")
+            return None
+        finally:
+            timer.add("bytes_downloaded",
+                      self._api_proxy.received_bytes() - bytes_received)
+        if not patched:
+            self.logger.warning(
+                "Patched configuration does not match its checksum, "
+                "downloading it instead")
+            return None
+        self.logger.debug(
+            "Patched configuration from version {} to version {}".format(
+                self.config_version_id, config_version_id))
+        self._cache.put(
+            config_id, config_version_id, json.dumps(configuration_data))
+        return configuration_data
+
+    def _get_errors(self, result):
+        """ Aggregates errors contained in a result """
+        errors = UpdateErrors(result)
+        if errors:
+            # do not let errors go unnoticed
             self.logger.error(
-                "{} errors were encountered during update: {}".format(
-                    len(messages), str_messages))
-        return str_messages
+                "Errors were encountered during update: {}".format(
+                    errors.summary(self._error_summary_length)))
+        return errors
 
     @property
     def config_id(self):
-        return self._config_id
+        return self._state.config_id
 
     @config_id.setter
     def config_id(self, config_id):
-        if self._config_id != config_id:
+        if self.config_id != config_id:
             self.logger.debug("Configuration ID set to: {}".format(config_id))
-            self._config_id = config_id
-            # persist value so that it can be read eventually
-            # when component starts again
-            Persistence().save(self.config_id, "configuration_id")
+            # persisted so that it can be read eventually when component
+            # starts again
+            self._state.update(config_id=config_id)
 
     @property
     def config_version_id(self):
-        return self._config_version_id
+        return self._state.config_version_id
 
     @config_version_id.setter
     def config_version_id(self, config_version_id):
-        if self._config_version_id != config_version_id:
+        if self.config_version_id != config_version_id:
             self.logger.debug("Configuration Version ID set to: {}".
                               format(config_version_id))
-            self._config_version_id = config_version_id
-            # persist value so that it can be read eventually
-            # when component starts again
-            Persistence().save(
-                self.config_version_id, "configuration_version_id")
+            self._state.update(config_version_id=config_version_id)
+
+
+def _credentials(setting):
+    """ Provides (user, password) out of a "user:password" setting, None
+    when not set
+    """
+    if not setting:
+        return None
+    return tuple(setting.split(":", 1))
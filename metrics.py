@@ -0,0 +1,109 @@
+"""
+
+   Deployment metrics
+
+"""
+import time
+from collections import deque
+from contextlib import contextmanager
+from threading import Lock
+
+# deployment phases in the order they happen
+PHASES = ("fetch", "decode", "validate", "accept_report", "apply",
+          "result_scan", "restart", "rollback", "final_report")
+
+
+class DeploymentTimer(object):
+    """ Collects phase timings and counters of a single deployment """
+
+    def __init__(self, clock=time.perf_counter):
+        super().__init__()
+        self._clock = clock
+        self.phases = {}
+        self.counters = {}
+
+    @contextmanager
+    def phase(self, name):
+        """ Times enclosed block, repeated phases add up """
+        start = self._clock()
+        try:
+            yield
+        finally:
+            self.phases[name] = \
+                self.phases.get(name, 0) + self._clock() - start
+
+    def add(self, name, value):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+
+class DeploymentMetrics(object):
+    """ Keeps timings and counters of the last `window` deployments """
+
+    def __init__(self, window=100):
+        super().__init__()
+        self._samples = deque(maxlen=window)
+        self._deployments = 0
+        self._lock = Lock()
+
+    def record(self, timer):
+        with self._lock:
+            self._samples.append((dict(timer.phases), dict(timer.counters)))
+            self._deployments += 1
+
+    def snapshot(self):
+        """ Provides statistics over recorded deployments
+
+        Returns:
+            snapshot (dict): with format
+                {
+                    "deployments": 10,
+                    "window": 10,
+                    "phases": {"fetch": {"p50": .., "p90": .., "p99": ..,
+                                         "max": .., "mean": ..}, ...},
+                    "counters": {"bytes_downloaded": {...}, ...},
+                    "last": {"phases": {...}, "counters": {...}}
+                }
+            phase timings are in seconds
+        """
+        with self._lock:
+            samples = list(self._samples)
+            deployments = self._deployments
+
+        phases = {}
+        counters = {}
+        for sample_phases, sample_counters in samples:
+            for name, value in sample_phases.items():
+                phases.setdefault(name, []).append(value)
+            for name, value in sample_counters.items():
+                counters.setdefault(name, []).append(value)
+        # known phases first, in the order they happen
+        names = [name for name in PHASES if name in phases] + \
+            sorted(name for name in phases if name not in PHASES)
+        return {
+            "deployments": deployments,
+            "window": len(samples),
+            "phases": {name: _statistics(phases[name]) for name in names},
+            "counters": {name: _statistics(values)
+                         for name, values in sorted(counters.items())},
+            "last": {
+                "phases": samples[-1][0],
+                "counters": samples[-1][1]
+            } if samples else None
+        }
+
+
+def _statistics(values):
+    values = sorted(values)
+    return {
+        "p50": _percentile(values, 50),
+        "p90": _percentile(values, 90),
+        "p99": _percentile(values, 99),
+        "max": values[-1],
+        "mean": sum(values) / len(values)
+    }
+
+
+def _percentile(values, percent):
+    """ Nearest-rank percentile of sorted values """
+    rank = max(int(-(-len(values) * percent // 100)), 1)
+    return values[rank - 1]
@@ -0,0 +1,210 @@
+"""
+
+   Deployment status report outbox
+
+"""
+from collections import OrderedDict
+from threading import Condition, Thread, Timer
+
+from requests.exceptions import HTTPError
+
+from nio.modules.persistence import Persistence
+from nio.util.logging import get_nio_logger
+
+
+class ReportOutbox(object):
+    """ Sends deployment status reports in the background
+
+    Reports are persisted once queued and removed once sent, reports not
+    sent before the component stops are sent when it starts again. Only the
+    latest report of each deployment is kept, a report queued while an older
+    one of the same deployment is still waiting replaces it.
+
+    Writes wait `save_delay` seconds after the first change so that a burst
+    of changes is written at once, a sent batch being one change. The outbox
+    is written right away when sending fails and when stopping.
+
+    Waiting reports are sent in batches of up to `batch_size`. When sending
+    fails the batch is retried after a delay doubling from `retry_interval`
+    up to `max_retry_interval`.
+    A report rejected by the Product API with a client error is dropped.
+    """
+
+    _persistence_key = "report_outbox"
+
+    def __init__(self, send, batch_size=20, retry_interval=1,
+                 max_retry_interval=60, save_delay=0):
+        """ Create an outbox
+
+        Args:
+            send (callable): sends a report, invoked with config_id,
+                config_version_id, deployment_id, status and message
+                keyword arguments
+            batch_size (int): max number of reports sent between outbox
+                writes
+            retry_interval (float): seconds to wait after first failure
+            max_retry_interval (float): max seconds to wait between retries
+            save_delay (float): seconds changes wait to be persisted, 0
+                persists them right away
+        """
+        super().__init__()
+        self.logger = get_nio_logger("DeploymentManager")
+
+        self._send = send
+        self._save_delay = save_delay
+        self._batch_size = batch_size
+        self._retry_interval = retry_interval
+        self._max_retry_interval = max_retry_interval
+
+        self._reports = OrderedDict()
+        for report in Persistence().load(self._persistence_key, default=[]):
+            self._reports[self._key(report)] = report
+        self._errors = 0
+        self._condition = Condition()
+        self._stopped = False
+        self._thread = None
+        self._timer = None
+        self._dirty = False
+
+    def start(self):
+        self._stopped = False
+        self._thread = Thread(target=self._work, name="ReportOutbox",
+                              daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=0):
+        """ Stops sending reports
+
+        Args:
+            timeout (float): seconds to wait for waiting reports to be sent,
+                reports not sent remain persisted
+        """
+        with self._condition:
+            if timeout:
+                self._condition.wait_for(lambda: not self._reports, timeout)
+            self._stopped = True
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        self._save()
+
+    @property
+    def pending(self):
+        """ Number of reports waiting to be sent """
+        with self._condition:
+            return len(self._reports)
+
+    def put(self, config_id, config_version_id, deployment_id, status,
+            message=""):
+        """ Queues a report, replacing any waiting one of same deployment
+        """
+        report = {
+            "config_id": config_id,
+            "config_version_id": config_version_id,
+            "deployment_id": deployment_id,
+            "status": status,
+            "message": message
+        }
+        with self._condition:
+            self._reports[self._key(report)] = report
+            self._changed()
+            self._condition.notify_all()
+
+    def flush(self, timeout=None):
+        """ Waits for all waiting reports to be sent
+
+        Returns:
+            True when no reports are waiting
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._reports, timeout)
+
+    @staticmethod
+    def _key(report):
+        return (report["deployment_id"], report["config_id"],
+                report["config_version_id"])
+
+    def _changed(self):
+        """ Persists the outbox once the save delay elapsed """
+        with self._condition:
+            self._dirty = True
+            if not self._save_delay:
+                self._save()
+            elif self._timer is None:
+                self._timer = Timer(self._save_delay, self._save)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _save(self):
+        """ Persists pending changes, in one write """
+        with self._condition:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._dirty:
+                return
+            Persistence().save(list(self._reports.values()),
+                               self._persistence_key)
+            self._dirty = False
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._reports and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                batch = list(self._reports.items())[:self._batch_size]
+
+            sent, failed = self._send_batch(batch)
+
+            with self._condition:
+                for key, report in sent:
+                    # a report replaced while being sent is still waiting
+                    if self._reports.get(key) is report:
+                        del self._reports[key]
+                if sent:
+                    self._changed()
+                    self._condition.notify_all()
+                if failed:
+                    # reports waiting may have to outlive this instance
+                    self._save()
+                    self._errors += 1
+                    delay = min(
+                        self._retry_interval * 2 ** (self._errors - 1),
+                        self._max_retry_interval)
+                    self.logger.warning(
+                        "Failed to send {} status reports, {} consecutive "
+                        "failures, retrying in {}s".format(
+                            len(self._reports), self._errors, delay))
+                    self._condition.wait_for(lambda: self._stopped, delay)
+                else:
+                    self._errors = 0
+
+    def _send_batch(self, batch):
+        """ Sends reports in order until one fails
+
+        Returns:
+            (sent, failed): reports no longer waiting and whether sending
+                stopped on a failure
+        """
+        sent = []
+        for key, report in batch:
+            try:
+                self._send(**report)
+            except HTTPError as e:
+                status_code = getattr(e.response, "status_code", None)
+                if status_code is None or status_code >= 500 or \
+                   status_code in (408, 429):
+                    self.logger.exception("Failed to send status report")
+                    return sent, True
+                self.logger.error(
+                    "Dropping status report {} rejected with status "
+                    "{}".format(report, status_code))
+            except Exception:
+                self.logger.exception("Failed to send status report")
+                return sent, True
+            sent.append((key, report))
+        return sent, False
@@ -0,0 +1,145 @@
+"""
+
+   JSON Patch (RFC 6902)
+
+"""
+import copy
+import hashlib
+import json
+
+
+class PatchError(ValueError):
+    """ Raised when a patch cannot be applied """
+
+
+def checksum(document):
+    """ Provides the sha256 of a document's canonical JSON encoding
+
+    Keys are sorted and no whitespace is used so that equal documents share
+    a checksum no matter how they were encoded when received
+    """
+    return hashlib.sha256(json.dumps(
+        document, sort_keys=True, separators=(",", ":"),
+        ensure_ascii=False).encode()).hexdigest()
+
+
+def apply_patch(document, operations):
+    """ Applies JSON Patch operations
+
+    The document is modified in place, a document failing to be patched is
+    left partially patched.
+
+    Args:
+        document: JSON document to patch
+        operations (list): JSON Patch operations
+
+    Returns:
+        patched document, a different object when the whole document was
+            replaced
+
+    Raises:
+        PatchError: when an operation is invalid or fails
+    """
+    if not isinstance(operations, list):
+        raise PatchError("Patch is not a list of operations")
+    for operation in operations:
+        if not isinstance(operation, dict):
+            raise PatchError("Invalid operation: {!r}".format(operation))
+        op = operation.get("op")
+        path = _parse_pointer(operation.get("path"))
+        if op == "add":
+            document = _add(document, path, _value(operation))
+        elif op == "remove":
+            document = _remove(document, path)
+        elif op == "replace":
+            _get(document, path)
+            document = _add(_remove(document, path), path,
+                            _value(operation)) if path \
+                else _value(operation)
+        elif op == "move":
+            from_path = _parse_pointer(operation.get("from"))
+            if path[:len(from_path)] == from_path and path != from_path:
+                raise PatchError("Cannot move {} into itself".format(
+                    operation.get("from")))
+            value = _get(document, from_path)
+            document = _add(_remove(document, from_path), path, value)
+        elif op == "copy":
+            value = _get(document, _parse_pointer(operation.get("from")))
+            document = _add(document, path, copy.deepcopy(value))
+        elif op == "test":
+            if _get(document, path) != _value(operation):
+                raise PatchError("Test failed at {}".format(
+                    operation.get("path")))
+        else:
+            raise PatchError("Invalid operation: {!r}".format(op))
+    return document
+
+
+def _value(operation):
+    if "value" not in operation:
+        raise PatchError("Operation {} has no value".format(
+            operation.get("op")))
+    return operation["value"]
+
+
+def _parse_pointer(pointer):
+    if not isinstance(pointer, str) or pointer and pointer[0] != "/":
+        raise PatchError("Invalid JSON pointer: {!r}".format(pointer))
+    if not pointer:
+        return []
+    return [token.replace("~1", "/").replace("~0", "~")
+            for token in pointer[1:].split("/")]
+
+
+def _index(container, token, adding=False):
+    if token == "-" and adding:
+        return len(container)
+    if not token.isdigit() or token != "0" and token.startswith("0"):
+        raise PatchError("Invalid array index: {}".format(token))
+    index = int(token)
+    if index > len(container) or index == len(container) and not adding:
+        raise PatchError("Array index out of range: {}".format(token))
+    return index
+
+
+def _get(document, path):
+    for token in path:
+        if isinstance(document, dict):
+            if token not in document:
+                raise PatchError("Missing member: {}".format(token))
+            document = document[token]
+        elif isinstance(document, list):
+            document = document[_index(document, token)]
+        else:
+            raise PatchError("Cannot access {} of a value".format(token))
+    return document
+
+
+def _add(document, path, value):
+    if not path:
+        return value
+    parent = _get(document, path[:-1])
+    token = path[-1]
+    if isinstance(parent, dict):
+        parent[token] = value
+    elif isinstance(parent, list):
+        parent.insert(_index(parent, token, adding=True), value)
+    else:
+        raise PatchError("Cannot add {} to a value".format(token))
+    return document
+
+
+def _remove(document, path):
+    if not path:
+        raise PatchError("Cannot remove whole document")
+    parent = _get(document, path[:-1])
+    token = path[-1]
+    if isinstance(parent, dict):
+        if token not in parent:
+            raise PatchError("Missing member: {}".format(token))
+        del parent[token]
+    elif isinstance(parent, list):
+        del parent[_index(parent, token)]
+    else:
+        raise PatchError("Cannot remove {} from a value".format(token))
+    return document
@@ -1,24 +1,122 @@
+import codecs
+import hashlib
+import json
+from threading import Lock, local
+
 import requests
-from requests.exceptions import HTTPError, ConnectionError
+from requests.adapters import HTTPAdapter
+from requests.exceptions import HTTPError, ConnectionError, \
+    RequestException
+from urllib3.util import Retry
 
 from nio.util.logging import get_nio_logger
 
+from .patch import checksum
+from .stream import EnvelopeParser
+from .wire import ACCEPT_ENCODING, DECODERS, accept_header, media_type
+
+
+def desired_fingerprint(config_id, config_version_id, deployment_id,
+                        staged_config_id=None, staged_config_version_id=None):
+    """ Provides the fingerprint of desired configuration ids
+
+    Matches the fingerprint the Product API provides in the
+    X-Configuration-Fingerprint header: the sha256 hex digest of
+    "config_id/config_version_id/deployment_id", followed by
+    "/staged_config_id/staged_config_version_id" when a configuration is
+    staged so that announcing one changes the fingerprint
+    """
+    ids = [config_id, config_version_id, deployment_id]
+    if staged_config_id or staged_config_version_id:
+        ids.extend([staged_config_id, staged_config_version_id])
+    return hashlib.sha256("/".join(
+        str(id_) for id_ in ids).encode()).hexdigest()
+
 
 class DeploymentProxy(object):
     """ Serves as a Proxy to make Product API configuration requests
     """
 
-    def __init__(self, url_prefix, manager):
+    def __init__(self, url_prefix, manager, pool_size=2,
+                 connect_timeout=10, read_timeout=60, keep_alive=True,
+                 peers=None, peer_auth=None, compact_encoding=True):
+        """ Create a proxy owning a persistent, pooled HTTP session
+
+        Args:
+            url_prefix (str): Product API url prefix
+            manager (DeploymentManager): manager providing api key and
+                instance id
+            pool_size (int): max number of connections kept open to the
+                Product API host
+            connect_timeout (float): seconds to wait for a connection
+            read_timeout (float): seconds to wait for a response
+            keep_alive (bool): when False connections are closed after
+                each request
+            peers (list): REST API urls of instances asked for
+                configurations before the Product API
+            peer_auth (tuple): optional user and password authenticating
+                requests to peers
+            compact_encoding (bool): whether configurations may be received
+                in a compact binary encoding, see `wire`
+        """
         super().__init__()
         self.logger = get_nio_logger("DeploymentManager")
 
         self._url_prefix = url_prefix
         self._manager = manager
+        # bytes received from the Product API, as transferred, in total
+        # and by the calling thread
+        self.bytes_received = 0
+        self._received_lock = Lock()
+        self._received = local()
+        self._timeout = (connect_timeout, read_timeout)
+        self._keep_alive = keep_alive
+        self._peers = [peer.rstrip("/") for peer in peers or []]
+        self._peer_auth = peer_auth
+        self._configuration_headers = {
+            "accept": accept_header(compact_encoding),
+            "accept-encoding": ACCEPT_ENCODING
+        }
+
+        self._session = requests.Session()
+        # without keep-alive the Product API closes connections after each
+        # response, which the pool may only find out when reusing one,
+        # idempotent requests are then sent again on a new connection
+        retries = 0 if keep_alive else Retry(
+            total=1, connect=1, read=1, redirect=False, status=0)
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size, max_retries=retries)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        # the event stream holds its connection for as long as it is open,
+        # it has a session of its own so that it does not take one of the
+        # pooled connections
+        self._stream_session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        self._stream_session.mount("http://", adapter)
+        self._stream_session.mount("https://", adapter)
+
+    def close(self):
+        """ Closes pooled connections """
+        self._session.close()
+        self._stream_session.close()
 
-    def get_instance_config_ids(self):
+    def get_instance_config_ids(self, validators=None, wait=0,
+                                instance_id=None):
         """ Gets the conf id and conf version id the instance should be running
 
-        Returns: an object with format
+        Args:
+            validators (dict): optional "etag" and "last_modified" values
+                from a previous response, sent as conditional request
+                headers. The dict is updated in place with the validators
+                of the new response.
+            wait (int): seconds the Product API may hold the request
+                waiting for the configuration to change (long-poll)
+            instance_id (str): optional, instance to get ids for, defaults
+                to the instance of the manager
+
+        Returns: None when the configuration did not change since the
+            validators were issued, otherwise an object with format
             {
                 "instance_configuration_id": "uuid..",
                 "instance_configuration_version_id": "uuid..",
@@ -26,13 +124,25 @@ class DeploymentProxy(object):
             }
         """
         url = "{}/instances/{}/configuration".format(
-            self._url_prefix, self._manager.instance_id)
+            self._url_prefix, instance_id or self._manager.instance_id)
+        headers = {}
+        kwargs = {}
+        if wait:
+            kwargs["params"] = {"wait": wait}
+            kwargs["timeout"] = (self._timeout[0], self._timeout[1] + wait)
+        if validators:
+            if validators.get("etag"):
+                headers["if-none-match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["if-modified-since"] = validators["last_modified"]
         try:
-            return self._request(
-                fn=requests.get,
+            response = self._send(
+                fn=self._session.get,
                 url=url,
                 failed_msg=("Failed to get configuration version the instance "
-                            "should be running")
+                            "should be running"),
+                headers=headers,
+                **kwargs
             )
         except HTTPError as e:
             if e.response.status_code == 404:
@@ -44,6 +154,98 @@ class DeploymentProxy(object):
                     e.response.json().get(
                         "message", "No error message provided")))
                 raise
+            return
+
+        self._count_received(response)
+        if validators is not None:
+            validators["etag"] = response.headers.get("etag")
+            validators["last_modified"] = response.headers.get(
+                "last-modified")
+        if response.status_code == 304:
+            self.logger.debug("Instance configuration not modified")
+            return
+        return response.json()
+
+    def open_event_stream(self, last_event_id=None):
+        """ Opens the stream of deployment events pushed to the instance
+
+        The Product API is expected to send a comment at least every
+        read timeout to keep the stream alive
+
+        Args:
+            last_event_id (str): optional, id of the last event received
+                on a previous stream
+
+        Returns:
+            response (requests.Response): streamed Server-Sent Events
+                response, to be closed by the caller
+        """
+        url = "{}/instances/{}/events".format(
+            self._url_prefix, self._manager.instance_id)
+        headers = {"accept": "text/event-stream"}
+        if last_event_id:
+            headers["last-event-id"] = last_event_id
+        return self._send(
+            fn=self._stream_session.get,
+            url=url,
+            failed_msg="Failed to open deployment event stream",
+            headers=headers,
+            stream=True)
+
+    def get_instances_config_ids(self, instance_ids):
+        """ Gets the conf ids several instances should be running, in one
+        request
+
+        Args:
+            instance_ids (list): ids of the instances
+
+        Returns: None when the Product API does not answer batched
+            requests, otherwise the ids by instance id, as returned by
+            `get_instance_config_ids`, None for instances without a
+            desired configuration
+        """
+        url = "{}/instances/configurations".format(self._url_prefix)
+        try:
+            response = self._send(
+                fn=self._session.get,
+                url=url,
+                failed_msg=("Failed to get configuration versions the "
+                            "instances should be running"),
+                params={"ids": ",".join(instance_ids)})
+        except HTTPError as e:
+            if e.response.status_code in (404, 405, 501):
+                return None
+            raise
+        self._count_received(response)
+        instances = response.json().get("instances") or {}
+        return {instance_id: instances.get(instance_id)
+                for instance_id in instance_ids}
+
+    def get_desired_fingerprint(self):
+        """ Gets the fingerprint of the configuration ids the instance
+        should be running, see `desired_fingerprint`
+
+        Only headers are requested, which is cheaper than getting the ids
+
+        Returns:
+            fingerprint (str), empty when no configuration is desired, None
+                when the Product API does not provide fingerprints
+        """
+        url = "{}/instances/{}/configuration".format(
+            self._url_prefix, self._manager.instance_id)
+        try:
+            response = self._send(
+                fn=self._session.head,
+                url=url,
+                failed_msg=("Failed to get fingerprint of configuration the "
+                            "instance should be running"))
+        except HTTPError as e:
+            if e.response.status_code == 404:
+                return ""
+            if e.response.status_code in (405, 501):
+                return None
+            raise
+        return response.headers.get("x-configuration-fingerprint")
 
     def set_reported_configuration(
             self,
@@ -73,7 +275,7 @@ class DeploymentProxy(object):
             "message": message,
         }
         return self._request(
-            fn=requests.post,
+            fn=self._session.post,
             url=url,
             failed_msg=("Failed to post new configuration version "
                         "instance is running"),
@@ -100,22 +302,209 @@ class DeploymentProxy(object):
                 "uuid": "uuid..",
                 "version_num": "v1.0.0"
             }
+            only holding "configuration_data" when provided by a peer.
+            "configuration_data" is a JSON string unless received in a
+            compact encoding
         """
+        from_peer = self.get_peer_configuration(config_id, config_version_id)
+        if from_peer is not None:
+            return {"configuration_data": from_peer[0]}
         url = "{}/instance_configurations/{}/versions/{}".format(
             self._url_prefix, config_id, config_version_id)
-        return self._request(
-            fn=requests.get,
+        response = self._send(
+            fn=self._session.get,
             url=url,
-            failed_msg="Failed to get instance configuration")
+            failed_msg="Failed to get instance configuration",
+            headers=self._configuration_headers)
+        decode = DECODERS.get(media_type(response.headers))
+        result = decode(response.content) if decode else response.json()
+        self._count_received(response)
+        return result
+
+    def get_configuration_patch(self, config_id, from_version_id,
+                                config_version_id):
+        """  Retrieves a JSON Patch (RFC 6902) between configuration versions
+
+        Args:
+            config_id (str): instance configuration id
+            from_version_id (str): instance configuration version id the
+                patch applies to
+            config_version_id (str): instance configuration version id the
+                patch results in
+
+        Returns: None when the Product API does not provide the patch,
+            otherwise an object with format
+            {
+                "patch": [{"op": "replace", "path": "/blocks/..", ...}],
+                "checksum": "sha256 of resulting configuration data.."
+            }
+        """
+        url = "{}/instance_configurations/{}/versions/{}/patch".format(
+            self._url_prefix, config_id, config_version_id)
+        try:
+            return self._request(
+                fn=self._session.get,
+                url=url,
+                failed_msg="Failed to get instance configuration patch",
+                params={"from": from_version_id})
+        except HTTPError as e:
+            if e.response.status_code in (400, 404, 405, 501):
+                self.logger.debug(
+                    "Instance configuration patch not available")
+                return None
+            raise
+
+    def stream_configuration(self, config_id, config_version_id, sink=None,
+                             chunk_size=65536):
+        """  Retrieves an instance configuration decoding it while received
+
+        Compressed responses are decoded transparently, a response in a
+        compact encoding is decoded once received
+
+        Args:
+            config_id (str): instance configuration id
+            config_version_id (str): instance configuration version id
+            sink (callable): optional, invoked with each piece of
+                configuration data text as received
+            chunk_size (int): size of response chunks read
+
+        Returns: configuration, same as `get_configuration` except that
+            "configuration_data" is decoded into a dict
+        """
+        from_peer = self.get_peer_configuration(config_id, config_version_id)
+        if from_peer is not None:
+            if sink:
+                sink(from_peer[0])
+            return {"configuration_data": from_peer[1]}
+        url = "{}/instance_configurations/{}/versions/{}".format(
+            self._url_prefix, config_id, config_version_id)
+        response = self._send(
+            fn=self._session.get,
+            url=url,
+            failed_msg="Failed to get instance configuration",
+            headers=self._configuration_headers,
+            stream=True)
+        try:
+            decode = DECODERS.get(media_type(response.headers))
+            if decode:
+                configuration = decode(response.content)
+                if sink:
+                    sink(json.dumps(configuration["configuration_data"]))
+                return configuration
+            decoder = codecs.getincrementaldecoder(
+                response.encoding or "utf-8")()
+            parser = EnvelopeParser(sink)
+            for chunk in response.iter_content(chunk_size):
+                parser.feed(decoder.decode(chunk))
+            parser.feed(decoder.decode(b"", final=True))
+            return parser.close()
+        finally:
+            self._count_received(response)
+            response.close()
+
+    def get_configuration_checksum(self, config_id, config_version_id):
+        """ Gets the checksum of a configuration version, see
+        `patch.checksum`
+
+        Only headers are requested
+
+        Returns:
+            checksum (str), None when the Product API does not provide it
+        """
+        url = "{}/instance_configurations/{}/versions/{}".format(
+            self._url_prefix, config_id, config_version_id)
+        try:
+            response = self._send(
+                fn=self._session.head,
+                url=url,
+                failed_msg="Failed to get instance configuration checksum")
+        except HTTPError as e:
+            if e.response.status_code in (404, 405, 501):
+                return None
+            raise
+        return response.headers.get("x-configuration-checksum")
+
+    def get_peer_configuration(self, config_id, config_version_id):
+        """ Gets a configuration version from the first peer having it
+
+        A configuration is only accepted when it matches the checksum the
+        Product API provides, peers are not asked when it does not
+
+        Returns:
+            (text, decoded) configuration data, None when no peer provided
+                it
+        """
+        if not self._peers:
+            return None
+        try:
+            expected = self.get_configuration_checksum(
+                config_id, config_version_id)
+        except RequestException:
+            self.logger.warning(
+                "Failed to get checksum of config ID {} version {}, peers "
+                "are not asked for it".format(config_id, config_version_id))
+            return None
+        if expected is None:
+            return None
+        for peer in self._peers:
+            url = "{}/config/versions/{}/{}".format(
+                peer, config_id, config_version_id)
+            try:
+                response = self._session.get(
+                    url, auth=self._peer_auth, timeout=self._timeout)
+                response.raise_for_status()
+                text = response.text
+                configuration_data = json.loads(text)
+            except (RequestException, ValueError) as e:
+                self.logger.debug(
+                    "Peer {} did not provide configuration: {}".format(
+                        peer, e))
+                continue
+            if checksum(configuration_data) != expected:
+                self.logger.warning(
+                    "Configuration provided by peer {} does not match its "
+                    "checksum".format(peer))
+                continue
+            self.logger.info(
+                "Got config ID {} version {} from peer {}".format(
+                    config_id, config_version_id, peer))
+            return text, configuration_data
+        return None
 
     def _request(self, fn, url, failed_msg, **kwargs):
-        headers = {
+        response = self._send(fn, url, failed_msg, **kwargs)
+        result = response.json()
+        self._count_received(response)
+        return result
+
+    def received_bytes(self):
+        """ Provides the number of bytes the calling thread received from
+        the Product API, requests of other threads are not counted so that
+        the difference between two calls is what the thread received
+        """
+        return getattr(self._received, "bytes", 0)
+
+    def _count_received(self, response):
+        # bytes read from the wire, before any content decoding
+        received = response.raw.tell()
+        self._received.bytes = self.received_bytes() + received
+        with self._received_lock:
+            self.bytes_received += received
+
+    def _send(self, fn, url, failed_msg, headers=None, timeout=None,
+              **kwargs):
+        headers = dict(headers or {})
+        headers.update({
             "authorization": "apikey {}".format(self._manager.api_key),
             "content-type": "application/json"
-        }
+        })
+        if not self._keep_alive:
+            headers["connection"] = "close"
         try:
-            response = fn(url, headers=headers, **kwargs)
+            response = fn(url, headers=headers,
+                          timeout=timeout or self._timeout, **kwargs)
         except ConnectionError:
             self.logger.exception(failed_msg)
+            raise
         response.raise_for_status()
-        return response.json()
+        return response
@@ -0,0 +1,181 @@
+"""
+
+   Deployments pushed by the Product API
+
+"""
+import codecs
+import json
+import random
+from threading import Condition, Thread
+
+from nio.util.logging import get_nio_logger
+
+
+class PushChannel(object):
+    """ Receives deployments over a long-lived Server-Sent Events stream
+
+    The stream is opened by the instance, so no inbound connection is
+    needed. Each "deployment" event holds the desired configuration ids as
+    JSON data. On connecting, the Product API sends the current desired
+    configuration ids unless the Last-Event-ID header names the latest
+    event. A stream that fails or ends is opened again after a delay
+    doubling from `retry_interval` (or the `retry` the stream asked for)
+    up to `max_retry_interval`, randomized so that instances disconnected
+    together do not reconnect together. The delay is reset once an event
+    is received.
+    """
+
+    def __init__(self, open_stream, on_event, retry_interval=1,
+                 max_retry_interval=60):
+        """ Create a push channel
+
+        Args:
+            open_stream (callable): opens the event stream, invoked with the
+                id of the last event received, returns a streamed response
+            on_event (callable): invoked with the data of each deployment
+                event, decoded
+            retry_interval (float): seconds to wait after first failure
+            max_retry_interval (float): max seconds to wait between retries
+        """
+        super().__init__()
+        self.logger = get_nio_logger("DeploymentManager")
+
+        self._open_stream = open_stream
+        self._on_event = on_event
+        self._retry_interval = retry_interval
+        self._max_retry_interval = max_retry_interval
+
+        self._last_event_id = None
+        self._response = None
+        self._connected = False
+        self._errors = 0
+        self._condition = Condition()
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        self._stopped = False
+        self._thread = Thread(target=self._work, name="PushChannel",
+                              daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """ Closes the stream
+
+        Args:
+            timeout (float): seconds to wait for an event being handled
+        """
+        with self._condition:
+            self._stopped = True
+            response = self._response
+            self._condition.notify_all()
+        if response is not None:
+            # unblocks the read of the stream
+            response.close()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    @property
+    def connected(self):
+        """ Whether the stream is open """
+        with self._condition:
+            return self._connected
+
+    def _work(self):
+        while True:
+            with self._condition:
+                if self._stopped:
+                    return
+            try:
+                self._receive()
+                self.logger.info("Push channel closed by Product API")
+            except Exception:
+                with self._condition:
+                    if self._stopped:
+                        return
+                self.logger.warning(
+                    "Push channel failed", exc_info=True)
+            with self._condition:
+                self._errors += 1
+                delay = min(
+                    self._retry_interval * 2 ** (self._errors - 1),
+                    self._max_retry_interval)
+                delay *= random.uniform(0.5, 1)
+                self.logger.info(
+                    "Reconnecting push channel in {:.1f}s".format(delay))
+                self._condition.wait_for(lambda: self._stopped, delay)
+
+    def _receive(self):
+        """ Opens the stream and handles its events until it ends """
+        response = self._open_stream(self._last_event_id)
+        try:
+            with self._condition:
+                if self._stopped:
+                    return
+                self._response = response
+                self._connected = True
+            self.logger.info("Push channel connected")
+            for event in parse_events(response.iter_content(None)):
+                # a stream failing right after connecting keeps backing off
+                with self._condition:
+                    self._errors = 0
+                if event.get("retry") is not None:
+                    self._retry_interval = event["retry"]
+                if event.get("id") is not None:
+                    self._last_event_id = event["id"]
+                if event.get("event") == "deployment":
+                    self._handle(event.get("data"))
+        finally:
+            with self._condition:
+                self._connected = False
+                self._response = None
+            response.close()
+
+    def _handle(self, data):
+        try:
+            self._on_event(json.loads(data))
+        except Exception:
+            self.logger.exception(
+                "Failed to handle pushed deployment: {}".format(data))
+
+
+def parse_events(chunks):
+    """ Parses a Server-Sent Events stream
+
+    Args:
+        chunks (iterable): stream content bytes, as received
+
+    Yields:
+        event (dict): with "event" (defaults to "message") and "data",
+            along with "id" and "retry" (in seconds) when given
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+    fields = {}
+    data = []
+    for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            line = line[:-1] if line.endswith("\r") else line
+            if not line:
+                # blank line dispatches the event
+                if data or fields:
+                    event = dict(fields, data="\n".join(data))
+                    event.setdefault("event", "message")
+                    yield event
+                fields = {}
+                data = []
+                continue
+            if line.startswith(":"):
+                # comment, e.g. keep-alive
+                continue
+            name, _, value = line.partition(":")
+            value = value[1:] if value.startswith(" ") else value
+            if name == "data":
+                data.append(value)
+            elif name in ("event", "id"):
+                fields[name] = value
+            elif name == "retry" and value.isdigit():
+                fields["retry"] = int(value) / 1000
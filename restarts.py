@@ -0,0 +1,174 @@
+"""
+
+   Service restarts
+
+"""
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from nio.util.logging import get_nio_logger
+
+from .diff import service_blocks
+
+
+def service_dependencies(services, blocks):
+    """ Provides start order dependencies between services
+
+    A service executing a Subscriber block depends on the services
+    executing a Publisher block of the same topic, so that publishers run
+    by the time subscribers start and until they stopped
+
+    Args:
+        services (dict): services configuration keyed by id
+        blocks (dict): blocks configuration keyed by id
+
+    Returns:
+        dependencies (dict): ids of the services each service depends on
+    """
+    publishers = {}
+    subscriptions = {}
+    for service_id, service in services.items():
+        subscriptions[service_id] = set()
+        if not isinstance(service, dict):
+            continue
+        for block_id in service_blocks(service, blocks):
+            block = blocks[block_id]
+            topic = block.get("topic") if isinstance(block, dict) else None
+            if not isinstance(topic, str) or not topic:
+                continue
+            block_type = str(block.get("type")).rsplit(".", 1)[-1]
+            if block_type == "Publisher":
+                publishers.setdefault(topic, set()).add(service_id)
+            elif block_type == "Subscriber":
+                subscriptions[service_id].add(topic)
+    return {
+        service_id: {publisher for topic in topics
+                     for publisher in publishers.get(topic, ())
+                     if publisher != service_id}
+        for service_id, topics in subscriptions.items()}
+
+
+class ServiceRestarter(object):
+    """ Stops and starts services through a bounded pool of workers
+
+    Services start once the services they depend on started and stop once
+    the services depending on them stopped. A service is not started when
+    a service it depends on failed to start. A cycle of services depending
+    on each other is broken by letting the first of them go.
+    """
+
+    def __init__(self, service_manager, workers=4, clock=time.perf_counter):
+        """ Create a restarter
+
+        Args:
+            service_manager: provides start_service and stop_service,
+                invoked with a service id
+            workers (int): number of services stopped or started at once
+            clock (callable): provides the time in seconds
+        """
+        super().__init__()
+        self.logger = get_nio_logger("DeploymentManager")
+
+        self._service_manager = service_manager
+        self._workers = max(workers, 1)
+        self._clock = clock
+
+    def stop(self, service_ids, dependencies):
+        """ Stops services
+
+        Args:
+            service_ids (list): ids of services to stop
+            dependencies (dict): ids of the services each service depends
+                on, see `service_dependencies`
+
+        Returns:
+            outcomes (dict): by service id, as {"time": 0.1} or
+                {"time": 0.1, "error": "..."} when it failed
+        """
+        dependents = {}
+        for service_id, depends_on in dependencies.items():
+            for dependency in depends_on:
+                dependents.setdefault(dependency, set()).add(service_id)
+        return self._run(service_ids, "stop", dependents, skip_failed=False)
+
+    def start(self, service_ids, dependencies):
+        """ Starts services
+
+        Args:
+            service_ids (list): ids of services to start
+            dependencies (dict): ids of the services each service depends
+                on, see `service_dependencies`
+
+        Returns:
+            outcomes (dict): by service id, as {"time": 0.1} or
+                {"time": 0.1, "error": "..."} when it failed
+        """
+        return self._run(service_ids, "start", dependencies,
+                         skip_failed=True)
+
+    def _run(self, service_ids, action, dependencies, skip_failed):
+        """ Stops or starts services, each once those it waits for are done
+        """
+        waiting = {service_id: set() for service_id in service_ids}
+        for service_id in waiting:
+            waiting[service_id] = {
+                other for other in dependencies.get(service_id, ())
+                if other in waiting}
+        outcomes = {}
+        failed = set()
+        futures = {}
+        with ThreadPoolExecutor(self._workers) as pool:
+            while waiting or futures:
+                ready = [service_id for service_id, others in waiting.items()
+                         if not others]
+                if not ready and not futures:
+                    # a cycle, first service waiting is let go to break it
+                    self.logger.warning(
+                        "Services depend on each other: {}".format(
+                            ", ".join(waiting)))
+                    ready = [next(iter(waiting))]
+                skipped = False
+                for service_id in ready:
+                    del waiting[service_id]
+                    failed_dependencies = [
+                        other for other in dependencies.get(service_id, ())
+                        if other in failed]
+                    if skip_failed and failed_dependencies:
+                        outcomes[service_id] = {
+                            "time": 0,
+                            "error": "Service {} failed".format(
+                                failed_dependencies[0])
+                        }
+                        failed.add(service_id)
+                        self._done(waiting, service_id)
+                        skipped = True
+                        continue
+                    futures[pool.submit(
+                        self._timed, action, service_id)] = service_id
+                if skipped or not futures:
+                    continue
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    service_id = futures.pop(future)
+                    outcomes[service_id] = future.result()
+                    if "error" in outcomes[service_id]:
+                        failed.add(service_id)
+                    self._done(waiting, service_id)
+        return outcomes
+
+    @staticmethod
+    def _done(waiting, service_id):
+        for others in waiting.values():
+            others.discard(service_id)
+
+    def _timed(self, action, service_id):
+        start = self._clock()
+        try:
+            getattr(self._service_manager, "{}_service".format(action))(
+                service_id)
+        except Exception as e:
+            self.logger.exception(
+                "Failed to {} service {}".format(action, service_id))
+            return {"time": self._clock() - start,
+                    "error": str(e) or type(e).__name__}
+        return {"time": self._clock() - start}
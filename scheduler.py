@@ -0,0 +1,65 @@
+"""
+
+   Poll Scheduler
+
+"""
+import random
+
+
+class PollScheduler(object):
+    """ Computes delays between Product API polls
+
+    Delays are randomized by `jitter` so that instances started together do
+    not poll in lockstep, grow exponentially up to `max_interval` while
+    polls fail, and drop to `fast_interval` for `fast_polls` polls after a
+    deployment.
+    """
+
+    def __init__(self, interval, jitter=0.1, max_interval=None,
+                 fast_interval=None, fast_polls=0, rand=random.random):
+        """ Create a scheduler
+
+        Args:
+            interval (float): seconds between polls in steady state
+            jitter (float): fraction of a delay it is randomized by
+            max_interval (float): max seconds between polls while failing
+            fast_interval (float): seconds between polls after a deployment
+            fast_polls (int): number of fast polls after a deployment
+            rand (callable): provides random numbers in [0, 1)
+        """
+        super().__init__()
+        self._interval = interval
+        self._jitter = jitter
+        self._max_interval = max(max_interval or interval * 8, interval)
+        self._fast_interval = min(fast_interval or interval, interval)
+        self._fast_polls = fast_polls
+        self._rand = rand
+
+        self._errors = 0
+        self._fast_remaining = 0
+
+    @property
+    def errors(self):
+        """ Number of consecutive failed polls """
+        return self._errors
+
+    def success(self):
+        self._errors = 0
+
+    def failure(self):
+        self._errors += 1
+
+    def deployed(self):
+        self._fast_remaining = self._fast_polls
+
+    def next_delay(self):
+        """ Provides seconds to wait before next poll """
+        if self._errors:
+            delay = min(self._interval * 2 ** self._errors,
+                        self._max_interval)
+        elif self._fast_remaining:
+            self._fast_remaining -= 1
+            delay = self._fast_interval
+        else:
+            delay = self._interval
+        return delay * (1 + self._jitter * (2 * self._rand() - 1))
@@ -0,0 +1,93 @@
+"""
+
+   Configuration staging
+
+"""
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from nio.util.logging import get_nio_logger
+
+# a configuration ready to be applied, validation `errors` are in update
+# result format and `fingerprints` as computed by the diff module
+StagedConfiguration = namedtuple(
+    "StagedConfiguration", ["configuration_data", "errors", "fingerprints"])
+
+
+class ConfigurationStager(object):
+    """ Prepares an upcoming configuration version in the background
+
+    Only one version is staged at a time, staging a version replaces the
+    version staged before. Preparing a version is left to `prepare` which
+    is expected to download, decode and validate it.
+    """
+
+    def __init__(self, prepare):
+        """ Create a stager
+
+        Args:
+            prepare (callable): invoked with (config_id, config_version_id),
+                returns a StagedConfiguration
+        """
+        super().__init__()
+        self.logger = get_nio_logger("DeploymentManager")
+
+        self._prepare = prepare
+        self._pool = ThreadPoolExecutor(1)
+        self._key = None
+        self._future = None
+        self._lock = Lock()
+
+    def stop(self):
+        with self._lock:
+            self._discard()
+        self._pool.shutdown(wait=False)
+
+    @property
+    def staged(self):
+        """ (config_id, config_version_id) being staged or staged """
+        return self._key
+
+    def stage(self, config_id, config_version_id):
+        """ Starts preparing a version unless it is staged already """
+        key = (config_id, config_version_id)
+        with self._lock:
+            if key == self._key:
+                return
+            self._discard()
+            self.logger.info("Staging config ID {} version {}".format(
+                config_id, config_version_id))
+            self._key = key
+            self._future = self._pool.submit(self._run, *key)
+
+    def take(self, config_id, config_version_id):
+        """ Provides a staged version, waiting for it to be prepared
+
+        Returns:
+            StagedConfiguration, None when version is not staged or could
+                not be prepared
+        """
+        with self._lock:
+            if (config_id, config_version_id) != self._key:
+                return None
+            future = self._future
+            self._key = self._future = None
+        try:
+            return future.result()
+        except Exception:
+            return None
+
+    def _discard(self):
+        if self._future:
+            self._future.cancel()
+        self._key = self._future = None
+
+    def _run(self, config_id, config_version_id):
+        try:
+            return self._prepare(config_id, config_version_id)
+        except Exception:
+            self.logger.exception(
+                "Failed to stage config ID {} version {}".format(
+                    config_id, config_version_id))
+            raise
@@ -0,0 +1,153 @@
+"""
+
+   Deployment state
+
+"""
+import time
+from threading import Lock, Timer
+
+from nio.modules.persistence import Persistence
+from nio.util.logging import get_nio_logger
+
+
+class DeploymentState(object):
+    """ Deployment state of the instance, persisted as a single record
+
+    The record is read once when loaded and kept in memory, changes are
+    persisted `delay` seconds after the first of them so that a burst of
+    changes is written at once. Flushing writes pending changes right away.
+
+    Persisted record:
+        {
+            "config_id": "..",
+            "config_version_id": "..",
+            "deployment_id": "..",
+            # conditional request validators and desired configuration
+            # fingerprint, each with the running ids they were stored for
+            "validators": {"config_id": .., "config_version_id": ..,
+                           "etag": .., "last_modified": ..},
+            "desired_fingerprint": {"config_id": ..,
+                                    "config_version_id": ..,
+                                    "fingerprint": ..},
+            # fingerprints of running configuration objects, None when not
+            # known
+            "fingerprints": {"blocks": {"id": ".."}, ...},
+            "deployed_at": 1700000000.0,
+            "saved_at": 1700000000.0
+        }
+    """
+
+    _persistence_key = "deployment_state"
+    _fields = ("config_id", "config_version_id", "deployment_id",
+               "validators", "desired_fingerprint", "fingerprints",
+               "deployed_at")
+    _legacy_keys = ("configuration_id", "configuration_version_id")
+
+    def __init__(self, delay=0):
+        """ Create a deployment state
+
+        Args:
+            delay (float): seconds changes wait to be persisted, 0 persists
+                them right away
+        """
+        super().__init__()
+        self.logger = get_nio_logger("DeploymentManager")
+
+        self._delay = delay
+        self._values = {field: None for field in self._fields}
+        self._lock = Lock()
+        self._timer = None
+        self._dirty = False
+
+    def load(self, config_id=None, config_version_id=None):
+        """ Reads persisted state, migrating state persisted under separate
+        keys by earlier versions
+
+        Args:
+            config_id (str): configuration id when none was persisted
+            config_version_id (str): configuration version id when none was
+                persisted
+        """
+        record = Persistence().load(self._persistence_key, default=None)
+        migrated = False
+        if record is None:
+            record = self._load_legacy()
+            migrated = record is not None
+        with self._lock:
+            self._values = {field: (record or {}).get(field)
+                            for field in self._fields}
+            if self._values["config_id"] is None and \
+                    self._values["config_version_id"] is None:
+                self._values["config_id"] = config_id
+                self._values["config_version_id"] = config_version_id
+            self._dirty = migrated
+        if migrated:
+            self.logger.info("Migrating persisted deployment state")
+            self.flush()
+            # only once the record replacing them was written
+            self._remove_legacy()
+
+    @staticmethod
+    def _load_legacy():
+        """ Provides a record out of the ids earlier versions persisted,
+        None when there are none
+        """
+        persistence = Persistence()
+        config_id = persistence.load("configuration_id", default=None)
+        config_version_id = persistence.load(
+            "configuration_version_id", default=None)
+        if config_id is None and config_version_id is None:
+            return None
+        return {
+            "config_id": config_id,
+            "config_version_id": config_version_id
+        }
+
+    @classmethod
+    def _remove_legacy(cls):
+        """ Removes the keys earlier versions persisted ids under """
+        persistence = Persistence()
+        for key in cls._legacy_keys:
+            persistence.remove(key)
+
+    def __getattr__(self, name):
+        if name in DeploymentState._fields:
+            return self._values[name]
+        raise AttributeError(name)
+
+    def update(self, **values):
+        """ Changes state, persisted once the delay elapsed
+
+        Args:
+            values: new values of state fields
+        """
+        for name in values:
+            if name not in self._fields:
+                raise AttributeError(name)
+        with self._lock:
+            changed = {name: value for name, value in values.items()
+                       if self._values[name] != value}
+            if not changed:
+                return
+            if {"config_id", "config_version_id"} & set(changed):
+                changed.setdefault("deployed_at", time.time())
+            self._values.update(changed)
+            self._dirty = True
+            if self._delay and self._timer is None:
+                self._timer = Timer(self._delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if not self._delay:
+            self.flush()
+
+    def flush(self):
+        """ Persists pending changes, in one write """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._dirty:
+                return
+            record = dict(self._values, saved_at=time.time())
+            Persistence().save(record, self._persistence_key)
+            self._dirty = False
@@ -0,0 +1,302 @@
+"""
+
+   Streaming configuration decoding
+
+"""
+import json
+import re
+from json.decoder import scanstring
+
+from .diff import SECTIONS
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_NUMBER_TAIL = re.compile(r"[0-9.eE+-]*")
+# content of a JSON string up to its closing quote, stops before an escape
+# sequence which is not complete yet. A surrogate pair escape is only
+# consumed as a whole so that both halves are unescaped together
+_STRING_CONTENT = re.compile(
+    r'(?:[^"\\]+'
+    r'|\\["\\/bfnrt]'
+    r'|\\u[dD][89abAB][0-9a-fA-F]{2}\\u[dD][c-fC-F][0-9a-fA-F]{2}'
+    r'|\\u(?![dD][89abAB])[0-9a-fA-F]{4})*')
+# consumed text kept in buffer before it is discarded
+_TRIM_SIZE = 65536
+
+
+class _NeedMore(Exception):
+    """ Raised when buffered text ends before the next token is complete """
+
+
+class _IncrementalParser(object):
+    """ Base class for parsers fed JSON text in arbitrary pieces """
+
+    def __init__(self):
+        super().__init__()
+        self.done = False
+        self._buffer = ""
+        self._pos = 0
+        self._closing = False
+        # keys are shared among decoded objects the way json.loads shares
+        # them within a document, objects are decoded one at a time here
+        self._keys = {}
+        self._decoder = json.JSONDecoder(
+            object_pairs_hook=self._make_object)
+
+    def _make_object(self, pairs):
+        keys = self._keys
+        return {keys.setdefault(key, key): value for key, value in pairs}
+
+    def feed(self, text):
+        """ Parses as much of given text as possible
+
+        Returns:
+            text following the parsed JSON object once it is complete
+        """
+        if self.done:
+            return text
+        self._buffer += text
+        try:
+            self._parse()
+        except _NeedMore:
+            pass
+        if self.done:
+            leftover = self._buffer[self._pos:]
+            self._buffer = ""
+            self._pos = 0
+            return leftover
+        if self._pos > _TRIM_SIZE:
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+        return ""
+
+    def close(self):
+        """ Ends input, raises ValueError if the JSON object is incomplete
+        """
+        self._closing = True
+        if not self.done:
+            try:
+                self._parse()
+            except _NeedMore:
+                pass
+        if not self.done:
+            raise ValueError("Incomplete configuration at: {!r}".format(
+                self._buffer[self._pos:self._pos + 80]))
+
+    def _parse(self):
+        raise NotImplementedError
+
+    def _peek(self):
+        """ Skips whitespace and provides next character """
+        self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+        if self._pos >= len(self._buffer):
+            self._need_more()
+        return self._buffer[self._pos]
+
+    def _expect(self, characters):
+        character = self._peek()
+        if character not in characters:
+            raise ValueError("Expected one of {!r} at: {!r}".format(
+                characters, self._buffer[self._pos:self._pos + 80]))
+        self._pos += 1
+        return character
+
+    def _key(self):
+        self._expect('"')
+        try:
+            key, end = scanstring(self._buffer, self._pos)
+        except json.JSONDecodeError:
+            # unterminated key, wait for rest of it
+            self._need_more()
+        self._pos = end
+        self._expect(":")
+        return key
+
+    def _value(self):
+        self._peek()
+        try:
+            value, end = self._decoder.raw_decode(self._buffer, self._pos)
+        except json.JSONDecodeError:
+            if self._closing:
+                raise
+            self._need_more()
+        # a number or literal at the end of buffer may continue
+        if not self._closing and \
+           _NUMBER_TAIL.match(self._buffer, end).end() == len(self._buffer):
+            self._need_more()
+        self._pos = end
+        return value
+
+    def _need_more(self):
+        if self._closing:
+            raise ValueError("Incomplete configuration at: {!r}".format(
+                self._buffer[self._pos:self._pos + 80]))
+        raise _NeedMore()
+
+
+class ConfigurationParser(_IncrementalParser):
+    """ Incrementally parses configuration data
+
+    Objects in blocks, services and blockTypes are decoded one at a time as
+    soon as their text is complete, so the whole configuration text never
+    has to be held in memory.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.configuration = {}
+        self._state = "start"
+        self._section = None
+
+    def _parse(self):
+        while not self.done:
+            if self._state == "start":
+                self._expect("{")
+                self._state = "first_key"
+            elif self._state in ("first_key", "key"):
+                if self._state == "first_key" and self._peek() == "}":
+                    self._pos += 1
+                    self.done = True
+                    break
+                start = self._pos
+                try:
+                    key = self._key()
+                    if key in SECTIONS and self._peek() == "{":
+                        self._pos += 1
+                        self._section = self.configuration[key] = {}
+                        self._state = "first_object"
+                    else:
+                        self.configuration[key] = self._value()
+                        self._state = "next"
+                except _NeedMore:
+                    # member is parsed again once its text is complete
+                    self._pos = start
+                    raise
+            elif self._state == "next":
+                if self._expect(",}") == "}":
+                    self.done = True
+                else:
+                    self._state = "key"
+            elif self._state in ("first_object", "object"):
+                if self._state == "first_object" and self._peek() == "}":
+                    self._pos += 1
+                    self._state = "next"
+                    continue
+                start = self._pos
+                try:
+                    key = self._key()
+                    self._section[key] = self._value()
+                except _NeedMore:
+                    # object is parsed again once its text is complete
+                    self._pos = start
+                    raise
+                self._state = "next_object"
+            elif self._state == "next_object":
+                if self._expect(",}") == "}":
+                    self._state = "next"
+                else:
+                    self._state = "object"
+
+
+class EnvelopeParser(_IncrementalParser):
+    """ Incrementally parses a Product API configuration response
+
+    The embedded configuration data, provided either as a JSON encoded
+    string or as an object, is decoded through a ConfigurationParser while
+    it is received.
+
+    Args:
+        sink (callable): optional, invoked with each piece of configuration
+            data text as received
+    """
+
+    def __init__(self, sink=None):
+        super().__init__()
+        self.envelope = {}
+        self._sink = sink
+        self._configuration = None
+        self._state = "start"
+
+    def close(self):
+        """ Ends input
+
+        Returns:
+            envelope (dict): response with "configuration_data" decoded
+        """
+        super().close()
+        return self.envelope
+
+    def _parse(self):
+        while not self.done:
+            if self._state == "start":
+                self._expect("{")
+                self._state = "first_key"
+            elif self._state in ("first_key", "key"):
+                if self._state == "first_key" and self._peek() == "}":
+                    self._pos += 1
+                    self.done = True
+                    break
+                start = self._pos
+                try:
+                    key = self._key()
+                    if key == "configuration_data" and self._peek() in '"{':
+                        self._configuration = ConfigurationParser()
+                        if self._buffer[self._pos] == '"':
+                            self._pos += 1
+                            self._state = "data_string"
+                        else:
+                            self._state = "data_object"
+                        continue
+                    self.envelope[key] = self._value()
+                    self._state = "next"
+                except _NeedMore:
+                    # member is parsed again once its text is complete
+                    self._pos = start
+                    raise
+            elif self._state == "next":
+                if self._expect(",}") == "}":
+                    self.done = True
+                else:
+                    self._state = "key"
+            elif self._state == "data_string":
+                end = _STRING_CONTENT.match(self._buffer, self._pos).end()
+                if end > self._pos:
+                    text = json.loads(
+                        '"{}"'.format(self._buffer[self._pos:end]))
+                    self._pos = end
+                    self._feed_configuration(text)
+                if end == len(self._buffer):
+                    self._need_more()
+                if self._buffer[end] != '"':
+                    # an escape sequence split across pieces is at most
+                    # a surrogate pair long
+                    if len(self._buffer) - end < 12:
+                        self._need_more()
+                    raise ValueError("Invalid escape at: {!r}".format(
+                        self._buffer[end:end + 12]))
+                self._pos += 1
+                self._end_configuration()
+            elif self._state == "data_object":
+                text = self._buffer[self._pos:]
+                self._pos = len(self._buffer)
+                leftover = self._configuration.feed(text)
+                if self._sink:
+                    self._sink(text[:len(text) - len(leftover)])
+                if not self._configuration.done:
+                    self._need_more()
+                # rest of envelope follows configuration object
+                self._buffer = leftover
+                self._pos = 0
+                self._end_configuration()
+
+    def _feed_configuration(self, text):
+        if self._sink:
+            self._sink(text)
+        if self._configuration.feed(text).strip():
+            raise ValueError("Unexpected text following configuration data")
+
+    def _end_configuration(self):
+        self._configuration.close()
+        self.envelope["configuration_data"] = \
+            self._configuration.configuration
+        self._configuration = None
+        self._state = "next"
@@ -20,3 +20,8 @@ class TestAccess(NIOTestCase):
                 handler.on_put(Mock(spec=Request), Mock(spec=Response))
 
             self.assertEqual(patched_authorize.call_count, 1)
+
+            with self.assertRaises(Unauthorized):
+                handler.on_get(Mock(spec=Request), Mock(spec=Response))
+
+            self.assertEqual(patched_authorize.call_count, 2)
@@ -0,0 +1,92 @@
+import json
+import os
+import tempfile
+import time
+
+from nio.testing.test_case import NIOTestCase
+
+from ..cache import ConfigurationCache
+
+
+class TestConfigurationCache(NIOTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._dir.cleanup()
+        super().tearDown()
+
+    def test_get_put(self):
+        cache = ConfigurationCache(self._dir.name, 1024)
+        self.assertIsNone(cache.get("cfg_id", "cfg_version_id"))
+        cache.put("cfg_id", "cfg_version_id", '{"blocks": {}}')
+        self.assertEqual(
+            cache.get("cfg_id", "cfg_version_id"), '{"blocks": {}}')
+        self.assertIsNone(cache.get("cfg_id", "cfg_version_id_2"))
+
+        # a new cache instance reads previously stored entries
+        cache = ConfigurationCache(self._dir.name, 1024)
+        self.assertEqual(
+            cache.get("cfg_id", "cfg_version_id"), '{"blocks": {}}')
+
+    def test_corrupted_entry(self):
+        cache = ConfigurationCache(self._dir.name, 1024)
+        cache.put("cfg_id", "cfg_version_id", '{"blocks": {}}')
+        file_name = os.path.join(
+            self._dir.name,
+            [name for name in os.listdir(self._dir.name)
+             if name.endswith(".json")][0])
+        with open(file_name, "w") as f:
+            f.write('{"blocks": {"changed": {}}}')
+
+        self.assertIsNone(cache.get("cfg_id", "cfg_version_id"))
+        self.assertEqual(os.listdir(self._dir.name), [])
+
+    def test_lru_eviction(self):
+        data = json.dumps({"blocks": {"block": "x" * 200}})
+        cache = ConfigurationCache(self._dir.name, 500)
+        cache.put("cfg_id", "v1", data)
+        time.sleep(0.01)
+        cache.put("cfg_id", "v2", data)
+        time.sleep(0.01)
+        # v1 becomes most recently used
+        self.assertIsNotNone(cache.get("cfg_id", "v1"))
+        time.sleep(0.01)
+        cache.put("cfg_id", "v3", data)
+
+        self.assertIsNotNone(cache.get("cfg_id", "v1"))
+        self.assertIsNone(cache.get("cfg_id", "v2"))
+        self.assertIsNotNone(cache.get("cfg_id", "v3"))
+
+    def test_pinned(self):
+        """ The pinned entry is not evicted however old it is """
+        data = json.dumps({"blocks": {"block": "x" * 200}})
+        cache = ConfigurationCache(self._dir.name, 500)
+        cache.put("cfg_id", "v1", data)
+        cache.pin("cfg_id", "v1")
+        for version in ("v2", "v3"):
+            time.sleep(0.01)
+            cache.put("cfg_id", version, data)
+
+        self.assertIsNotNone(cache.get("cfg_id", "v1"))
+        self.assertIsNone(cache.get("cfg_id", "v2"))
+        self.assertIsNotNone(cache.get("cfg_id", "v3"))
+
+    def test_writer(self):
+        cache = ConfigurationCache(self._dir.name, 1024)
+        writer = cache.writer("cfg_id", "cfg_version_id")
+        writer.write('{"blocks": ')
+        writer.write('{}}')
+        # nothing is cached before writer is committed
+        self.assertIsNone(cache.get("cfg_id", "cfg_version_id"))
+        writer.commit()
+        self.assertEqual(
+            cache.get("cfg_id", "cfg_version_id"), '{"blocks": {}}')
+
+        writer = cache.writer("cfg_id", "cfg_version_id_2")
+        writer.write('{"blocks": ')
+        writer.discard()
+        self.assertIsNone(cache.get("cfg_id", "cfg_version_id_2"))
+        self.assertEqual(len(os.listdir(self._dir.name)), 2)
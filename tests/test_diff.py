@@ -0,0 +1,97 @@
+from nio.testing.test_case import NIOTestCase
+
+from ..diff import ConfigurationDiff, fingerprint, service_blocks
+
+
+class TestConfigurationDiff(NIOTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._configuration = {
+            "version": "1.0.0",
+            "blockTypes": {"type1": {"name": "Type1"}},
+            "blocks": {
+                "block1": {"type": "type1", "name": "block1"},
+                "block2": {"type": "type1", "name": "block2"},
+            },
+            "services": {
+                "service1": {"name": "service1", "execution": []},
+            }
+        }
+
+    def test_fingerprint(self):
+        """ Fingerprints do not depend on key order """
+        self.assertEqual(fingerprint({"a": 1, "b": [1, 2]}),
+                         fingerprint({"b": [1, 2], "a": 1}))
+        self.assertNotEqual(fingerprint({"a": 1}), fingerprint({"a": 2}))
+
+    def test_full(self):
+        diff = ConfigurationDiff(self._configuration)
+        self.assertTrue(diff.is_full)
+        self.assertFalse(diff.has_removals)
+        self.assertIs(diff.delta(), self._configuration)
+        self.assertEqual(set(diff.fingerprints["blocks"]),
+                         {"block1", "block2"})
+
+    def test_delta(self):
+        previous = ConfigurationDiff(self._configuration).fingerprints
+
+        self._configuration["blocks"]["block1"]["name"] = "renamed"
+        self._configuration["blocks"]["block3"] = {"type": "type1"}
+        del self._configuration["blocks"]["block2"]
+        diff = ConfigurationDiff(self._configuration, previous)
+
+        self.assertFalse(diff.is_full)
+        self.assertTrue(diff.has_removals)
+        self.assertEqual(diff.added["blocks"], ["block3"])
+        self.assertEqual(diff.changed["blocks"], ["block1"])
+        self.assertEqual(diff.removed["blocks"], ["block2"])
+        self.assertEqual(diff.count(diff.changed), 1)
+        self.assertDictEqual(diff.delta(), {
+            "version": "1.0.0",
+            "blockTypes": {},
+            "blocks": {
+                "block1": {"type": "type1", "name": "renamed"},
+                "block3": {"type": "type1"},
+            },
+            "services": {}
+        })
+
+    def test_no_changes(self):
+        previous = ConfigurationDiff(self._configuration).fingerprints
+        diff = ConfigurationDiff(self._configuration, previous)
+        self.assertFalse(diff.has_removals)
+        self.assertEqual(diff.count(diff.added), 0)
+        self.assertEqual(diff.count(diff.changed), 0)
+
+    def test_service_blocks(self):
+        blocks = {
+            "block1": {"name": "name1"},
+            "block2": {"name": "name2"},
+        }
+        service = {"execution": [
+            {"id": "block1", "receivers": {}},
+            {"name": "name2"},
+            {"name": "unknown"},
+        ]}
+        self.assertEqual(service_blocks(service, blocks),
+                         {"block1", "block2"})
+        self.assertEqual(service_blocks({}, blocks), set())
+
+    def test_restart(self):
+        """ Only services executing changed blocks are restarted """
+        self._configuration["services"]["service1"]["execution"] = [
+            {"id": "block1"}]
+        self._configuration["services"]["service2"] = {
+            "name": "service2", "execution": [{"id": "block2"}]}
+        diff = ConfigurationDiff(self._configuration)
+        self.assertEqual(set(diff.restart), {"service1", "service2"})
+
+        self._configuration["blocks"]["block2"]["name"] = "renamed"
+        diff = ConfigurationDiff(self._configuration, diff.fingerprints)
+        self.assertEqual(diff.restart, ["service2"])
+        self.assertEqual(list(diff.delta()["services"]), ["service2"])
+        self.assertEqual(list(diff.delta()["blocks"]), ["block2"])
+
+        diff = ConfigurationDiff(self._configuration, diff.fingerprints)
+        self.assertEqual(diff.restart, [])
@@ -0,0 +1,62 @@
+from nio.testing.test_case import NIOTestCase
+
+from ..errors import UpdateErrors
+
+
+class TestUpdateErrors(NIOTestCase):
+
+    def test_groups(self):
+        result = {
+            "blocks": {
+                "added": ["block1"],
+                "error": [{"id": "id{}".format(index), "type": "Counter"}
+                          for index in range(10)] +
+                         [{"name": "filter1", "type": "Filter"}]
+            },
+            "services": {"error": []},
+            "blockTypes": {
+                "error": ["Failed to load dependency for block X"]
+            },
+            "restarts": ["not", "a", "section"]
+        }
+        errors = UpdateErrors(result, sample_size=3)
+        self.assertTrue(errors)
+        self.assertEqual(errors.count, 12)
+        self.assertEqual(errors.groups, [{
+            "section": "blocks", "kind": "Counter", "count": 10,
+            "sample": [{"id": "id0", "type": "Counter"},
+                       {"id": "id1", "type": "Counter"},
+                       {"id": "id2", "type": "Counter"}]
+        }, {
+            "section": "blocks", "kind": "Filter", "count": 1,
+            "sample": [{"name": "filter1", "type": "Filter"}]
+        }, {
+            "section": "blockTypes", "kind": "message", "count": 1,
+            "sample": ["Failed to load dependency for block X"]
+        }])
+        self.assertEqual(
+            errors.summary(),
+            "12 errors, blocks Counter (10): id0, id1, id2 (+7), "
+            "blocks Filter (1): filter1, "
+            "blockTypes message (1): Failed to load dependency for block X")
+
+    def test_no_errors(self):
+        errors = UpdateErrors({"blocks": {"error": []}, "services": {}})
+        self.assertFalse(errors)
+        self.assertEqual(errors.groups, [])
+
+    def test_summary_length(self):
+        """ Summary is capped no matter how many errors there are """
+        result = {"blocks": {"error": [
+            {"id": "block{}".format(index), "type": "Type{}".format(index)}
+            for index in range(5000)]}}
+        errors = UpdateErrors(result)
+        summary = errors.summary(500)
+        self.assertLessEqual(len(summary), 500)
+        self.assertTrue(summary.startswith(
+            "5000 errors, blocks Type0 (1): block0, "))
+        self.assertRegex(summary, r"\(\+\d+ more\)$")
+
+        # errors without identifiers are described by their content
+        errors = UpdateErrors({"services": {"error": [{"x": "y" * 500}]}})
+        self.assertLessEqual(len(errors.summary()), 300)
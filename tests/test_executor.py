@@ -0,0 +1,72 @@
+from threading import Event
+from unittest.mock import MagicMock
+
+from nio.testing.test_case import NIOTestCase
+
+from ..executor import DeploymentExecutor
+
+
+class TestDeploymentExecutor(NIOTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._release = Event()
+        self._started = Event()
+        self._runs = []
+        self._on_superseded = MagicMock()
+        self._executor = DeploymentExecutor(self._run, self._on_superseded)
+        self._executor.start()
+
+    def tearDown(self):
+        self._release.set()
+        self._executor.stop()
+        super().tearDown()
+
+    def _run(self, config_id, config_version_id, deployment_id):
+        self._runs.append(config_version_id)
+        self._started.set()
+        self._release.wait(1)
+        if config_version_id == "fail":
+            raise RuntimeError("failed")
+        return {"version": config_version_id}
+
+    def test_run(self):
+        self._release.set()
+        future = self._executor.submit("cfg", "v1", "dep1")
+        self.assertEqual(future.result(1), {"version": "v1"})
+        self.assertFalse(self._executor.in_worker)
+
+        future = self._executor.submit("cfg", "fail", "dep2")
+        with self.assertRaises(RuntimeError):
+            future.result(1)
+
+    def test_coalescing(self):
+        """ Waiting deployments are superseded by newer ones """
+        running = self._executor.submit("cfg", "v1", "dep1")
+        self.assertTrue(self._started.wait(1))
+
+        v2 = self._executor.submit("cfg", "v2", "dep2")
+        v3 = self._executor.submit("cfg", "v3", "dep3")
+        other = self._executor.submit("other_cfg", "v1", "dep4")
+        # same deployment is not queued twice
+        self.assertIs(self._executor.submit("cfg", "v3", "dep3"), v3)
+        self.assertIs(self._executor.submit("cfg", "v1", "dep1"), running)
+
+        self.assertEqual(v2.result(1), {"superseded_by": "dep3"})
+        self._on_superseded.assert_called_once_with(
+            "cfg", "v2", "dep2", "dep3")
+
+        self._release.set()
+        self.assertEqual(running.result(1), {"version": "v1"})
+        self.assertEqual(v3.result(1), {"version": "v3"})
+        self.assertEqual(other.result(1), {"version": "v1"})
+        self.assertEqual(self._runs, ["v1", "v3", "v1"])
+
+    def test_stop(self):
+        self._executor.submit("cfg", "v1", "dep1")
+        self.assertTrue(self._started.wait(1))
+        waiting = self._executor.submit("cfg", "v2", "dep2")
+        self._executor.stop()
+        self.assertTrue(waiting.cancelled())
+        with self.assertRaises(RuntimeError):
+            self._executor.submit("cfg", "v3", "dep3")
@@ -0,0 +1,146 @@
+import json
+from unittest.mock import MagicMock
+
+from nio.testing.test_case import NIOTestCase
+from requests.exceptions import ConnectionError
+
+from ..benchmarks.configurations import synthetic_configuration
+from ..benchmarks.stub_api import StubProductAPI
+from ..fanout import FanOut, fanout_instances
+from ..manager import DeploymentManager
+from ..proxy import DeploymentProxy
+
+
+class TestFanOut(NIOTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._api = StubProductAPI().start()
+        self._configurations = {
+            "v1": synthetic_configuration(20),
+            "v2": synthetic_configuration(20, version=2)
+        }
+        for version, configuration in self._configurations.items():
+            self._api.add_configuration("cfg_id", version, configuration)
+        self._instances = {
+            "instance_{}".format(index):
+                "http://127.0.0.1:{}".format(8180 + index)
+            for index in range(6)}
+        for index, instance_id in enumerate(self._instances):
+            self._api.set_desired(instance_id, "cfg_id",
+                                  "v1" if index % 2 else "v2", "dep_1")
+
+        self._manager = DeploymentManager()
+        self._manager._api_proxy = DeploymentProxy(
+            self._api.url, MagicMock(api_key="key", instance_id="instance"))
+        self._fanout = FanOut(
+            self._manager._api_proxy, self._manager._get_configuration,
+            self._instances)
+        self._fanout._session = MagicMock()
+        self._fanout._session.put.return_value.status_code = 200
+        self._fanout._session.get.return_value.json.return_value = {
+            "status": "success"}
+
+    def tearDown(self):
+        self._manager._api_proxy.close()
+        self._api.stop()
+        super().tearDown()
+
+    def _handed_over(self):
+        """ Provides deployment bodies sent by instance url """
+        return {
+            call[0][0]: json.loads(call[1]["data"].decode())
+            for call in self._fanout._session.put.call_args_list}
+
+    def test_poll(self):
+        """ Each distinct version is fetched once for all instances """
+        results = self._fanout.poll()
+        self.assertEqual(results, {instance_id: {"status": 200}
+                                   for instance_id in self._instances})
+        self.assertEqual(self._api.routes["poll"], 1)
+        self.assertEqual(self._api.routes["configuration"], 2)
+        handed_over = self._handed_over()
+        self.assertEqual(len(handed_over), 6)
+        for index, url in enumerate(self._instances.values()):
+            version = "v1" if index % 2 else "v2"
+            self.assertEqual(handed_over[url + "/config/update"], {
+                "instance_configuration_id": "cfg_id",
+                "instance_configuration_version_id": version,
+                "deployment_id": "dep_1",
+                "configuration_data": self._configurations[version]
+            })
+
+        # nothing changed
+        self._fanout._session.put.reset_mock()
+        self.assertIsNone(self._fanout.poll())
+        self.assertEqual(self._fanout._session.put.call_count, 0)
+        self.assertEqual(self._api.routes["poll"], 2)
+        self.assertEqual(self._api.routes["configuration"], 2)
+
+        # a new deployment for one instance
+        self._api.set_desired("instance_0", "cfg_id", "v1", "dep_2")
+        self.assertEqual(self._fanout.poll(), {"instance_0": {"status": 200}})
+        self.assertEqual(self._api.routes["configuration"], 3)
+
+    def test_failed_instance(self):
+        """ An instance failing to take a deployment gets it on next poll
+        """
+        def put(url, **kwargs):
+            if url.startswith(self._instances["instance_1"]):
+                raise ConnectionError("Connection refused")
+            return MagicMock(status_code=200)
+        self._fanout._session.put.side_effect = put
+
+        results = self._fanout.poll()
+        self.assertEqual(results["instance_1"],
+                         {"error": "Connection refused"})
+        self.assertEqual(results["instance_2"], {"status": 200})
+
+        self._fanout._session.put.side_effect = None
+        self.assertEqual(self._fanout.poll(), {"instance_1": {"status": 200}})
+
+    def test_failed_deployment(self):
+        """ A deployment failing on an instance is handed over again """
+        self._fanout.poll()
+        statuses = {"instance_0": "failure", "instance_1": "in_progress"}
+
+        def get(url, **kwargs):
+            for instance_id, status in statuses.items():
+                if url.startswith(self._instances[instance_id]):
+                    return MagicMock(**{"json.return_value": {
+                        "status": status}})
+            return MagicMock(**{"json.return_value": {"status": "success"}})
+        self._fanout._session.get.side_effect = get
+        self.assertEqual(self._fanout.poll(), {"instance_0": {"status": 200}})
+        self.assertEqual(self._fanout._session.get.call_count, 6)
+
+        # statuses are checked until deployments succeeded
+        statuses = {"instance_1": "success"}
+        self._fanout._session.get.reset_mock()
+        self.assertIsNone(self._fanout.poll())
+        self.assertEqual(
+            {call[0][0] for call in self._fanout._session.get.call_args_list},
+            {self._instances[instance_id] + "/config/deployments/dep_1"
+             for instance_id in ("instance_0", "instance_1")})
+        self._fanout._session.get.reset_mock()
+        self.assertIsNone(self._fanout.poll())
+        self.assertEqual(self._fanout._session.get.call_count, 0)
+
+    def test_per_instance_polls(self):
+        """ Instances are polled one by one without batched requests """
+        self._manager._api_proxy.get_instances_config_ids = \
+            MagicMock(return_value=None)
+        self._api.set_desired("instance_0", "cfg_id", "v3", "dep_1")
+        results = self._fanout.poll()
+        self.assertEqual(self._api.routes["poll"], 6)
+        # configuration missing
+        self.assertIn("error", results["instance_0"])
+        self.assertEqual(len(self._handed_over()), 5)
+
+    def test_fanout_instances(self):
+        self.assertEqual(list(fanout_instances(
+            "a=http://127.0.0.1:8181/, b = http://127.0.0.1:8182,").items()),
+            [("a", "http://127.0.0.1:8181"), ("b", "http://127.0.0.1:8182")])
+        self.assertEqual(fanout_instances(""), {})
+        with self.assertRaises(ValueError):
+            fanout_instances("a=http://127.0.0.1:8181, b")
@@ -0,0 +1,32 @@
+from nio.testing.test_case import NIOTestCase
+
+from ..benchmarks.fleet import FakeConfigurationManager, FleetSimulation
+
+
+class TestFleetSimulation(NIOTestCase):
+
+    def test_fake_configuration_manager(self):
+        manager = FakeConfigurationManager(error_rate=0.5, rand=iter(
+            [0.9, 0.1]).__next__)
+        result = manager.update({
+            "blocks": {"block1": {"id": "block1"},
+                       "block2": {"id": "block2"}}
+        }, True, True)
+        self.assertEqual(result["blocks"], {
+            "added": ["block1", "block2"], "error": [{"id": "block2"}]})
+        self.assertEqual(result["services"], {"added": [], "error": []})
+        self.assertEqual(manager.updates, 1)
+
+    def test_run(self):
+        """ A small fleet deploys every rollout """
+        results = FleetSimulation(
+            instances=3, blocks=20, poll_interval=0.2).run(
+                duration=1.5, rollouts=1)
+        self.assertEqual(results["deployments"], 3)
+        self.assertEqual(results["pending"], 0)
+        self.assertEqual(results["failures"], 0)
+        self.assertGreater(results["poll_rate"], 0)
+        self.assertEqual(results["requests"]["patch"], 3)
+        self.assertGreater(results["memory_per_instance"], 0)
+        self.assertLessEqual(results["deployment_latency"]["p50"],
+                             results["deployment_latency"]["max"])
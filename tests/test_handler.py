@@ -1,3 +1,4 @@
+import json
 from unittest.mock import MagicMock
 
 from nio.modules.web.http import Request, Response
@@ -23,14 +24,71 @@ class TestDeploymentHandler(NIOWebTestCase):
         super().setUp()
         self._manager = MagicMock(spec=DeploymentManager)
         self._manager.update_configuration.return_value = {"foo": "bar"}
+        self._manager.async_deployments = False
         self._handler = DeploymentHandler(self._manager)
 
     def test_on_get(self):
-        """ Asserts 'GET' call NotImplemented response.
+        """ Asserts deployments status is provided
         """
-        handler = DeploymentHandler(None)
-        with self.assertRaises(NotImplementedError):
-            handler.on_get(MagicMock(spec=Request), MagicMock(spec=Response))
+        mock_req = MagicMock(spec=Request)
+        mock_resp = MagicMock(spec=Response)
+        self._manager.get_deployments.return_value = [{"status": "success"}]
+        self._manager.get_deployment.return_value = {"status": "accepted"}
+
+        mock_req.get_identifier.return_value = 'deployments'
+        self._handler.on_get(mock_req, mock_resp)
+        mock_resp.set_body.assert_called_with(
+            json.dumps([{"status": "success"}]))
+
+        mock_req.get_identifier.return_value = 'deployments/dep_id'
+        self._handler.on_get(mock_req, mock_resp)
+        self._manager.get_deployment.assert_called_with('dep_id')
+        mock_resp.set_body.assert_called_with(
+            json.dumps({"status": "accepted"}))
+
+        # unknown deployment
+        self._manager.get_deployment.return_value = None
+        with self.assertRaises(ValueError):
+            self._handler.on_get(mock_req, mock_resp)
+
+    def test_on_get_metrics(self):
+        """ Asserts deployment metrics are provided
+        """
+        mock_req = MagicMock(spec=Request)
+        mock_resp = MagicMock(spec=Response)
+        self._manager.get_metrics.return_value = {"deployments": 1}
+
+        mock_req.get_identifier.return_value = 'metrics'
+        self._handler.on_get(mock_req, mock_resp)
+        mock_resp.set_body.assert_called_with(
+            json.dumps({"deployments": 1}))
+
+    def test_on_get_version(self):
+        """ Asserts cached configurations are served to peers
+        """
+        mock_req = MagicMock(spec=Request)
+        mock_resp = MagicMock(spec=Response)
+        self._manager.get_cached_configuration.return_value = '{"a": 1}'
+
+        mock_req.get_identifier.return_value = 'versions/cfg_id/v1'
+        self._handler.on_get(mock_req, mock_resp)
+        self._manager.get_cached_configuration.assert_called_with(
+            'cfg_id', 'v1')
+        mock_resp.set_body.assert_called_with('{"a": 1}')
+
+        # not cached
+        self._manager.get_cached_configuration.return_value = None
+        with self.assertRaises(ValueError):
+            self._handler.on_get(mock_req, mock_resp)
+
+    def test_on_get_bad_identifier(self):
+        mock_req = MagicMock(spec=Request)
+        for identifier in (None, 'update', 'deployments/dep_id/other',
+                           'metrics/other', 'versions/cfg_id',
+                           'versions/cfg_id/v1/other'):
+            mock_req.get_identifier.return_value = identifier
+            with self.assertRaises(ValueError):
+                self._handler.on_get(mock_req, MagicMock(spec=Response))
 
     def test_on_put_updates(self):
         mock_req = MagicMock(spec=Request)
@@ -43,6 +101,44 @@ class TestDeploymentHandler(NIOWebTestCase):
         self._handler.on_put(mock_req, MagicMock())
         self._manager.update_configuration.assert_called_once_with(
             "config_id", "config_version_id", "deployment_id")
+        self.assertEqual(self._manager.provide_configuration.call_count, 0)
+
+    def test_on_put_configuration_data(self):
+        """ Asserts configuration handed over is provided to the manager """
+        mock_req = MagicMock(spec=Request)
+        mock_req.get_identifier.return_value = 'update'
+        mock_req.get_body.return_value = {
+            "deployment_id": "deployment_id",
+            "instance_configuration_id": "config_id",
+            "instance_configuration_version_id": "config_version_id",
+            "configuration_data": {"blocks": {}},
+        }
+        self._handler.on_put(mock_req, MagicMock())
+        self._manager.provide_configuration.assert_called_once_with(
+            "config_id", "config_version_id", "deployment_id",
+            {"blocks": {}})
+        self._manager.update_configuration.assert_called_once_with(
+            "config_id", "config_version_id", "deployment_id")
+
+    def test_on_put_async(self):
+        """ Asserts deployment is queued and accepted """
+        self._manager.async_deployments = True
+        self._manager.queue_deployment.return_value = {"status": "started"}
+        mock_req = MagicMock(spec=Request)
+        mock_resp = MagicMock(spec=Response)
+        mock_req.get_identifier.return_value = 'update'
+        mock_req.get_body.return_value = {
+            "deployment_id": "deployment_id",
+            "instance_configuration_id": "config_id",
+            "instance_configuration_version_id": "config_version_id",
+        }
+        self._handler.on_put(mock_req, mock_resp)
+        self._manager.queue_deployment.assert_called_once_with(
+            "config_id", "config_version_id", "deployment_id")
+        self.assertEqual(self._manager.update_configuration.call_count, 0)
+        mock_resp.set_status.assert_called_once_with(202)
+        mock_resp.set_body.assert_called_once_with(
+            json.dumps({"status": "started"}))
 
     def test_on_put_bad_body(self):
         """ Verify an error is raised with incorrect put body """
@@ -1,10 +1,17 @@
 import json
+import tempfile
+from datetime import timedelta
 from unittest.mock import MagicMock, patch, ANY
 
 from nio.modules.web import RESTHandler
 from niocore.core.context import CoreContext
 
+from ..cache import ConfigurationCache
 from ..manager import DeploymentManager
+from ..restarts import ServiceRestarter
+from ..state import DeploymentState
+from ..proxy import desired_fingerprint
+from ..staging import ConfigurationStager
 
 
 # noinspection PyProtectedMember
@@ -13,6 +20,38 @@ from nio.testing.test_case import NIOTestCase
 
 class TestDeploymentManager(NIOTestCase):
 
+    def _manager(self, **attributes):
+        """ Provides a manager handing configurations over to a mock
+
+        Args:
+            attributes: manager attributes to set, without leading underscore
+        """
+        manager = DeploymentManager()
+        manager._start_stop_services = True
+        manager._delete_missing = True
+        manager._api_proxy = MagicMock()
+        manager._api_proxy.received_bytes.return_value = 0
+        manager._configuration_manager = MagicMock()
+        manager._configuration_manager.update.return_value = {}
+        for name, value in attributes.items():
+            setattr(manager, "_" + name, value)
+        return manager
+
+    def _cache(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        return ConfigurationCache(cache_dir.name, 1048576)
+
+    @staticmethod
+    def _deploy(manager, configuration, version, *mocks):
+        """ Deploys given configuration as version, resetting mocks first """
+        for mock in mocks:
+            mock.reset_mock()
+        manager._api_proxy.get_configuration.return_value = {
+            "configuration_data": json.dumps(configuration)
+        }
+        return manager.update_configuration("cfg_id", version, "dep_id")
+
     def test_start_stop(self):
         # Test a handler is created and passed to REST Manager on start
 
@@ -47,8 +86,8 @@ class TestDeploymentManager(NIOTestCase):
         deployment_id = "dep_id"
 
         manager._config_api_url_prefix = "api_url_prefix"
-        manager._config_id = cfg_id
-        manager._config_version_id = cfg_version_id
+        manager.config_id = cfg_id
+        manager.config_version_id = cfg_version_id
         manager._api_proxy = MagicMock()
 
         failed_resource_properties = {
@@ -105,7 +144,8 @@ class TestDeploymentManager(NIOTestCase):
         manager._run_config_update()
         self.assertEqual(
             manager._api_proxy.get_instance_config_ids.call_count, 1)
-        manager._api_proxy.get_instance_config_ids.assert_called_once_with()
+        manager._api_proxy.get_instance_config_ids.assert_called_once_with(
+            {"etag": None, "last_modified": None}, wait=0)
         self.assertEqual(core_updater.call_count, 0)
 
         manager._api_proxy.reset_mock()
@@ -150,8 +190,8 @@ class TestDeploymentManager(NIOTestCase):
         # Set variables
         manager._start_stop_services = True
         manager._delete_missing = False
-        manager._config_id = "cfg_id"
-        manager._config_version_id = "cfg_version_id_1"
+        manager.config_id = "cfg_id"
+        manager.config_version_id = "cfg_version_id_1"
 
         # Mock methods/dependencies
         manager._api_proxy = MagicMock()
@@ -190,6 +230,868 @@ class TestDeploymentManager(NIOTestCase):
         manager._run_config_update()
         self.assertEqual(manager._configuration_manager.update.call_count, 2)
 
+    def test_update_delta(self):
+        """ Assert only changes are handed over once a config was applied
+        """
+        manager = self._manager()
+        core_updater = manager._configuration_manager.update
+        configuration = {
+            "blocks": {"block1": {"name": "block1"},
+                       "block2": {"name": "block2"}},
+            "services": {"service1": {"name": "service1"}},
+            "blockTypes": {}
+        }
+
+        def deploy(version):
+            self._deploy(manager, configuration, version)
+            return core_updater.call_args[0]
+
+        # first update hands over whole configuration
+        self.assertEqual(deploy("v1"), (configuration, True, True))
+
+        # a changed block is the only object handed over
+        configuration["blocks"]["block1"]["name"] = "renamed"
+        self.assertEqual(deploy("v2"), ({
+            "blocks": {"block1": {"name": "renamed"}},
+            "services": {},
+            "blockTypes": {}
+        }, True, False))
+
+        # removals require whole configuration to delete missing objects
+        del configuration["blocks"]["block2"]
+        self.assertEqual(deploy("v3"), (configuration, True, True))
+
+        # a failed update hands over whole configuration next time
+        core_updater.return_value = {"blocks": {"error": ["failed"]}}
+        configuration["blocks"]["block1"]["name"] = "block1"
+        deploy("v4")
+        core_updater.return_value = {}
+        self.assertEqual(deploy("v5"), (configuration, True, True))
+
+    def test_rollback(self):
+        """ Assert a failed update is rolled back and ids are kept
+        """
+        manager = self._manager(rollback=True, cache=self._cache())
+        core_updater = manager._configuration_manager.update
+        configuration = {
+            "blocks": {"block1": {"name": "block1"},
+                       "block2": {"name": "block2"}},
+            "services": {"service1": {"name": "service1"}},
+            "blockTypes": {}
+        }
+
+        def deploy(version):
+            return self._deploy(manager, configuration, version)
+
+        deploy("v1")
+        fingerprints = manager._state.fingerprints
+
+        # failing blocks are restored, services are not updated
+        core_updater.side_effect = [{"blocks": {"error": ["failed"]}}, {}]
+        configuration["blocks"]["block1"]["name"] = "renamed"
+        configuration["services"]["service1"]["name"] = "renamed"
+        result = deploy("v2")
+        self.assertEqual(core_updater.call_args[0], ({
+            "blocks": {"block1": {"name": "block1"}},
+            "services": {},
+            "blockTypes": {}
+        }, True, False))
+        self.assertEqual(result["rollback"]["objects"], 1)
+        self.assertTrue(result["rollback"]["success"])
+        message = manager._api_proxy.set_reported_configuration.call_args[0][4]
+        self.assertTrue(message.startswith(
+            "Rolled back 1 objects to config ID cfg_id version v1. Failed"))
+        # instance still runs previous version
+        self.assertEqual(manager.config_version_id, "v1")
+        self.assertEqual(manager._state.fingerprints, fingerprints)
+        # failed update is retried when polled
+        self.assertIsNone(manager._rejected)
+        self.assertIn("rollback", manager.get_metrics()["last"]["phases"])
+
+        # a failed rollback leaves instance state unknown
+        core_updater.side_effect = [{"blocks": {"error": ["failed"]}},
+                                    {"blocks": {"error": ["failed"]}}]
+        result = deploy("v3")
+        self.assertFalse(result["rollback"]["success"])
+        self.assertEqual(manager.config_version_id, "v1")
+        self.assertIsNone(manager._state.fingerprints)
+
+        # which cannot be rolled back to
+        core_updater.side_effect = None
+        core_updater.return_value = {"blocks": {"error": ["failed"]}}
+        self.assertNotIn("rollback", deploy("v4"))
+
+    def test_rollback_added(self):
+        """ Assert objects a failed update added make its rollback partial
+        """
+        manager = self._manager(rollback=True, cache=self._cache(),
+                                service_manager=MagicMock())
+        core_updater = manager._configuration_manager.update
+        configuration = {
+            "blocks": {},
+            "services": {"s1": {"name": "s1"}},
+            "blockTypes": {}
+        }
+
+        self._deploy(manager, configuration, "v1")
+        configuration["services"]["s1"]["name"] = "changed"
+        configuration["services"]["s2"] = {"name": "s2"}
+        core_updater.side_effect = [{"services": {"error": ["failed"]}}, {}]
+        result = self._deploy(manager, configuration, "v2")
+        self.assertEqual(core_updater.call_args[0][0]["services"],
+                         {"s1": {"name": "s1"}})
+        self.assertFalse(result["rollback"]["success"])
+        self.assertEqual(result["rollback"]["added"], {"services": ["s2"]})
+        self.assertTrue(result["rollback"]["message"].startswith(
+            "Partially rolled back 1 objects"))
+        self.assertIn("services s2", result["rollback"]["message"])
+        # the update started the service it added
+        manager._service_manager.stop_service.assert_called_once_with("s2")
+        # next update hands over the whole configuration
+        self.assertIsNone(manager._state.fingerprints)
+
+    def test_parallel_restarts(self):
+        """ Assert modified services are stopped and started around update
+        """
+        service_manager = MagicMock()
+        manager = self._manager(
+            restarter=ServiceRestarter(service_manager, 2))
+        core_updater = manager._configuration_manager.update
+        configuration = {
+            "blocks": {"block1": {"name": "block1", "type": "Publisher",
+                                  "topic": "topic"},
+                       "block2": {"name": "block2", "type": "Subscriber",
+                                  "topic": "topic"}},
+            "services": {
+                "service1": {"name": "service1", "auto_start": True,
+                             "execution": [{"id": "block1"}]},
+                "service2": {"name": "service2", "auto_start": True,
+                             "execution": [{"id": "block2"}]},
+                "service3": {"name": "service3", "auto_start": False}
+            },
+            "blockTypes": {}
+        }
+
+        def deploy(version):
+            return self._deploy(manager, configuration, version,
+                                service_manager)
+
+        result = deploy("v1")
+        # update does not restart services itself
+        self.assertFalse(core_updater.call_args[0][1])
+        self.assertEqual(service_manager.stop_service.call_count, 3)
+        self.assertEqual(
+            [call[0][0]
+             for call in service_manager.start_service.call_args_list],
+            ["service1", "service2"])
+        self.assertEqual(set(result["restarts"]["timings"]),
+                         {"service1", "service2", "service3"})
+        self.assertIn("start", result["restarts"]["timings"]["service2"])
+        self.assertIn("restart", manager.get_metrics()["last"]["phases"])
+
+        # only services executing a changed block are restarted
+        configuration["blocks"]["block2"]["name"] = "renamed"
+        result = deploy("v2")
+        service_manager.stop_service.assert_called_once_with("service2")
+        service_manager.start_service.assert_called_once_with("service2")
+        self.assertEqual(list(result["restarts"]["timings"]), ["service2"])
+
+        # a service failing to start fails the deployment
+        service_manager.start_service.side_effect = RuntimeError("failed")
+        configuration["blocks"]["block2"]["name"] = "block2"
+        result = deploy("v3")
+        self.assertEqual(result["services"]["error"], [{
+            "id": "service2", "kind": "start_failed", "message": "failed"}])
+        self.assertEqual(manager.get_deployment("dep_id")["status"],
+                         "failure")
+
+    def test_rolling_update(self):
+        """ Assert services are updated in batches reporting progress
+        """
+        service_manager = MagicMock()
+        manager = self._manager(
+            rolling_batch_size=2, rolling_settle_time=0.01,
+            restarter=ServiceRestarter(service_manager, 2))
+        core_updater = manager._configuration_manager.update
+        configuration = {
+            "blocks": {"block1": {"name": "block1"}},
+            "services": {"service{}".format(index): {
+                "name": "service{}".format(index), "auto_start": True,
+                "execution": [{"id": "block1"}]} for index in range(5)},
+            "blockTypes": {}
+        }
+
+        def deploy(version):
+            return self._deploy(manager, configuration, version,
+                                service_manager, core_updater,
+                                manager._api_proxy)
+
+        # a whole configuration deleting missing objects is not batched
+        deploy("v1")
+        self.assertEqual(core_updater.call_count, 1)
+
+        configuration["blocks"]["block1"]["name"] = "renamed"
+        result = deploy("v2")
+        # blocks, then 3 batches of services
+        self.assertEqual(core_updater.call_count, 4)
+        self.assertEqual(len(core_updater.call_args[0][0]["services"]), 1)
+        self.assertEqual(service_manager.start_service.call_count, 5)
+        self.assertEqual(len(result["restarts"]["timings"]), 5)
+        report = manager._api_proxy.set_reported_configuration
+        reports = [call[0] for call in report.call_args_list]
+        self.assertEqual([report[3] for report in reports],
+                         ["accepted", "in_progress", "in_progress",
+                          "success"])
+        message = reports[1][4]
+        self.assertEqual(message, "Updated batch 1 of 3 of services")
+        self.assertEqual(
+            manager.get_metrics()["last"]["counters"]["batches"], 3)
+
+        # a batch failing to start stops the update
+        service_manager.start_service.side_effect = RuntimeError("failed")
+        configuration["blocks"]["block1"]["name"] = "block1"
+        result = deploy("v3")
+        self.assertEqual(core_updater.call_count, 2)
+        self.assertEqual(len(result["services"]["error"]), 2)
+        self.assertEqual(manager.get_deployment("dep_id")["status"],
+                         "failure")
+
+    def test_restarts(self):
+        """ Assert fingerprints are persisted and restarts are reported
+        """
+        manager = DeploymentManager()
+        manager._start_stop_services = True
+        manager._delete_missing = True
+        manager._api_proxy = MagicMock()
+        manager._configuration_manager = MagicMock()
+        manager._configuration_manager.update.side_effect = \
+            lambda *args: {}
+        configuration = {
+            "blocks": {"block1": {"name": "block1"},
+                       "block2": {"name": "block2"}},
+            "services": {
+                "service1": {"execution": [{"id": "block1"}]},
+                "service2": {"execution": [{"id": "block2"}]}
+            },
+            "blockTypes": {}
+        }
+        manager._api_proxy.get_configuration.return_value = {
+            "configuration_data": json.dumps(configuration)
+        }
+        result = manager.update_configuration("cfg_id", "v1", "dep_id")
+        self.assertEqual(result["restarts"]["avoided"], 0)
+
+        # fingerprints are loaded for the configuration they belong to
+        restarted = DeploymentManager()
+        restarted.get_dependency = MagicMock()
+        with patch(DeploymentManager.__module__ + ".Settings") as settings:
+            settings.get.side_effect = \
+                lambda section, option, fallback=None: \
+                {"config_id": "cfg_id", "config_version_id": "v1"}.get(
+                    option, fallback)
+            settings.getint.return_value = 0
+            settings.getfloat.return_value = 0
+            restarted.configure(CoreContext([], []))
+        self.assertEqual(restarted._state.fingerprints,
+                         manager._state.fingerprints)
+
+        configuration["blocks"]["block2"]["name"] = "renamed"
+        manager._api_proxy.get_configuration.return_value = {
+            "configuration_data": json.dumps(configuration)
+        }
+        result = manager.update_configuration("cfg_id", "v2", "dep_id")
+        self.assertEqual(result["restarts"],
+                         {"services": ["service2"], "avoided": 1})
+
+    def test_stream_configuration(self):
+        """ Assert streamed configurations are cached as received
+        """
+        manager = DeploymentManager()
+        manager._stream_downloads = True
+        manager._api_proxy = MagicMock()
+        manager._configuration_manager = MagicMock()
+        manager._configuration_manager.update.return_value = {}
+        manager._cache = MagicMock()
+        manager._cache.get.return_value = None
+        writer = manager._cache.writer.return_value
+        configuration = {"blocks": {}, "services": {}, "blockTypes": {}}
+        manager._api_proxy.stream_configuration.return_value = {
+            "configuration_data": configuration
+        }
+
+        manager.update_configuration("cfg_id", "cfg_version_id", "dep_id")
+        manager._api_proxy.stream_configuration.assert_called_once_with(
+            "cfg_id", "cfg_version_id", sink=writer.write)
+        self.assertEqual(manager._api_proxy.get_configuration.call_count, 0)
+        writer.commit.assert_called_once_with()
+        self.assertDictEqual(
+            manager._configuration_manager.update.call_args[0][0],
+            configuration)
+
+        # a failed download is not cached
+        manager._api_proxy.stream_configuration.side_effect = ValueError
+        with self.assertRaises(ValueError):
+            manager.update_configuration("cfg_id", "cfg_version_id", "dep2")
+        writer.discard.assert_called_once_with()
+
+    def test_metrics(self):
+        """ Assert deployment phases and counters are measured
+        """
+        manager = DeploymentManager()
+        manager._start_stop_services = True
+        manager._api_proxy = MagicMock()
+        manager._api_proxy.received_bytes.return_value = 0
+        manager._configuration_manager = MagicMock()
+        manager._configuration_manager.update.return_value = {}
+        configuration = {
+            "blocks": {"block1": {"name": "block1"}},
+            "services": {"service1": {"name": "service1"}},
+            "blockTypes": {}
+        }
+
+        def get_configuration(*args):
+            manager._api_proxy.received_bytes.return_value += 100
+            return {"configuration_data": json.dumps(configuration)}
+        manager._api_proxy.get_configuration.side_effect = get_configuration
+
+        manager.update_configuration("cfg_id", "v1", "dep1")
+        metrics = manager.get_metrics()
+        self.assertEqual(metrics["deployments"], 1)
+        self.assertEqual(list(metrics["phases"]), [
+            "fetch", "decode", "validate", "accept_report", "apply",
+            "result_scan", "final_report"])
+        self.assertEqual(metrics["last"]["counters"], {
+            "bytes_downloaded": 100, "objects_applied": 2})
+
+        # failed deployments are measured up to where they failed
+        manager._configuration_manager.update.side_effect = RuntimeError
+        with self.assertRaises(RuntimeError):
+            manager.update_configuration("cfg_id", "v2", "dep2")
+        metrics = manager.get_metrics()
+        self.assertEqual(metrics["deployments"], 2)
+        self.assertNotIn("final_report", metrics["last"]["phases"])
+        self.assertIn("apply", metrics["last"]["phases"])
+
+    def test_error_summary(self):
+        """ Assert a failure reports a summary of errors
+        """
+        manager = DeploymentManager()
+        manager._api_proxy = MagicMock()
+        manager._configuration_manager = MagicMock()
+        errors = [{"id": "block{}".format(index), "type": "Counter"}
+                  for index in range(5000)]
+        manager._configuration_manager.update.return_value = {
+            "blocks": {"error": errors}
+        }
+        manager._api_proxy.get_configuration.return_value = {
+            "configuration_data": json.dumps({})
+        }
+
+        manager.update_configuration("cfg_id", "cfg_version_id", "dep_id")
+        message = manager._api_proxy.set_reported_configuration.call_args[0][4]
+        self.assertLess(len(message), 2100)
+        self.assertIn("5000 errors, blocks Counter (5000): block0", message)
+        deployment = manager.get_deployment("dep_id")
+        self.assertEqual(deployment["status"], "failure")
+        self.assertEqual(deployment["message"], message)
+        self.assertEqual(deployment["errors"][0]["count"], 5000)
+        # full errors remain available
+        self.assertIs(deployment["result"]["blocks"]["error"], errors)
+
+    def test_validation(self):
+        """ Assert an invalid configuration is rejected before acceptance
+        """
+        manager = DeploymentManager()
+        manager._validate = True
+        manager._delete_missing = True
+        manager._api_proxy = MagicMock()
+        manager._configuration_manager = MagicMock()
+        manager._configuration_manager.update.return_value = {}
+        configuration = {
+            "blocks": {"block1": {"name": "block1", "type": "Logger"}},
+            "services": {"service1": {"name": "service1",
+                                      "execution": [{"id": "block2"}]}},
+            "blockTypes": {"Logger": {}}
+        }
+        manager._api_proxy.get_configuration.return_value = {
+            "configuration_data": json.dumps(configuration)
+        }
+        manager._api_proxy.get_instance_config_ids.return_value = {
+            "instance_configuration_id": "cfg_id",
+            "instance_configuration_version_id": "v1",
+            "deployment_id": "dep_id"
+        }
+
+        result = manager._run_config_update()
+        self.assertEqual(result["services"]["error"][0]["kind"],
+                         "missing_block")
+        self.assertEqual(manager._configuration_manager.update.call_count, 0)
+        manager._api_proxy.set_reported_configuration.assert_called_once_with(
+            "cfg_id", "v1", "dep_id", "failure", ANY)
+        self.assertIsNone(manager.config_version_id)
+        self.assertEqual(manager.get_deployment("dep_id")["status"],
+                         "failure")
+
+        # a rejected configuration is not deployed again when polled
+        self.assertIsNone(manager._run_config_update())
+        self.assertEqual(manager._api_proxy.get_configuration.call_count, 1)
+
+        # a valid configuration is applied
+        configuration["services"]["service1"]["execution"] = [
+            {"id": "block1"}]
+        manager._api_proxy.get_configuration.return_value = {
+            "configuration_data": json.dumps(configuration)
+        }
+        manager._api_proxy.get_instance_config_ids.return_value[
+            "instance_configuration_version_id"] = "v2"
+        manager._run_config_update()
+        self.assertEqual(manager._configuration_manager.update.call_count, 1)
+        self.assertEqual(manager.config_version_id, "v2")
+
+    def test_staging(self):
+        """ Assert an announced configuration is prepared ahead of use
+        """
+        manager = DeploymentManager()
+        manager._validate = True
+        manager._api_proxy = MagicMock()
+        manager._configuration_manager = MagicMock()
+        manager._configuration_manager.update.return_value = {}
+        manager.config_id = "cfg_id"
+        manager.config_version_id = "v1"
+        manager._stager = ConfigurationStager(manager._prepare)
+        self.addCleanup(manager._stager.stop)
+        configuration = {
+            "blocks": {"block1": {"name": "block1", "type": "Logger"}},
+            "services": {},
+            "blockTypes": {}
+        }
+        manager._api_proxy.get_configuration.return_value = {
+            "configuration_data": json.dumps(configuration)
+        }
+        ids = {
+            "instance_configuration_id": "cfg_id",
+            "instance_configuration_version_id": "v1",
+            "staged_configuration_id": "cfg_id",
+            "staged_configuration_version_id": "v2",
+            "deployment_id": "dep_id"
+        }
+        manager._api_proxy.get_instance_config_ids.return_value = ids
+
+        # running version is kept, upcoming version is prepared
+        self.assertIsNone(manager._run_config_update())
+        self.assertEqual(manager._stager.staged, ("cfg_id", "v2"))
+
+        # deploying staged version does not download it again
+        manager.update_configuration("cfg_id", "v2", "dep_id2")
+        manager._api_proxy.get_configuration.assert_called_once_with(
+            "cfg_id", "v2")
+        self.assertDictEqual(
+            manager._configuration_manager.update.call_args[0][0],
+            configuration)
+        self.assertEqual(manager.config_version_id, "v2")
+        self.assertEqual(manager._state.fingerprints["blocks"].keys(),
+                         {"block1"})
+
+        # an invalid staged version is rejected
+        del configuration["blocks"]["block1"]["type"]
+        manager._api_proxy.get_configuration.return_value = {
+            "configuration_data": json.dumps(configuration)
+        }
+        ids["instance_configuration_version_id"] = "v2"
+        ids["staged_configuration_version_id"] = "v3"
+        manager._run_config_update()
+        result = manager.update_configuration("cfg_id", "v3", "dep_id3")
+        self.assertEqual(result["blocks"]["error"][0]["kind"],
+                         "missing_type")
+        self.assertEqual(manager._configuration_manager.update.call_count, 1)
+        self.assertEqual(manager._api_proxy.get_configuration.call_count, 2)
+
+    def test_report_outbox(self):
+        """ Assert reports go through outbox when enabled
+        """
+        manager = DeploymentManager()
+        manager._api_proxy = MagicMock()
+        manager._configuration_manager = MagicMock()
+        manager._configuration_manager.update.return_value = {}
+        manager._api_proxy.get_configuration.return_value = {
+            "configuration_data": json.dumps({})
+        }
+        manager._outbox = MagicMock()
+        # reporting does not take part in deployment
+        manager._api_proxy.set_reported_configuration.side_effect = \
+            ConnectionError
+
+        manager.update_configuration("cfg_id", "cfg_version_id", "dep_id")
+        self.assertEqual(
+            manager._outbox.put.call_args_list[-1][0],
+            ("cfg_id", "cfg_version_id", "dep_id", "success",
+             "Successfully updated services and blocks"))
+        self.assertEqual(manager._outbox.put.call_count, 2)
+        self.assertEqual(manager.config_version_id, "cfg_version_id")
+
+    def test_deployment_status(self):
+        """ Assert deployments are tracked through their stages
+        """
+        manager = DeploymentManager()
+        manager._api_proxy = MagicMock()
+        manager._configuration_manager = MagicMock()
+        manager._api_proxy.get_configuration.return_value = {
+            "configuration_data": json.dumps({})
+        }
+        statuses = []
+
+        def update(*args):
+            statuses.append(manager.get_deployment("dep_id")["status"])
+            return {}
+        manager._configuration_manager.update.side_effect = update
+
+        manager.update_configuration("cfg_id", "cfg_version_id", "dep_id")
+        self.assertEqual(statuses, ["in_progress"])
+        deployment = manager.get_deployment("dep_id")
+        self.assertEqual(deployment["status"], "success")
+        self.assertEqual(deployment["instance_configuration_id"], "cfg_id")
+        self.assertEqual(deployment["instance_configuration_version_id"],
+                         "cfg_version_id")
+        self.assertIsNone(manager.get_deployment("unknown"))
+
+        # a raised error is reported as failure
+        manager._api_proxy.get_configuration.return_value = None
+        with self.assertRaises(RuntimeError):
+            manager.update_configuration("cfg_id", "cfg_version_id2", "dep2")
+        self.assertEqual(manager.get_deployment("dep2")["status"], "failure")
+        self.assertEqual(
+            [deployment["deployment_id"]
+             for deployment in manager.get_deployments()],
+            ["dep_id", "dep2"])
+
+    def test_queue_deployment(self):
+        """ Assert queued deployments are run in the background
+        """
+        manager = DeploymentManager()
+        manager._executor = MagicMock()
+        deployment = manager.queue_deployment(
+            "cfg_id", "cfg_version_id", "dep_id")
+        self.assertEqual(deployment["status"], "started")
+        manager._executor.submit.assert_called_once_with(
+            "cfg_id", "cfg_version_id", "dep_id")
+
+    def test_serialized_updates(self):
+        """ Assert updates go through executor and superseded are reported
+        """
+        manager = DeploymentManager()
+        manager._api_proxy = MagicMock()
+        manager._executor = MagicMock()
+        manager._executor.in_worker = False
+        future = manager._executor.submit.return_value
+        future.result.return_value = {"superseded_by": "dep2"}
+
+        self.assertEqual(
+            manager.update_configuration("cfg_id", "cfg_version_id", "dep1"),
+            {"superseded_by": "dep2"})
+        manager._executor.submit.assert_called_once_with(
+            "cfg_id", "cfg_version_id", "dep1")
+
+        manager._report_superseded("cfg_id", "cfg_version_id", "dep1", "dep2")
+        self.assertEqual(manager.get_deployment("dep1")["status"],
+                         "superseded")
+        manager._api_proxy.set_reported_configuration.assert_called_once_with(
+            "cfg_id", "cfg_version_id", "dep1",
+            DeploymentManager.Status.superseded.name,
+            "Superseded by deployment dep2")
+
+    def test_cached_configuration(self):
+        """ Assert cached configurations are used instead of the nio API
+        """
+        manager = DeploymentManager()
+        manager._api_proxy = MagicMock()
+        manager._configuration_manager = MagicMock()
+        manager._configuration_manager.update.return_value = {}
+        manager._cache = MagicMock()
+        configuration = {"blocks": {}, "services": {}, "blockTypes": {}}
+
+        # not cached, configuration is fetched and cached
+        manager._cache.get.return_value = None
+        manager._api_proxy.get_configuration.return_value = {
+            "configuration_data": json.dumps(configuration)
+        }
+        manager.update_configuration("cfg_id", "cfg_version_id", "dep_id")
+        manager._api_proxy.get_configuration.assert_called_once_with(
+            "cfg_id", "cfg_version_id")
+        manager._cache.writer.assert_called_once_with(
+            "cfg_id", "cfg_version_id")
+        writer = manager._cache.writer.return_value
+        writer.write.assert_called_once_with(json.dumps(configuration))
+        writer.commit.assert_called_once_with()
+
+        # cached, nio API is not used
+        manager._api_proxy.get_configuration.reset_mock()
+        manager._cache.get.return_value = json.dumps(configuration)
+        manager.update_configuration("cfg_id", "cfg_version_id", "dep_id")
+        self.assertEqual(manager._api_proxy.get_configuration.call_count, 0)
+        self.assertDictEqual(
+            manager._configuration_manager.update.call_args[0][0],
+            configuration)
+
+    def test_provided_configuration(self):
+        """ Assert configurations handed over with deployments are not
+        fetched
+        """
+        manager = DeploymentManager()
+        manager._api_proxy = MagicMock()
+        manager._configuration_manager = MagicMock()
+        manager._configuration_manager.update.return_value = {}
+        configuration = {"blocks": {}, "services": {}, "blockTypes": {}}
+
+        manager.provide_configuration("cfg_id", "cfg_version_id", "dep_id",
+                                      configuration)
+        manager.update_configuration("cfg_id", "cfg_version_id", "dep_id")
+        self.assertEqual(manager._api_proxy.get_configuration.call_count, 0)
+        self.assertDictEqual(
+            manager._configuration_manager.update.call_args[0][0],
+            configuration)
+        self.assertDictEqual(manager._provided, {})
+
+        # provided configuration is used by its deployment only
+        manager._api_proxy.get_configuration.return_value = {
+            "configuration_data": "{}"
+        }
+        manager.provide_configuration("cfg_id", "v2", "dep2", json.dumps(
+            configuration))
+        self.assertEqual(manager._provided,
+                         {"dep2": ("cfg_id", "v2", configuration)})
+        manager.update_configuration("cfg_id", "v2", "dep3")
+        self.assertEqual(manager._api_proxy.get_configuration.call_count, 1)
+        self.assertDictEqual(
+            manager._configuration_manager.update.call_args[0][0], {})
+        # and dropped once superseded
+        manager._report_superseded("cfg_id", "v2", "dep2", "dep3")
+        self.assertDictEqual(manager._provided, {})
+
+        # or once finished, even when not used
+        manager.provide_configuration("cfg_id", "v3", "dep4", configuration)
+        manager.update_configuration("cfg_id", "v4", "dep4")
+        self.assertEqual(manager._api_proxy.get_configuration.call_count, 2)
+        self.assertDictEqual(manager._provided, {})
+
+        # not cached, it is not verified
+        manager._cache = MagicMock()
+        manager.provide_configuration("cfg_id", "v5", "dep5", configuration)
+        manager.update_configuration("cfg_id", "v5", "dep5")
+        self.assertEqual(manager._cache.put.call_count, 0)
+
+    @patch(DeploymentState.__module__ + ".Persistence")
+    def test_deployment_state(self, persistence):
+        """ Assert deployment state is written once per deployment
+        """
+        manager = DeploymentManager()
+        manager._state = DeploymentState(delay=60)
+        manager._api_proxy = MagicMock()
+        manager._configuration_manager = MagicMock()
+        manager._configuration_manager.update.return_value = {}
+        manager._api_proxy.get_configuration.return_value = {
+            "configuration_data": json.dumps({"blocks": {}})
+        }
+        manager.update_configuration("cfg_id", "v1", "dep_id")
+        persistence.return_value.save.assert_called_once_with(
+            ANY, "deployment_state")
+        record = persistence.return_value.save.call_args[0][0]
+        self.assertEqual(
+            (record["config_id"], record["config_version_id"],
+             record["deployment_id"]), ("cfg_id", "v1", "dep_id"))
+        self.assertIsNotNone(record["fingerprints"])
+
+    @patch(DeploymentState.__module__ + ".Persistence")
+    def test_conditional_poll(self, persistence):
+        """ Assert validators are sent and persisted for the running config
+        """
+        manager = DeploymentManager()
+        manager.config_id = "cfg_id"
+        manager.config_version_id = "cfg_version_id"
+        persistence.reset_mock()
+        manager._api_proxy = MagicMock()
+        manager._configuration_manager = MagicMock()
+        manager._configuration_manager.update.return_value = {}
+        manager._api_proxy.get_configuration.return_value = {
+            "configuration_data": json.dumps({})
+        }
+
+        def get_ids(validators, wait):
+            validators["etag"] = "etag1"
+            validators["last_modified"] = None
+            return {
+                "instance_configuration_id": "cfg_id",
+                "instance_configuration_version_id": "cfg_version_id",
+                "deployment_id": "dep_id"
+            }
+        manager._api_proxy.get_instance_config_ids.side_effect = get_ids
+
+        # no validators known yet, unchanged configuration stores them
+        manager._run_config_update()
+        self.assertEqual(
+            manager._api_proxy.get_instance_config_ids.call_args[0][0],
+            {"etag": "etag1", "last_modified": None})
+        persistence.return_value.save.assert_called_once_with(
+            ANY, "deployment_state")
+        self.assertEqual(
+            persistence.return_value.save.call_args[0][0]["validators"],
+            {"config_id": "cfg_id", "config_version_id": "cfg_version_id",
+             "etag": "etag1", "last_modified": None})
+        self.assertEqual(manager._get_request_validators(),
+                         {"etag": "etag1", "last_modified": None})
+
+        # a 304 (None) neither updates nor saves
+        persistence.reset_mock()
+        manager._api_proxy.get_instance_config_ids.side_effect = None
+        manager._api_proxy.get_instance_config_ids.return_value = None
+        manager._run_config_update()
+        self.assertEqual(persistence.return_value.save.call_count, 0)
+        self.assertEqual(manager._configuration_manager.update.call_count, 0)
+
+        # validators issued for another version are not sent
+        manager.config_version_id = "cfg_version_id2"
+        self.assertEqual(manager._get_request_validators(),
+                         {"etag": None, "last_modified": None})
+
+    @patch(DeploymentState.__module__ + ".Persistence")
+    def test_fingerprint_poll(self, persistence):
+        """ Assert ids are only polled when desired fingerprint changed
+        """
+        manager = DeploymentManager()
+        manager._poll_fingerprint = True
+        manager.config_id = "cfg_id"
+        manager.config_version_id = "v1"
+        persistence.reset_mock()
+        manager._api_proxy = MagicMock()
+        manager._configuration_manager = MagicMock()
+        manager._configuration_manager.update.return_value = {}
+        manager._api_proxy.get_configuration.return_value = {
+            "configuration_data": json.dumps({})
+        }
+        ids = {
+            "instance_configuration_id": "cfg_id",
+            "instance_configuration_version_id": "v1",
+            "deployment_id": "dep_id"
+        }
+        manager._api_proxy.get_instance_config_ids.return_value = ids
+        proxy_fingerprint = manager._api_proxy.get_desired_fingerprint
+
+        # nothing handled yet, ids are polled and fingerprint stored
+        manager._run_config_update()
+        self.assertEqual(proxy_fingerprint.call_count, 0)
+        stored = {"config_id": "cfg_id", "config_version_id": "v1",
+                  "fingerprint": desired_fingerprint("cfg_id", "v1",
+                                                     "dep_id")}
+        self.assertEqual(manager._state.desired_fingerprint, stored)
+        self.assertEqual(persistence.return_value.save.call_args[0][0][
+            "desired_fingerprint"], stored)
+
+        # unchanged fingerprint, ids are not polled
+        proxy_fingerprint.return_value = stored["fingerprint"]
+        manager._api_proxy.get_instance_config_ids.reset_mock()
+        self.assertIsNone(manager._run_config_update())
+        self.assertEqual(
+            manager._api_proxy.get_instance_config_ids.call_count, 0)
+
+        # changed fingerprint, new version is deployed
+        ids = dict(ids, instance_configuration_version_id="v2",
+                   deployment_id="dep_2")
+        manager._api_proxy.get_instance_config_ids.return_value = ids
+        proxy_fingerprint.return_value = desired_fingerprint(
+            "cfg_id", "v2", "dep_2")
+        self.assertIsNotNone(manager._run_config_update())
+        self.assertEqual(manager.config_version_id, "v2")
+        self.assertEqual(manager._state.desired_fingerprint, {
+            "config_id": "cfg_id", "config_version_id": "v2",
+            "fingerprint": proxy_fingerprint.return_value})
+
+        # running configuration changed by a direct update, ids are polled
+        manager.update_configuration("cfg_id", "v3", "dep_3")
+        manager._api_proxy.get_instance_config_ids.reset_mock()
+        manager._run_config_update()
+        self.assertEqual(
+            manager._api_proxy.get_instance_config_ids.call_count, 1)
+        self.assertEqual(manager.config_version_id, "v2")
+
+        # no configuration desired, ids are polled and checks go on
+        proxy_fingerprint.return_value = ""
+        manager._api_proxy.get_instance_config_ids.reset_mock()
+        manager._run_config_update()
+        self.assertEqual(
+            manager._api_proxy.get_instance_config_ids.call_count, 1)
+        self.assertTrue(manager._poll_fingerprint)
+
+        # failed update is polled again, its fingerprint is not stored
+        stored = manager._state.desired_fingerprint
+        manager._configuration_manager.update.return_value = {
+            "blocks": {"error": ["failed"]}}
+        manager._api_proxy.get_instance_config_ids.return_value = dict(
+            ids, instance_configuration_version_id="v4",
+            deployment_id="dep_4")
+        proxy_fingerprint.return_value = desired_fingerprint(
+            "cfg_id", "v4", "dep_4")
+        manager._api_proxy.get_instance_config_ids.reset_mock()
+        manager._run_config_update()
+        manager._run_config_update()
+        self.assertEqual(
+            manager._api_proxy.get_instance_config_ids.call_count, 2)
+        self.assertEqual(manager.config_version_id, "v2")
+        self.assertEqual(manager._state.desired_fingerprint, stored)
+        manager._configuration_manager.update.return_value = {}
+
+        # fingerprints not provided, checks are disabled
+        proxy_fingerprint.reset_mock()
+        proxy_fingerprint.return_value = None
+        manager._run_config_update()
+        manager._run_config_update()
+        self.assertEqual(proxy_fingerprint.call_count, 1)
+        self.assertFalse(manager._poll_fingerprint)
+
+        # not checked when long-polling
+        manager._poll_fingerprint = True
+        manager._poll_wait = 20
+        proxy_fingerprint.reset_mock()
+        manager._run_config_update()
+        self.assertEqual(proxy_fingerprint.call_count, 0)
+
+    @patch(DeploymentState.__module__ + ".Persistence")
+    def test_fingerprint_staged(self, persistence):
+        """ Assert a change of the staged configuration alone is polled
+        """
+        manager = DeploymentManager()
+        manager._poll_fingerprint = True
+        manager.config_id = "cfg_id"
+        manager.config_version_id = "v1"
+        manager._api_proxy = MagicMock()
+        manager._stager = MagicMock()
+        ids = {
+            "instance_configuration_id": "cfg_id",
+            "instance_configuration_version_id": "v1",
+            "deployment_id": "dep_id",
+            "staged_configuration_id": "cfg_id",
+            "staged_configuration_version_id": "v2"
+        }
+        manager._api_proxy.get_instance_config_ids.return_value = ids
+        manager._run_config_update()
+        manager._stager.stage.assert_called_once_with("cfg_id", "v2")
+
+        # only the staged version changed
+        ids = dict(ids, staged_configuration_version_id="v3")
+        manager._api_proxy.get_instance_config_ids.return_value = ids
+        manager._api_proxy.get_desired_fingerprint.return_value = \
+            desired_fingerprint("cfg_id", "v1", "dep_id", "cfg_id", "v3")
+        manager._run_config_update()
+        self.assertEqual(
+            manager._api_proxy.get_instance_config_ids.call_count, 2)
+        manager._stager.stage.assert_called_with("cfg_id", "v3")
+
+        # unchanged
+        manager._run_config_update()
+        self.assertEqual(
+            manager._api_proxy.get_instance_config_ids.call_count, 2)
+        self.assertNotEqual(
+            desired_fingerprint("cfg_id", "v1", "dep_id", "cfg_id", "v3"),
+            desired_fingerprint("cfg_id", "v1", "dep_id"))
+
     def test_polling(self):
         """ Assert polling is setup upon start and cleaned up upon stop
         """
@@ -206,6 +1108,77 @@ class TestDeploymentManager(NIOTestCase):
         manager.stop()
         self.assertIsNone(manager._poll_job)
 
+    def test_poll_scheduling(self):
+        """ Assert next poll is scheduled according to poll outcome
+        """
+        manager = DeploymentManager()
+        manager._poll_scheduler = MagicMock()
+        manager._poll_scheduler.next_delay.return_value = 5
+        manager._poll_job = MagicMock()
+        manager._run_config_update = MagicMock(return_value=None)
+
+        with patch(manager.__module__ + ".Job") as job:
+            manager._poll_config_update()
+            manager._poll_scheduler.success.assert_called_once_with()
+            self.assertEqual(manager._poll_scheduler.deployed.call_count, 0)
+            job.assert_called_once_with(
+                manager._poll_config_update, timedelta(seconds=5), False)
+
+            # a deployment speeds up polling
+            manager._run_config_update.return_value = {}
+            manager._poll_config_update()
+            manager._poll_scheduler.deployed.assert_called_once_with()
+
+            # failures back off
+            manager._run_config_update.side_effect = RuntimeError
+            manager._poll_config_update()
+            manager._poll_scheduler.failure.assert_called_once_with()
+            self.assertEqual(job.call_count, 3)
+
+            # no polling once stopped
+            manager._poll_job = None
+            manager._poll_config_update()
+            self.assertEqual(job.call_count, 3)
+
+    def test_pushed_deployments(self):
+        """ Assert pushed deployments are applied and polls skipped while
+        the push channel is connected
+        """
+        manager = DeploymentManager()
+        manager._poll_scheduler = MagicMock()
+        manager._poll_scheduler.next_delay.return_value = 5
+        manager._poll_job = MagicMock()
+        manager._run_config_update = MagicMock(return_value=None)
+        manager._push = MagicMock(connected=True)
+
+        with patch(manager.__module__ + ".Job") as job:
+            manager._poll_config_update()
+            self.assertEqual(manager._run_config_update.call_count, 0)
+            manager._poll_scheduler.success.assert_called_once_with()
+            self.assertEqual(job.call_count, 1)
+
+            manager._push.connected = False
+            manager._poll_config_update()
+            manager._run_config_update.assert_called_once_with()
+
+        manager.update_configuration = MagicMock(return_value={})
+        manager._set_desired_fingerprint = MagicMock()
+        ids = {
+            "instance_configuration_id": "cfg_id",
+            "instance_configuration_version_id": "cfg_version_id",
+            "deployment_id": "dep_id"
+        }
+        self.assertEqual(manager._on_pushed_deployment(ids), {})
+        manager.update_configuration.assert_called_once_with(
+            "cfg_id", "cfg_version_id", "dep_id")
+        manager._set_desired_fingerprint.assert_called_once_with(ids)
+
+        # running already
+        manager._state.update(config_id="cfg_id",
+                              config_version_id="cfg_version_id")
+        self.assertIsNone(manager._on_pushed_deployment(ids))
+        self.assertEqual(manager.update_configuration.call_count, 1)
+
     def test_poll_on_start(self):
         """ Test optional polling on start
         """
@@ -216,6 +1189,7 @@ class TestDeploymentManager(NIOTestCase):
         with patch("nio.modules.settings.Settings.get"):
             manager.configure(CoreContext([], []))
             manager._poll_on_start = True
+            manager._cache = None
 
         with patch(manager.__module__ + '.DeploymentProxy') as mock_api:
             configuration = {
@@ -223,6 +1197,7 @@ class TestDeploymentManager(NIOTestCase):
                 "services": {},
                 "blockTypes": {},
             }
+            # configurations are not streamed by default
             mock_api.return_value.get_configuration.return_value = {
                 "configuration_data": json.dumps(configuration),
             }
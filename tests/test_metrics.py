@@ -0,0 +1,62 @@
+from itertools import count
+
+from nio.testing.test_case import NIOTestCase
+
+from ..metrics import DeploymentMetrics, DeploymentTimer
+
+
+class TestDeploymentMetrics(NIOTestCase):
+
+    def test_timer(self):
+        timer = DeploymentTimer(clock=count().__next__)
+        with timer.phase("fetch"):
+            pass
+        with timer.phase("decode"):
+            pass
+        # repeated phases add up
+        with timer.phase("fetch"):
+            pass
+        timer.add("bytes_downloaded", 10)
+        timer.add("bytes_downloaded", 5)
+        self.assertEqual(timer.phases, {"fetch": 2, "decode": 1})
+        self.assertEqual(timer.counters, {"bytes_downloaded": 15})
+
+        # a failing phase is timed as well
+        with self.assertRaises(ValueError):
+            with timer.phase("apply"):
+                raise ValueError
+        self.assertEqual(timer.phases["apply"], 1)
+
+    def test_snapshot(self):
+        metrics = DeploymentMetrics(window=100)
+        self.assertEqual(metrics.snapshot(), {
+            "deployments": 0, "window": 0, "phases": {}, "counters": {},
+            "last": None})
+
+        for value in range(1, 151):
+            timer = DeploymentTimer()
+            timer.phases = {"apply": value, "fetch": value * 2}
+            timer.counters = {"objects_applied": value}
+            metrics.record(timer)
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot["deployments"], 150)
+        # only last 100 deployments are covered
+        self.assertEqual(snapshot["window"], 100)
+        self.assertEqual(snapshot["phases"]["apply"], {
+            "p50": 100, "p90": 140, "p99": 149, "max": 150, "mean": 100.5})
+        self.assertEqual(snapshot["phases"]["fetch"]["p50"], 200)
+        # phases are listed in the order they happen
+        self.assertEqual(list(snapshot["phases"]), ["fetch", "apply"])
+        self.assertEqual(snapshot["counters"]["objects_applied"]["max"], 150)
+        self.assertEqual(snapshot["last"], {
+            "phases": {"apply": 150, "fetch": 300},
+            "counters": {"objects_applied": 150}})
+
+    def test_percentiles_few_samples(self):
+        metrics = DeploymentMetrics()
+        timer = DeploymentTimer()
+        timer.phases = {"apply": 3}
+        metrics.record(timer)
+        self.assertEqual(metrics.snapshot()["phases"]["apply"], {
+            "p50": 3, "p90": 3, "p99": 3, "max": 3, "mean": 3})
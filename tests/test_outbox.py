@@ -0,0 +1,167 @@
+import time
+from threading import Event
+from unittest.mock import MagicMock, patch
+
+from requests.exceptions import HTTPError
+
+from nio.testing.test_case import NIOTestCase
+
+from ..outbox import ReportOutbox
+
+
+class TestReportOutbox(NIOTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch(ReportOutbox.__module__ + ".Persistence")
+        self._persistence = patcher.start().return_value
+        self._persistence.load.return_value = []
+        self.addCleanup(patcher.stop)
+        self._sent = []
+        self._outbox = None
+
+    def tearDown(self):
+        if self._outbox:
+            self._outbox.stop()
+        super().tearDown()
+
+    def _send(self, **report):
+        self._sent.append((report["deployment_id"], report["status"]))
+
+    def _create(self, send=None, **kwargs):
+        self._outbox = ReportOutbox(send or self._send, **kwargs)
+        return self._outbox
+
+    def test_send(self):
+        outbox = self._create()
+        outbox.start()
+        outbox.put("cfg", "v1", "dep1", "accepted", "message")
+        outbox.put("cfg", "v1", "dep1", "success")
+        self.assertTrue(outbox.flush(1))
+        self.assertIn(self._sent, ([("dep1", "accepted"), ("dep1", "success")],
+                                   [("dep1", "success")]))
+        self.assertEqual(outbox.pending, 0)
+        self._persistence.save.assert_called_with([], "report_outbox")
+
+    def test_latest_per_deployment(self):
+        """ A waiting report is replaced by a newer one of same deployment
+        """
+        outbox = self._create()
+        outbox.put("cfg", "v1", "dep1", "accepted")
+        outbox.put("cfg", "v2", "dep2", "accepted")
+        outbox.put("cfg", "v1", "dep1", "success")
+        self.assertEqual(outbox.pending, 2)
+        self._persistence.save.assert_called_with([{
+            "config_id": "cfg", "config_version_id": "v1",
+            "deployment_id": "dep1", "status": "success", "message": ""
+        }, {
+            "config_id": "cfg", "config_version_id": "v2",
+            "deployment_id": "dep2", "status": "accepted", "message": ""
+        }], "report_outbox")
+
+        outbox.start()
+        self.assertTrue(outbox.flush(1))
+        self.assertEqual(self._sent, [("dep1", "success"),
+                                      ("dep2", "accepted")])
+
+    def test_persisted_reports(self):
+        """ Reports not sent before stopping are sent once started again
+        """
+        self._persistence.load.return_value = [{
+            "config_id": "cfg", "config_version_id": "v1",
+            "deployment_id": "dep1", "status": "success", "message": ""
+        }]
+        outbox = self._create()
+        self.assertEqual(outbox.pending, 1)
+        outbox.start()
+        self.assertTrue(outbox.flush(1))
+        self.assertEqual(self._sent, [("dep1", "success")])
+
+    def test_retry(self):
+        """ Failed reports are retried with backoff """
+        failures = [ConnectionError(), HTTPError(response=MagicMock(
+            status_code=503))]
+
+        def send(**report):
+            if failures:
+                raise failures.pop(0)
+            self._send(**report)
+
+        outbox = self._create(send, retry_interval=0.01)
+        outbox.start()
+        outbox.put("cfg", "v1", "dep1", "success")
+        self.assertTrue(outbox.flush(1))
+        self.assertEqual(self._sent, [("dep1", "success")])
+
+    def test_backoff(self):
+        send = MagicMock(side_effect=ConnectionError())
+        waits = []
+        outbox = self._create(send, retry_interval=1, max_retry_interval=4)
+        done = Event()
+
+        def wait_for(predicate, timeout=None):
+            waits.append(timeout)
+            if len(waits) == 5:
+                outbox._stopped = True
+                done.set()
+            return predicate()
+        outbox._condition.wait_for = wait_for
+        outbox.put("cfg", "v1", "dep1", "success")
+        outbox.start()
+        self.assertTrue(done.wait(1))
+        self.assertEqual(waits, [1, 2, 4, 4, 4])
+        self.assertEqual(outbox.pending, 1)
+
+    def test_rejected_report(self):
+        """ Reports rejected with a client error are dropped """
+        send = MagicMock(side_effect=[
+            HTTPError(response=MagicMock(status_code=400)), None])
+        outbox = self._create(send)
+        outbox.put("cfg", "v1", "dep1", "success")
+        outbox.put("cfg", "v2", "dep2", "success")
+        outbox.start()
+        self.assertTrue(outbox.flush(1))
+        self.assertEqual(send.call_count, 2)
+
+    def test_batches(self):
+        """ Outbox is persisted once per batch of sent reports """
+        outbox = self._create(batch_size=2)
+        for index in range(5):
+            outbox.put("cfg", "v1", "dep{}".format(index), "success")
+        self._persistence.save.reset_mock()
+        outbox.start()
+        self.assertTrue(outbox.flush(1))
+        self.assertEqual(len(self._sent), 5)
+        self.assertEqual(self._persistence.save.call_count, 3)
+
+    def test_save_delay(self):
+        """ Reports queued together are persisted at once """
+        outbox = self._create(save_delay=0.1)
+        for index in range(5):
+            outbox.put("cfg", "v1", "dep{}".format(index), "success")
+        self._persistence.save.assert_not_called()
+        time.sleep(0.3)
+        self.assertEqual(self._persistence.save.call_count, 1)
+        self.assertEqual(len(self._persistence.save.call_args[0][0]), 5)
+
+        # pending changes are persisted when stopping
+        outbox.put("cfg", "v1", "dep5", "success")
+        outbox.stop()
+        self.assertEqual(self._persistence.save.call_count, 2)
+        self.assertEqual(len(self._persistence.save.call_args[0][0]), 6)
+
+    def test_save_on_failure(self):
+        """ Waiting reports are persisted right away when sending fails """
+        send = MagicMock(side_effect=ConnectionError())
+        outbox = self._create(send, retry_interval=10, save_delay=10)
+        outbox.put("cfg", "v1", "dep1", "success")
+        self._persistence.save.assert_not_called()
+        outbox.start()
+        end = time.monotonic() + 1
+        while not self._persistence.save.called:
+            self.assertLess(time.monotonic(), end)
+            time.sleep(0.01)
+        self._persistence.save.assert_called_once_with([{
+            "config_id": "cfg", "config_version_id": "v1",
+            "deployment_id": "dep1", "status": "success", "message": ""
+        }], "report_outbox")
@@ -0,0 +1,130 @@
+import json
+import tempfile
+from unittest.mock import MagicMock
+
+from nio.testing.test_case import NIOTestCase
+
+from ..benchmarks.configurations import synthetic_configuration
+from ..benchmarks.stub_api import StubProductAPI
+from ..cache import ConfigurationCache
+from ..manager import DeploymentManager
+from ..patch import PatchError, apply_patch, checksum
+from ..proxy import DeploymentProxy
+
+
+class TestApplyPatch(NIOTestCase):
+
+    def test_operations(self):
+        document = {"foo": ["bar", "baz"], "a/b": 1, "m~n": 2}
+        document = apply_patch(document, [
+            {"op": "add", "path": "/foo/1", "value": "qux"},
+            {"op": "add", "path": "/foo/-", "value": "end"},
+            {"op": "remove", "path": "/a~1b"},
+            {"op": "replace", "path": "/m~0n", "value": 3},
+            {"op": "copy", "from": "/foo/0", "path": "/copied"},
+            {"op": "move", "from": "/copied", "path": "/moved"},
+            {"op": "test", "path": "/moved", "value": "bar"},
+            {"op": "add", "path": "/child", "value": {"grand": {}}},
+            {"op": "add", "path": "/child/grand/x", "value": None}
+        ])
+        self.assertEqual(document, {
+            "foo": ["bar", "qux", "baz", "end"],
+            "m~n": 3,
+            "moved": "bar",
+            "child": {"grand": {"x": None}}
+        })
+
+        # whole document may be replaced
+        self.assertEqual(apply_patch(
+            document, [{"op": "replace", "path": "", "value": [1]}]), [1])
+
+    def test_errors(self):
+        for operations in (
+                {"op": "add"},
+                [{"op": "unknown", "path": "/a"}],
+                [{"op": "add", "path": "a", "value": 1}],
+                [{"op": "add", "path": "/a"}],
+                [{"op": "add", "path": "/missing/a", "value": 1}],
+                [{"op": "remove", "path": "/missing"}],
+                [{"op": "replace", "path": "/missing", "value": 1}],
+                [{"op": "add", "path": "/list/3", "value": 1}],
+                [{"op": "add", "path": "/list/01", "value": 1}],
+                [{"op": "remove", "path": "/list/-"}],
+                [{"op": "add", "path": "/number/a", "value": 1}],
+                [{"op": "move", "from": "/object", "path": "/object/a"}],
+                [{"op": "test", "path": "/number", "value": 2}]):
+            with self.assertRaises(PatchError, msg=operations):
+                apply_patch({"list": [1, 2], "number": 1, "object": {}},
+                            operations)
+
+    def test_checksum(self):
+        self.assertEqual(checksum({"a": 1, "b": [1, "é"]}),
+                         checksum({"b": [1, "é"], "a": 1}))
+        self.assertNotEqual(checksum({"a": 1}), checksum({"a": 2}))
+
+
+class TestPatchDownloads(NIOTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._dir = tempfile.TemporaryDirectory()
+        self._api = StubProductAPI(patches=True).start()
+        self._configurations = {
+            "v1": synthetic_configuration(100),
+            "v2": synthetic_configuration(100, version=2)
+        }
+        for version, configuration in self._configurations.items():
+            self._api.add_configuration("cfg_id", version, configuration)
+
+        self._manager = DeploymentManager()
+        self._manager._patch_downloads = True
+        self._manager._stream_downloads = True
+        self._manager._cache = ConfigurationCache(self._dir.name, 10485760)
+        self._manager._configuration_manager = MagicMock()
+        self._manager._configuration_manager.update.return_value = {}
+        self._manager._api_proxy = DeploymentProxy(
+            self._api.url, MagicMock(api_key="key", instance_id="instance"))
+
+    def tearDown(self):
+        self._manager._api_proxy.close()
+        self._api.stop()
+        self._dir.cleanup()
+        super().tearDown()
+
+    def _deploy(self, version):
+        self._manager.update_configuration("cfg_id", version, version)
+        self.assertEqual(self._manager.config_version_id, version)
+        self.assertEqual(
+            json.loads(self._manager._cache.get("cfg_id", version)),
+            self._configurations[version])
+        metrics = self._manager.get_metrics()["last"]
+        return metrics["counters"]["bytes_downloaded"]
+
+    def test_patch(self):
+        """ A new version of running configuration is patched """
+        full = self._deploy("v1")
+        patched = self._deploy("v2")
+        self.assertLess(patched * 10, full)
+
+    def test_fallback(self):
+        """ Full version is downloaded when a patch does not apply """
+        full = self._deploy("v1")
+        # running configuration in cache no longer matches patch
+        self._manager._cache.put("cfg_id", "v1", '{"blocks": {}}')
+        self.assertGreaterEqual(self._deploy("v2"), full)
+
+        # checksum mismatch
+        self._api._patch = lambda *args: (
+            200, {}, {"patch": [], "checksum": "other"})
+        self._configurations["v3"] = synthetic_configuration(100, version=3)
+        self._api.add_configuration(
+            "cfg_id", "v3", self._configurations["v3"])
+        self.assertGreaterEqual(self._deploy("v3"), full)
+
+        # patches not provided
+        del self._api._patch
+        self._api._patches = False
+        self._configurations["v4"] = synthetic_configuration(100, version=4)
+        self._api.add_configuration(
+            "cfg_id", "v4", self._configurations["v4"])
+        self.assertGreaterEqual(self._deploy("v4"), full)
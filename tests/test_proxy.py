@@ -1,22 +1,70 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import patch, Mock
 from requests.exceptions import HTTPError
 
 from nio.testing.test_case import NIOTestCase
 
-from ..proxy import DeploymentProxy
+from ..benchmarks.configurations import synthetic_configuration
+from ..benchmarks.stub_api import StubProductAPI
+from ..proxy import DeploymentProxy, desired_fingerprint
+from ..wire import ACCEPT_ENCODING, accept_header
 
 
-@patch("{}.requests".format(DeploymentProxy.__module__))
 class TestDeploymentProxy(NIOTestCase):
 
     def setUp(self):
         super().setUp()
+        patcher = patch("{}.requests".format(DeploymentProxy.__module__))
+        self._mock_req = patcher.start()
+        self.addCleanup(patcher.stop)
         manager = Mock()
         manager.api_key = "token"
         manager.instance_id = "my_instance_id"
         self._proxy = DeploymentProxy("api_url_prefix", manager)
+        self._timeout = (10, 60)
 
-    def test_get_instance_config_ids(self, mock_req):
+    def test_session(self):
+        """Requests go through one pooled session owned by the proxy"""
+        mock_req = self._mock_req
+        mock_req.reset_mock()
+        session, stream_session = mock_req.Session.return_value, Mock()
+        mock_req.Session.side_effect = [session, stream_session]
+        manager = Mock()
+        proxy = DeploymentProxy("api_url_prefix", manager, pool_size=5,
+                                connect_timeout=1, read_timeout=2)
+        self.assertEqual(session.mount.call_count, 2)
+        adapter = session.mount.call_args[0][1]
+        self.assertEqual(adapter._pool_maxsize, 5)
+
+        proxy.get_configuration("config_id", "config_version_id")
+        self.assertEqual(session.get.call_args[1]["timeout"], (1, 2))
+        self.assertEqual(mock_req.get.call_count, 0)
+
+        # the event stream does not hold a pooled connection
+        proxy.open_event_stream()
+        self.assertEqual(session.get.call_count, 1)
+        self.assertTrue(stream_session.get.call_args[1]["stream"])
+
+        proxy.close()
+        session.close.assert_called_once_with()
+        stream_session.close.assert_called_once_with()
+
+    def test_no_keep_alive(self):
+        mock_req = self._mock_req
+        manager = Mock()
+        manager.api_key = "token"
+        proxy = DeploymentProxy("api_url_prefix", manager, keep_alive=False)
+        proxy.get_configuration("config_id", "config_version_id")
+        headers = mock_req.Session.return_value.get.call_args[1]["headers"]
+        self.assertEqual(headers["connection"], "close")
+        # connections found closed once reused are replaced
+        adapter = mock_req.Session.return_value.mount.call_args_list[-4][0][1]
+        self.assertEqual(adapter.max_retries.read, 1)
+
+    def test_get_instance_config_ids(self):
+        mock_req = self._mock_req
         self._proxy.get_instance_config_ids()
         expected_headers = {
             "authorization": "apikey token",
@@ -24,15 +72,25 @@ class TestDeploymentProxy(NIOTestCase):
         }
 
         desired_url = "api_url_prefix/instances/my_instance_id/configuration"
-        mock_req.get.assert_called_with(desired_url, headers=expected_headers)
+        mock_req.Session.return_value.get.assert_called_with(
+            desired_url, headers=expected_headers, timeout=self._timeout)
 
-    def test_get_instance_config_errors(self, mock_req):
+    def test_get_instance_config_ids_wait(self):
+        """Long-poll wait is sent and added to read timeout"""
+        self._proxy.get_instance_config_ids(wait=30)
+        kwargs = self._mock_req.Session.return_value.get.call_args[1]
+        self.assertEqual(kwargs["params"], {"wait": 30})
+        self.assertEqual(kwargs["timeout"], (10, 90))
+
+    def test_get_instance_config_errors(self):
         """Tests the behavior when fetching the config ID causes an error"""
+        mock_req = self._mock_req
         # A 404 should do nothing, since that's a missing configuration for
         # the instance
         mock_resp = Mock()
         mock_resp.status_code = 404
-        mock_req.get.side_effect = HTTPError(response=mock_resp)
+        mock_req.Session.return_value.get.side_effect = \
+            HTTPError(response=mock_resp)
         self._proxy.get_instance_config_ids()
 
         # Any non-400 should raise though
@@ -40,7 +98,8 @@ class TestDeploymentProxy(NIOTestCase):
         with self.assertRaises(HTTPError):
             self._proxy.get_instance_config_ids()
 
-    def test_notify_instance_config_ids(self, mock_req):
+    def test_notify_instance_config_ids(self):
+        mock_req = self._mock_req
         cfg_id = "cfg_id"
         cfg_version_id = "cfg_version_id"
         deployment_id = "dep_id"
@@ -56,9 +115,10 @@ class TestDeploymentProxy(NIOTestCase):
 
         desired_url = \
             "api_url_prefix/instances/my_instance_id/configuration"
-        mock_req.post.assert_called_with(
+        mock_req.Session.return_value.post.assert_called_with(
             desired_url,
             headers=expected_headers,
+            timeout=self._timeout,
             json={
                 'reported_configuration_id': cfg_id,
                 'reported_configuration_version_id': cfg_version_id,
@@ -68,12 +128,280 @@ class TestDeploymentProxy(NIOTestCase):
             }
         )
 
-    def test_get_configuration(self, mock_req):
+    def test_get_configuration(self):
+        mock_req = self._mock_req
         self._proxy.get_configuration("config_id", "config_version_id")
         expected_headers = {
             "authorization": "apikey token",
-            "content-type": "application/json"
+            "content-type": "application/json",
+            "accept": accept_header(),
+            "accept-encoding": ACCEPT_ENCODING
         }
         desired_url = ("api_url_prefix/instance_configurations/config_id/"
                        "versions/config_version_id")
-        mock_req.get.assert_called_with(desired_url, headers=expected_headers)
+        mock_req.Session.return_value.get.assert_called_with(
+            desired_url, headers=expected_headers, timeout=self._timeout)
+
+    def test_get_configuration_patch(self):
+        get = self._mock_req.Session.return_value.get
+        self.assertEqual(
+            self._proxy.get_configuration_patch("config_id", "v1", "v2"),
+            get.return_value.json.return_value)
+        get.assert_called_with(
+            "api_url_prefix/instance_configurations/config_id/versions/v2/"
+            "patch",
+            headers={"authorization": "apikey token",
+                     "content-type": "application/json"},
+            timeout=self._timeout, params={"from": "v1"})
+
+        # patches not provided
+        response = Mock(status_code=404)
+        get.return_value.raise_for_status.side_effect = \
+            HTTPError(response=response)
+        self.assertIsNone(
+            self._proxy.get_configuration_patch("config_id", "v1", "v2"))
+        response.status_code = 500
+        with self.assertRaises(HTTPError):
+            self._proxy.get_configuration_patch("config_id", "v1", "v2")
+
+    def test_get_instance_config_ids_conditional(self):
+        """Validators are sent and a 304 is reported as no change"""
+        mock_req = self._mock_req
+        response = mock_req.Session.return_value.get.return_value
+        response.status_code = 304
+        response.headers = {"etag": "etag2", "last-modified": "date2"}
+        validators = {"etag": "etag1", "last_modified": "date1"}
+
+        self.assertIsNone(self._proxy.get_instance_config_ids(validators))
+        headers = mock_req.Session.return_value.get.call_args[1]["headers"]
+        self.assertEqual(headers["if-none-match"], "etag1")
+        self.assertEqual(headers["if-modified-since"], "date1")
+        self.assertEqual(response.json.call_count, 0)
+        self.assertEqual(
+            validators, {"etag": "etag2", "last_modified": "date2"})
+
+        response.status_code = 200
+        self.assertEqual(self._proxy.get_instance_config_ids(validators),
+                         response.json.return_value)
+
+    def test_stream_configuration(self):
+        """Configuration is decoded from response chunks"""
+        response = self._mock_req.Session.return_value.get.return_value
+        response.encoding = "utf-8"
+        text = json.dumps({
+            "configuration_data": json.dumps(
+                {"blocks": {"block1": {"name": "é"}}, "services": {}}),
+            "message": "Found Instance Configuration"
+        }).encode()
+        response.iter_content.return_value = \
+            [text[i:i + 7] for i in range(0, len(text), 7)]
+        pieces = []
+
+        configuration = self._proxy.stream_configuration(
+            "config_id", "config_version_id", sink=pieces.append)
+        self.assertEqual(configuration, {
+            "configuration_data": {
+                "blocks": {"block1": {"name": "é"}}, "services": {}},
+            "message": "Found Instance Configuration"
+        })
+        self.assertEqual(
+            json.loads("".join(pieces)),
+            {"blocks": {"block1": {"name": "é"}}, "services": {}})
+        self.assertTrue(
+            self._mock_req.Session.return_value.get.call_args[1]["stream"])
+        response.close.assert_called_once_with()
+
+
+class TestDeploymentProxyTransfer(NIOTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._api = StubProductAPI(compress=True).start()
+        self._api.add_configuration(
+            "config_id", "v1", synthetic_configuration(50))
+        self._api.set_desired("my_instance_id", "config_id", "v1", "dep_id")
+        manager = Mock()
+        manager.api_key = "token"
+        manager.instance_id = "my_instance_id"
+        self._proxy = DeploymentProxy(self._api.url, manager)
+
+    def tearDown(self):
+        self._proxy.close()
+        self._api.stop()
+        super().tearDown()
+
+    def test_bytes_received(self):
+        """Bytes are counted as transferred, before decompression"""
+        configuration = self._proxy.get_configuration("config_id", "v1")
+        self.assertEqual(self._proxy.bytes_received, self._api.bytes_sent)
+        self.assertLess(self._proxy.bytes_received,
+                        len(json.dumps(configuration)))
+
+        self._proxy.stream_configuration("config_id", "v1")
+        self._proxy.set_reported_configuration(
+            "config_id", "v1", "dep_id", "success")
+        self._proxy.get_instance_config_ids()
+        self.assertEqual(self._proxy.bytes_received, self._api.bytes_sent)
+
+    def test_no_keep_alive(self):
+        """Requests succeed on connections closed after each response"""
+        proxy = DeploymentProxy(
+            self._api.url, Mock(api_key="token", instance_id="my_instance_id"),
+            keep_alive=False)
+        self.addCleanup(proxy.close)
+        connections = self._api.connections
+        for _ in range(100):
+            proxy.get_instance_config_ids()
+        self.assertEqual(self._api.connections - connections, 100)
+
+    def test_received_bytes(self):
+        """Bytes are counted by thread as well"""
+        received = {}
+
+        def poll():
+            for _ in range(20):
+                self._proxy.get_instance_config_ids()
+            received["poll"] = self._proxy.received_bytes()
+
+        thread = threading.Thread(target=poll)
+        thread.start()
+        for _ in range(5):
+            self._proxy.get_configuration("config_id", "v1")
+        thread.join()
+        received["main"] = self._proxy.received_bytes()
+        self.assertEqual(self._proxy.bytes_received,
+                         received["poll"] + received["main"])
+        self.assertEqual(self._proxy.bytes_received, self._api.bytes_sent)
+        self.assertEqual(received["main"] % 5, 0)
+        self.assertEqual(received["poll"] % 20, 0)
+
+    def test_get_desired_fingerprint(self):
+        """Fingerprint is read from headers of a HEAD request"""
+        # not provided by Product API
+        self.assertIsNone(self._proxy.get_desired_fingerprint())
+
+        self._api._fingerprints = True
+        sent = self._api.bytes_sent
+        self.assertEqual(self._proxy.get_desired_fingerprint(),
+                         desired_fingerprint("config_id", "v1", "dep_id"))
+        # no body is sent
+        self.assertEqual(self._api.bytes_sent, sent)
+        self.assertEqual(self._api.routes["fingerprint"], 2)
+
+        self._api.set_desired("my_instance_id", "config_id", "v1", "dep_2")
+        self.assertEqual(self._proxy.get_desired_fingerprint(),
+                         desired_fingerprint("config_id", "v1", "dep_2"))
+
+        # no configuration desired
+        self._api.status_override = 404
+        self.assertEqual(self._proxy.get_desired_fingerprint(), "")
+        self._api.status_override = 501
+        self.assertIsNone(self._proxy.get_desired_fingerprint())
+        self._api.status_override = 500
+        with self.assertRaises(HTTPError):
+            self._proxy.get_desired_fingerprint()
+
+    def test_get_instances_config_ids(self):
+        """Ids of several instances are got in one request"""
+        self.assertEqual(
+            self._proxy.get_instances_config_ids(["my_instance_id", "other"]),
+            {
+                "my_instance_id": {
+                    "instance_configuration_id": "config_id",
+                    "instance_configuration_version_id": "v1",
+                    "deployment_id": "dep_id"
+                },
+                "other": None
+            })
+        self.assertEqual(self._api.routes["poll"], 1)
+
+        # batched requests not answered
+        self._api.status_override = 404
+        self.assertIsNone(self._proxy.get_instances_config_ids(["other"]))
+        self._api.status_override = 500
+        with self.assertRaises(HTTPError):
+            self._proxy.get_instances_config_ids(["other"])
+
+
+class TestDeploymentProxyPeers(NIOTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._configuration = synthetic_configuration(50)
+        self._api = StubProductAPI().start()
+        self._api.add_configuration("config_id", "v1", self._configuration)
+        # configuration data served by peer, by path
+        self._served = {}
+        self._peer = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._peer.daemon_threads = True
+        threading.Thread(target=self._peer.serve_forever, daemon=True).start()
+        manager = Mock()
+        manager.api_key = "token"
+        manager.instance_id = "my_instance_id"
+        self._proxy = DeploymentProxy(
+            self._api.url, manager,
+            peers=["http://127.0.0.1:1", "http://127.0.0.1:{}/".format(
+                self._peer.server_address[1])])
+
+    def tearDown(self):
+        self._proxy.close()
+        self._peer.shutdown()
+        self._peer.server_close()
+        self._api.stop()
+        super().tearDown()
+
+    def _handler(self):
+        served = self._served
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                body = served.get(self.path)
+                self.send_response(404 if body is None else 200)
+                body = (body or "").encode()
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def test_peer_configuration(self):
+        """Configuration is got from a peer when it matches its checksum"""
+        self._served["/config/versions/config_id/v1"] = json.dumps(
+            self._configuration, indent=1)
+        configuration = self._proxy.get_configuration("config_id", "v1")
+        self.assertEqual(json.loads(configuration["configuration_data"]),
+                         self._configuration)
+        sink = []
+        configuration = self._proxy.stream_configuration(
+            "config_id", "v1", sink=sink.append)
+        self.assertEqual(configuration["configuration_data"],
+                         self._configuration)
+        self.assertEqual(json.loads("".join(sink)), self._configuration)
+        self.assertEqual(self._api.routes["configuration"], 0)
+        self.assertEqual(self._api.routes["checksum"], 2)
+
+    def test_peer_fallback(self):
+        """Product API is used when no peer provides the configuration"""
+        # not provided
+        configuration = self._proxy.get_configuration("config_id", "v1")
+        self.assertEqual(json.loads(configuration["configuration_data"]),
+                         self._configuration)
+        self.assertEqual(self._api.routes["configuration"], 1)
+
+        # checksum mismatch
+        self._served["/config/versions/config_id/v1"] = json.dumps(
+            synthetic_configuration(50, version=2))
+        self._proxy.stream_configuration("config_id", "v1")
+        self.assertEqual(self._api.routes["configuration"], 2)
+
+        # checksum not provided
+        self._served["/config/versions/config_id/v2"] = json.dumps({})
+        self._api.add_configuration("config_id", "v2", {})
+        with patch.object(self._proxy, "get_configuration_checksum",
+                          return_value=None):
+            self._proxy.get_configuration("config_id", "v2")
+        self.assertEqual(self._api.routes["configuration"], 3)
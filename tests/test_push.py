@@ -0,0 +1,140 @@
+import time
+from threading import Event
+from unittest.mock import MagicMock
+
+from nio.testing.test_case import NIOTestCase
+
+from ..benchmarks.stub_api import StubProductAPI
+from ..proxy import DeploymentProxy
+from ..push import PushChannel, parse_events
+
+
+class TestParseEvents(NIOTestCase):
+
+    def test_parse(self):
+        stream = (b": keep-alive\r\n\r\nid: 1\r\nevent: deployment\r\n"
+                  b"data: {\"a\":\r\ndata:  1}\r\n\r\n"
+                  b"retry: 2500\n\ndata:\xc3\xa9\n\nevent: ignored\n")
+        # split anywhere, even within a character
+        chunks = [stream[index:index + 5]
+                  for index in range(0, len(stream), 5)]
+        self.assertEqual(list(parse_events(chunks)), [
+            {"id": "1", "event": "deployment", "data": '{"a":\n 1}'},
+            {"retry": 2.5, "event": "message", "data": ""},
+            {"event": "message", "data": "é"}
+        ])
+
+
+class TestPushChannel(NIOTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._api = StubProductAPI().start()
+        self._api.push_keepalive = 0.1
+        self._proxy = DeploymentProxy(
+            self._api.url, MagicMock(api_key="key", instance_id="instance"),
+            read_timeout=1)
+        self._events = []
+        self._received = Event()
+        self._channel = PushChannel(
+            self._proxy.open_event_stream, self._on_event,
+            retry_interval=0.05, max_retry_interval=0.1)
+
+    def tearDown(self):
+        self._channel.stop(timeout=1)
+        self._proxy.close()
+        self._api.stop()
+        super().tearDown()
+
+    def _on_event(self, ids):
+        self._events.append(ids)
+        self._received.set()
+
+    def _next_event(self):
+        self.assertTrue(self._received.wait(2))
+        self._received.clear()
+        return self._events[-1]["instance_configuration_version_id"]
+
+    def _wait_connected(self, connections):
+        end = time.monotonic() + 2
+        while not (self._channel.connected and
+                   self._api.routes["events"] == connections):
+            self.assertLess(time.monotonic(), end)
+            time.sleep(0.01)
+
+    def test_push(self):
+        """ Deployments are received as soon as they are desired """
+        self._channel.start()
+        self._wait_connected(1)
+        # nothing desired yet, keep-alive comments only
+        time.sleep(0.3)
+        self.assertEqual(self._events, [])
+
+        self._api.set_desired("instance", "cfg_id", "v1", "dep_1")
+        self.assertEqual(self._next_event(), "v1")
+        self._api.set_desired("instance", "cfg_id", "v2", "dep_2")
+        self.assertEqual(self._next_event(), "v2")
+        self.assertEqual(self._api.routes["poll"], 0)
+
+        # reconnects, latest event is not received again
+        self._api.disconnect_push()
+        self._wait_connected(2)
+        time.sleep(0.2)
+        self.assertEqual(len(self._events), 2)
+        self._api.set_desired("instance", "cfg_id", "v3", "dep_3")
+        self.assertEqual(self._next_event(), "v3")
+
+        # stops promptly while stream is open
+        start = time.monotonic()
+        self._channel.stop(timeout=1)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertFalse(self._channel.connected)
+
+    def test_current_on_connect(self):
+        """ Desired configuration is received when connecting """
+        self._api.set_desired("instance", "cfg_id", "v1", "dep_1")
+        self._channel.start()
+        self.assertEqual(self._next_event(), "v1")
+
+    def test_reconnect(self):
+        """ Failing streams are opened again, backing off """
+        self._api.status_override = 503
+        self._channel.start()
+        time.sleep(0.5)
+        self.assertFalse(self._channel.connected)
+        # backs off up to max retry interval
+        self.assertGreater(self._channel._errors, 3)
+        self.assertLess(self._channel._errors, 20)
+
+        self._api.status_override = None
+        self._api.set_desired("instance", "cfg_id", "v1", "dep_1")
+        self.assertEqual(self._next_event(), "v1")
+        self.assertTrue(self._channel.connected)
+        self.assertEqual(self._channel._errors, 0)
+
+    def test_backoff_until_event(self):
+        """ Streams ending before any event keep backing off """
+        response = MagicMock()
+        response.iter_content.return_value = []
+        open_stream = MagicMock(return_value=response)
+        channel = PushChannel(open_stream, self._on_event,
+                              retry_interval=0.01, max_retry_interval=0.02)
+        channel.start()
+        time.sleep(0.2)
+        self.assertGreater(channel._errors, 3)
+
+        # an event received resets the delay
+        response.iter_content.return_value = [
+            b"event: deployment\ndata: {}\n\n"]
+        self.assertTrue(self._received.wait(1))
+        channel.stop(timeout=1)
+        self.assertLessEqual(channel._errors, 1)
+
+    def test_failing_handler(self):
+        """ A deployment failing to be handled does not end the stream """
+        on_event = MagicMock(side_effect=RuntimeError)
+        channel = PushChannel(self._proxy.open_event_stream, on_event)
+        channel._handle('{"a": 1}')
+        on_event.assert_called_once_with({"a": 1})
+        channel._handle("not json")
+        self.assertEqual(on_event.call_count, 1)
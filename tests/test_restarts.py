@@ -0,0 +1,105 @@
+import time
+from threading import Lock
+from unittest.mock import MagicMock
+
+from nio.testing.test_case import NIOTestCase
+
+from ..restarts import ServiceRestarter, service_dependencies
+
+
+class TestServiceRestarter(NIOTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._lock = Lock()
+        self._events = []
+        self._running = 0
+        self.max_running = 0
+        self._service_manager = MagicMock()
+        self._service_manager.start_service.side_effect = \
+            lambda service_id: self._action("start", service_id)
+        self._service_manager.stop_service.side_effect = \
+            lambda service_id: self._action("stop", service_id)
+
+    def _action(self, action, service_id):
+        with self._lock:
+            self._running += 1
+            self.max_running = max(self.max_running, self._running)
+        time.sleep(0.02)
+        with self._lock:
+            self._running -= 1
+            self._events.append((action, service_id))
+        if service_id == "failing":
+            raise RuntimeError("failed")
+
+    def test_dependencies(self):
+        """ Subscribers depend on publishers of their topics """
+        blocks = {
+            "pub": {"name": "pub", "type": "Publisher", "topic": "a"},
+            "pub_b": {"name": "pub_b", "type": "blocks.Publisher",
+                      "topic": "b"},
+            "sub": {"name": "sub", "type": "Subscriber", "topic": "a"},
+            "sub_b": {"name": "sub_b", "type": "Subscriber", "topic": "b"},
+            "sub_c": {"name": "sub_c", "type": "Subscriber", "topic": "c"},
+            "logger": {"name": "logger", "type": "Logger", "topic": "a"}
+        }
+        self.assertEqual(service_dependencies({
+            "s1": {"execution": [{"id": "sub"}, {"name": "sub_b"}]},
+            "s2": {"execution": [{"id": "pub"}, {"id": "sub"}]},
+            "s3": {"execution": [{"id": "pub_b"}, {"id": "sub_c"}]},
+            "s4": {"execution": [{"id": "logger"}]},
+            "s5": None
+        }, blocks), {"s1": {"s2", "s3"}, "s2": set(), "s3": set(),
+                     "s4": set(), "s5": set()})
+
+    def test_bounded(self):
+        """ Services run in parallel, at most workers at once """
+        restarter = ServiceRestarter(self._service_manager, workers=3)
+        service_ids = ["s{}".format(index) for index in range(9)]
+        start = time.monotonic()
+        outcomes = restarter.start(service_ids, {})
+        self.assertLess(time.monotonic() - start, 9 * 0.02)
+        self.assertEqual(self.max_running, 3)
+        self.assertEqual(set(outcomes), set(service_ids))
+        self.assertGreater(outcomes["s0"]["time"], 0)
+
+    def test_order(self):
+        """ Services start after and stop before the ones they depend on
+        """
+        restarter = ServiceRestarter(self._service_manager, workers=4)
+        dependencies = {"app": {"db", "cache"}, "db": set(), "cache": set(),
+                        "other": set()}
+        restarter.start(["app", "db", "cache", "other"], dependencies)
+        started = [service_id for _, service_id in self._events]
+        self.assertEqual(started[-1], "app")
+
+        self._events.clear()
+        restarter.stop(["db", "app", "cache"], dependencies)
+        stopped = [service_id for _, service_id in self._events]
+        self.assertEqual(stopped[0], "app")
+
+    def test_failures(self):
+        """ Services depending on a failed service are not started """
+        restarter = ServiceRestarter(self._service_manager, workers=2)
+        outcomes = restarter.start(
+            ["failing", "dependent", "indirect"],
+            {"dependent": {"failing"}, "indirect": {"dependent"}})
+        self.assertEqual(outcomes["failing"]["error"], "failed")
+        self.assertEqual(outcomes["dependent"]["error"],
+                         "Service failing failed")
+        self.assertEqual(outcomes["indirect"]["error"],
+                         "Service dependent failed")
+        self.assertEqual(self._events, [("start", "failing")])
+
+        # services are stopped regardless
+        outcomes = restarter.stop(
+            ["failing", "dependent"], {"dependent": {"failing"}})
+        self.assertNotIn("error", outcomes["dependent"])
+
+    def test_cycle(self):
+        """ Services depending on each other are still started """
+        restarter = ServiceRestarter(self._service_manager)
+        outcomes = restarter.start(["a", "b", "c"], {
+            "a": {"b"}, "b": {"a"}, "c": {"a"}})
+        self.assertEqual(set(outcomes), {"a", "b", "c"})
+        self.assertEqual(self._events[0], ("start", "a"))
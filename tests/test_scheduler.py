@@ -0,0 +1,120 @@
+import heapq
+import random
+from collections import Counter
+from unittest.mock import Mock
+
+from requests.exceptions import HTTPError
+
+from nio.testing.test_case import NIOTestCase
+
+from ..benchmarks.stub_api import StubProductAPI
+from ..proxy import DeploymentProxy
+from ..scheduler import PollScheduler
+
+
+class TestPollScheduler(NIOTestCase):
+
+    def test_jitter(self):
+        scheduler = PollScheduler(100, jitter=0.1, rand=lambda: 0)
+        self.assertAlmostEqual(scheduler.next_delay(), 90)
+        scheduler = PollScheduler(100, jitter=0.1, rand=lambda: 0.5)
+        self.assertAlmostEqual(scheduler.next_delay(), 100)
+        scheduler = PollScheduler(100, jitter=0, rand=lambda: 0.99)
+        self.assertAlmostEqual(scheduler.next_delay(), 100)
+
+    def test_backoff(self):
+        scheduler = PollScheduler(10, jitter=0, max_interval=50)
+        delays = []
+        for _ in range(4):
+            scheduler.failure()
+            delays.append(scheduler.next_delay())
+        self.assertEqual(delays, [20, 40, 50, 50])
+        self.assertEqual(scheduler.errors, 4)
+        scheduler.success()
+        self.assertEqual(scheduler.next_delay(), 10)
+
+    def test_fast_polls(self):
+        scheduler = PollScheduler(60, jitter=0, fast_interval=5, fast_polls=2)
+        self.assertEqual(scheduler.next_delay(), 60)
+        scheduler.deployed()
+        self.assertEqual([scheduler.next_delay() for _ in range(3)],
+                         [5, 5, 60])
+        # errors take precedence over fast polls
+        scheduler.deployed()
+        scheduler.failure()
+        self.assertEqual(scheduler.next_delay(), 120)
+
+
+class TestPollSimulation(NIOTestCase):
+    """ Polls a local stub Product API from simulated instances in virtual
+    time, every instance starts at the same time as after a fleet restart
+    """
+
+    instances = 20
+    interval = 60
+    # the stub answers with 503 between these virtual times
+    outage = (600, 1200)
+    duration = 1800
+
+    def setUp(self):
+        super().setUp()
+        self._api = StubProductAPI().start()
+
+    def tearDown(self):
+        self._api.stop()
+        super().tearDown()
+
+    def _simulate(self, jitter):
+        proxies = []
+        schedulers = []
+        for index in range(self.instances):
+            instance_id = "instance_{}".format(index)
+            self._api.set_desired(instance_id, "cfg", "v1", "dep")
+            proxies.append(DeploymentProxy(
+                self._api.url, Mock(api_key="key", instance_id=instance_id)))
+            schedulers.append(PollScheduler(
+                self.interval, jitter=jitter,
+                rand=random.Random(index).random))
+
+        sent = self._api.requests
+        events = [(schedulers[index].next_delay(), index)
+                  for index in range(self.instances)]
+        heapq.heapify(events)
+        requests = []
+        while events[0][0] < self.duration:
+            now, index = heapq.heappop(events)
+            self._api.status_override = \
+                503 if self.outage[0] <= now < self.outage[1] else None
+            try:
+                proxies[index].get_instance_config_ids({})
+                schedulers[index].success()
+            except HTTPError:
+                schedulers[index].failure()
+            requests.append(now)
+            heapq.heappush(
+                events, (now + schedulers[index].next_delay(), index))
+
+        for proxy in proxies:
+            proxy.close()
+        self.assertEqual(self._api.requests - sent, len(requests))
+        return requests
+
+    def test_request_rate(self):
+        requests = self._simulate(jitter=0.2)
+        steady = len([t for t in requests if t < self.outage[0]])
+        during_outage = len(
+            [t for t in requests if self.outage[0] <= t < self.outage[1]])
+
+        # about one request per instance and interval in steady state
+        expected = self.instances * self.outage[0] / self.interval
+        self.assertGreater(steady, expected * 0.8)
+        self.assertLess(steady, expected * 1.3)
+        # backing off during outage
+        self.assertLess(during_outage, steady / 2)
+
+        # instances started together do not poll in lockstep
+        per_second = Counter(int(t) for t in requests)
+        self.assertLessEqual(max(per_second.values()), 3)
+
+        lockstep = Counter(int(t) for t in self._simulate(jitter=0))
+        self.assertEqual(max(lockstep.values()), self.instances)
@@ -0,0 +1,64 @@
+from threading import Event
+
+from nio.testing.test_case import NIOTestCase
+
+from ..staging import ConfigurationStager, StagedConfiguration
+
+
+class TestConfigurationStager(NIOTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._release = Event()
+        self._prepared = []
+        self._stager = ConfigurationStager(self._prepare)
+
+    def tearDown(self):
+        self._release.set()
+        self._stager.stop()
+        super().tearDown()
+
+    def _prepare(self, config_id, config_version_id):
+        self._release.wait(1)
+        self._prepared.append(config_version_id)
+        if config_version_id == "fail":
+            raise RuntimeError("failed")
+        return StagedConfiguration({"version": config_version_id}, {}, None)
+
+    def test_take(self):
+        self._release.set()
+        self._stager.stage("cfg", "v1")
+        self.assertEqual(self._stager.staged, ("cfg", "v1"))
+        self.assertIsNone(self._stager.take("cfg", "v2"))
+        self.assertEqual(self._stager.take("cfg", "v1").configuration_data,
+                         {"version": "v1"})
+        # a version is taken once
+        self.assertIsNone(self._stager.staged)
+        self.assertIsNone(self._stager.take("cfg", "v1"))
+
+    def test_take_waits(self):
+        """ Taking a version being prepared waits for it """
+        self._stager.stage("cfg", "v1")
+        # staging same version again does not prepare it again
+        self._stager.stage("cfg", "v1")
+        self._release.set()
+        self.assertEqual(self._stager.take("cfg", "v1").configuration_data,
+                         {"version": "v1"})
+        self.assertEqual(self._prepared, ["v1"])
+
+    def test_replaced(self):
+        """ Staging a version replaces the version staged before """
+        self._stager.stage("cfg", "v1")
+        self._stager.stage("cfg", "v2")
+        self._stager.stage("cfg", "v3")
+        self._release.set()
+        self.assertIsNone(self._stager.take("cfg", "v2"))
+        self.assertEqual(self._stager.take("cfg", "v3").configuration_data,
+                         {"version": "v3"})
+        # v2 was dropped before it was prepared
+        self.assertNotIn("v2", self._prepared)
+
+    def test_failure(self):
+        self._release.set()
+        self._stager.stage("cfg", "fail")
+        self.assertIsNone(self._stager.take("cfg", "fail"))
@@ -0,0 +1,100 @@
+import time
+from unittest.mock import patch
+
+from nio.testing.test_case import NIOTestCase
+
+from ..state import DeploymentState
+
+
+class TestDeploymentState(NIOTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._store = {}
+        patcher = patch(DeploymentState.__module__ + ".Persistence")
+        persistence = patcher.start()
+        self.addCleanup(patcher.stop)
+        persistence.return_value.load.side_effect = \
+            lambda key, default=None: self._store.get(key, default)
+        persistence.return_value.save.side_effect = self._save
+        persistence.return_value.remove.side_effect = self._remove
+        self._saves = []
+        self._removes = []
+
+    def _save(self, value, key):
+        self._saves.append(key)
+        self._store[key] = value
+
+    def _remove(self, key):
+        self._removes.append(key)
+        self._store.pop(key, None)
+
+    def test_load(self):
+        """ Settings ids are used until ids were persisted """
+        state = DeploymentState()
+        state.load("cfg_id", "v1")
+        self.assertEqual((state.config_id, state.config_version_id),
+                         ("cfg_id", "v1"))
+        self.assertIsNone(state.fingerprints)
+        self.assertEqual(self._saves, [])
+
+        state.update(config_id="cfg_id", config_version_id="v2",
+                     deployment_id="dep_id", fingerprints={"blocks": {}})
+        self.assertEqual(self._saves, ["deployment_state"])
+        self.assertIsNotNone(self._store["deployment_state"]["deployed_at"])
+
+        restarted = DeploymentState()
+        restarted.load("cfg_id", "v1")
+        self.assertEqual(restarted.config_version_id, "v2")
+        self.assertEqual(restarted.deployment_id, "dep_id")
+        self.assertEqual(restarted.fingerprints, {"blocks": {}})
+
+        with self.assertRaises(AttributeError):
+            state.update(unknown=1)
+
+    def test_migration(self):
+        """ Ids persisted under separate keys are migrated """
+        self._store.update({
+            "configuration_id": "cfg_id",
+            "configuration_version_id": "v1"
+        })
+        state = DeploymentState()
+        state.load("settings_id", "settings_v")
+        self.assertEqual((state.config_id, state.config_version_id),
+                         ("cfg_id", "v1"))
+        self.assertIsNone(state.fingerprints)
+        self.assertEqual(self._saves, ["deployment_state"])
+        # legacy keys are removed once the record was written
+        self.assertEqual(self._removes,
+                         ["configuration_id", "configuration_version_id"])
+        self.assertEqual(list(self._store), ["deployment_state"])
+
+        # and not migrated again
+        restarted = DeploymentState()
+        restarted.load()
+        self.assertEqual(restarted.config_version_id, "v1")
+        self.assertEqual(self._saves, ["deployment_state"])
+
+    def test_batched_writes(self):
+        """ Changes are written at once after the delay or when flushed """
+        state = DeploymentState(delay=0.05)
+        state.update(validators={"etag": "1"})
+        state.update(desired_fingerprint={"fingerprint": "abc"})
+        # unchanged values are not written
+        state.update(validators={"etag": "1"})
+        self.assertEqual(self._saves, [])
+        time.sleep(0.2)
+        self.assertEqual(self._saves, ["deployment_state"])
+        self.assertEqual(
+            self._store["deployment_state"]["desired_fingerprint"],
+            {"fingerprint": "abc"})
+
+        state.update(config_id="cfg_id")
+        state.update(config_version_id="v1")
+        state.flush()
+        state.flush()
+        self.assertEqual(len(self._saves), 2)
+        self.assertEqual(self._store["deployment_state"]["config_version_id"],
+                         "v1")
+        time.sleep(0.1)
+        self.assertEqual(len(self._saves), 2)
@@ -0,0 +1,74 @@
+import json
+
+from nio.testing.test_case import NIOTestCase
+
+from ..stream import ConfigurationParser, EnvelopeParser
+
+
+class TestStream(NIOTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._configuration = {
+            "version": 1.25,
+            "blocks": {
+                "block1": {"name": "quote \" and \\ backslash", "n": 10},
+                "block2": {"name": "unicode é \U0001F600", "l": [1, {}]},
+            },
+            "services": {
+                "service1": {"execution": [{"id": "block1"}]},
+            },
+            "blockTypes": {},
+            "other": True
+        }
+
+    def _feed(self, parser, text, size):
+        for i in range(0, len(text), size):
+            parser.feed(text[i:i + size])
+
+    def test_configuration(self):
+        text = json.dumps(self._configuration, indent=2)
+        for size in (1, 2, 3, 7, 64, len(text)):
+            parser = ConfigurationParser()
+            self._feed(parser, text, size)
+            parser.close()
+            self.assertDictEqual(parser.configuration, self._configuration)
+
+    def test_envelope(self):
+        """ Configuration data is decoded as a string or as an object """
+        for configuration_data in (json.dumps(self._configuration),
+                                   self._configuration):
+            for ensure_ascii in (True, False):
+                envelope = {
+                    "configuration_data": configuration_data,
+                    "message": "Found Instance Configuration",
+                    "status": 200
+                }
+                text = json.dumps(envelope, ensure_ascii=ensure_ascii)
+                for size in (1, 5, 13, len(text)):
+                    pieces = []
+                    parser = EnvelopeParser(pieces.append)
+                    self._feed(parser, text, size)
+                    result = parser.close()
+                    self.assertDictEqual(
+                        result["configuration_data"], self._configuration)
+                    self.assertEqual(result["status"], 200)
+                    self.assertDictEqual(
+                        json.loads("".join(pieces)), self._configuration)
+
+    def test_incomplete(self):
+        for text in ('{"configuration_data": "{\\"blocks\\": {"}',
+                     '{"configuration_data": {"blocks": {}',
+                     '{"status": 20'):
+            parser = EnvelopeParser()
+            with self.assertRaises(ValueError):
+                parser.feed(text)
+                parser.close()
+
+    def test_invalid(self):
+        parser = EnvelopeParser()
+        with self.assertRaises(ValueError):
+            parser.feed("[]")
+        parser = EnvelopeParser()
+        with self.assertRaises(ValueError):
+            parser.feed('{"configuration_data": "{}trailing"}')
@@ -0,0 +1,140 @@
+import json
+from unittest.mock import MagicMock
+
+from nio.testing.test_case import NIOTestCase
+
+from ..transaction import ConfigurationTransaction
+
+
+class TestConfigurationTransaction(NIOTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._running = {
+            "blockTypes": {"type1": {"name": "type1"}},
+            "blocks": {"block1": {"name": "block1", "type": "type1"},
+                       "block2": {"name": "block2", "type": "type1"}},
+            "services": {"service1": {"name": "service1"}}
+        }
+        self._update = MagicMock(return_value={})
+
+    def _transaction(self, snapshot=True):
+        return ConfigurationTransaction(
+            self._update, json.dumps(self._running) if snapshot else None,
+            True)
+
+    def test_stages(self):
+        """ Sections are handed over in dependency order """
+        update_data = {
+            "services": {"service1": {"name": "renamed"}},
+            "blocks": {"block1": {"name": "renamed"}},
+            "blockTypes": {},
+            "other": 1
+        }
+        self._update.side_effect = [
+            {"blocks": {"success": ["block1"]}, "services": {}},
+            {"blocks": {"success": []}, "services": {"success": ["s"]}}]
+        result = self._transaction().apply(update_data, False)
+        self.assertEqual(self._update.call_count, 2)
+        first, second = [call[0] for call in self._update.call_args_list]
+        self.assertEqual(first, ({
+            "blockTypes": {}, "blocks": update_data["blocks"],
+            "services": {}, "other": 1}, True, False))
+        self.assertEqual(second[0]["services"], update_data["services"])
+        self.assertEqual(second[0]["blocks"], {})
+        self.assertNotIn("other", second[0])
+        # stage results are merged
+        self.assertEqual(result, {"blocks": {"success": ["block1"]},
+                                  "services": {"success": ["s"]}})
+
+        # a whole configuration is handed over at once
+        self._update.reset_mock(side_effect=True)
+        self._transaction().apply(update_data, True)
+        self._update.assert_called_once_with(update_data, True, True)
+
+    def test_rollback(self):
+        """ Only touched objects are restored """
+        self._update.side_effect = [
+            {"blocks": {"error": [{"id": "block1"}]}}, {}]
+        transaction = self._transaction()
+        result = transaction.apply({
+            "blocks": {"block1": {"name": "changed"}},
+            "services": {"service1": {"name": "changed"}}}, False)
+        self.assertEqual(result["blocks"]["error"], [{"id": "block1"}])
+        # services stage did not run
+        self.assertEqual(self._update.call_count, 1)
+        self.assertEqual(transaction.touched["services"], [])
+
+        transaction.rollback()
+        self._update.assert_called_with({
+            "blockTypes": {},
+            "blocks": {"block1": self._running["blocks"]["block1"]},
+            "services": {}}, True, False)
+        self.assertEqual(transaction.restored, 1)
+
+    def test_rollback_added(self):
+        """ Added objects are left in place, other objects are restored """
+        update_data = {"services": {"service1": {"name": "changed"},
+                                    "service2": {"name": "service2"}}}
+        self._update.return_value = {"services": {"error": ["failed"]}}
+        transaction = self._transaction()
+        transaction.apply(update_data, False)
+        transaction.rollback()
+        self._update.assert_called_with(
+            {"blockTypes": {}, "blocks": {},
+             "services": {"service1": self._running["services"]["service1"]}},
+            True, False)
+        self.assertEqual(transaction.restored, 1)
+        self.assertEqual(transaction.added,
+                         {"blockTypes": [], "blocks": [],
+                          "services": ["service2"]})
+
+        # a whole configuration is restored as a whole
+        transaction = self._transaction()
+        transaction.apply(update_data, True)
+        transaction.rollback()
+        self._update.assert_called_with(self._running, True, True)
+        self.assertEqual(transaction.restored, 4)
+
+    def test_no_snapshot(self):
+        """ Without a snapshot all stages are applied """
+        self._update.return_value = {"blocks": {"error": ["failed"]}}
+        transaction = self._transaction(snapshot=False)
+        self.assertFalse(transaction.can_rollback)
+        transaction.apply({"blocks": {"block1": {}},
+                           "services": {"service1": {}}}, False)
+        self.assertEqual(self._update.call_count, 2)
+
+    def test_batches(self):
+        """ Services are handed over in batches, checked after each """
+        services = {"service{}".format(index): {} for index in range(5)}
+        batches = []
+        self._update.side_effect = lambda data, *args: {
+            "services": {"success": list(data["services"])}}
+
+        def after_batch(service_ids, index, count):
+            batches.append((service_ids, index, count))
+            return {"services": {"error": []}}
+
+        before_batch = MagicMock()
+        result = self._transaction().apply(
+            {"blocks": {"block1": {}}, "services": services}, False, 2,
+            before_batch, after_batch)
+        self.assertEqual(self._update.call_count, 4)
+        self.assertEqual(batches, [
+            (["service0", "service1"], 0, 3),
+            (["service2", "service3"], 1, 3),
+            (["service4"], 2, 3)])
+        self.assertEqual(before_batch.call_count, 3)
+        self.assertEqual(result["services"]["success"], list(services))
+
+        # a failing check stops the update, even without a snapshot
+        batches.clear()
+        transaction = self._transaction(snapshot=False)
+        result = transaction.apply(
+            {"services": services}, False, 2, None,
+            lambda service_ids, index, count: {"services": {"error": [
+                {"id": service_ids[0]}]}})
+        self.assertEqual(result["services"]["error"], [{"id": "service0"}])
+        self.assertEqual(transaction.touched["services"],
+                         ["service0", "service1"])
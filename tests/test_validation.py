@@ -0,0 +1,101 @@
+from unittest.mock import MagicMock
+
+from nio.testing.test_case import NIOTestCase
+
+from ..benchmarks.configurations import synthetic_configuration
+from ..validation import ConfigurationValidator
+
+
+class TestConfigurationValidator(NIOTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._validator = ConfigurationValidator()
+
+    def _kinds(self, errors):
+        return {section: sorted((error.get("id"), error["kind"])
+                                for error in section_errors["error"])
+                for section, section_errors in errors.items()}
+
+    def test_valid(self):
+        self.assertEqual(
+            self._validator.validate(synthetic_configuration(20)), {})
+        self.assertEqual(self._validator.validate({}), {})
+        # blocks may be referenced by name
+        configuration = synthetic_configuration(2, blocks_per_service=2)
+        configuration["services"]["service_0"]["execution"] = [
+            {"name": "Block 1"}]
+        self.assertEqual(self._validator.validate(configuration), {})
+
+    def test_references(self):
+        configuration = synthetic_configuration(4, blocks_per_service=2)
+        configuration["blocks"]["block_1"]["type"] = "blocks.Unknown"
+        # block_2 is executed by service_1
+        del configuration["blocks"]["block_2"]
+        self._validator.logger = MagicMock()
+        errors = self._validator.validate(configuration)
+        self.assertEqual(self._kinds(errors), {
+            "services": [("service_1", "missing_block")]
+        })
+        # unknown block types are warned about only
+        self._validator.logger.warning.assert_called_once_with(
+            "1 blocks of 1 types are not part of configuration: "
+            "blocks.Unknown")
+        # blocks kept on instance may be referenced
+        self.assertEqual(self._validator.validate(
+            configuration, allow_missing_blocks=True), {})
+
+        # block types are only checked when configuration provides them
+        self._validator.logger.reset_mock()
+        configuration["blockTypes"] = {}
+        self.assertEqual(self._validator.validate(
+            configuration, allow_missing_blocks=True), {})
+        self._validator.logger.warning.assert_not_called()
+
+    def test_unknown_types(self):
+        """ Asserts unknown block types are warned about once """
+        configuration = synthetic_configuration(30)
+        for index in range(30):
+            configuration["blocks"]["block_{}".format(index)]["type"] = \
+                "blocks.Unknown{:02}".format(index % 15)
+        self._validator.logger = MagicMock()
+        self.assertEqual(self._validator.validate(configuration), {})
+        self._validator.logger.warning.assert_called_once_with(
+            "30 blocks of 15 types are not part of configuration: " +
+            ", ".join("blocks.Unknown{:02}".format(index)
+                      for index in range(10)) +
+            ", ... (5 more)")
+
+    def test_shape(self):
+        self.assertEqual(
+            self._kinds(self._validator.validate([])),
+            {"configuration": [(None, "invalid_configuration")]})
+        configuration = {
+            "blockTypes": [],
+            "blocks": {
+                "block1": "block",
+                "block2": {"id": "other", "name": "block2", "type": "t"},
+                "block3": {"name": ["list"]}
+            },
+            "services": {
+                "service1": {"name": "service1", "execution": {}},
+                "service2": {"name": "service2",
+                             "execution": ["block1", {"id": "block2",
+                                                      "receivers": 1}]},
+                "service3": {"execution": [{"id": "block2", "receivers": {
+                    "terminal": [{"id": "missing"}]}}]}
+            }
+        }
+        errors = self._validator.validate(configuration)
+        self.assertEqual(self._kinds(errors), {
+            "blockTypes": [(None, "invalid_section")],
+            "blocks": [("block1", "invalid_object"),
+                       ("block2", "id_mismatch"),
+                       ("block3", "missing_name"),
+                       ("block3", "missing_type")],
+            "services": [("service1", "invalid_execution"),
+                         ("service2", "invalid_execution"),
+                         ("service2", "invalid_execution"),
+                         ("service3", "missing_block"),
+                         ("service3", "missing_name")]
+        })
@@ -0,0 +1,91 @@
+import json
+from unittest import skipIf
+from unittest.mock import Mock
+
+from nio.testing.test_case import NIOTestCase
+
+from ..benchmarks.configurations import synthetic_configuration
+from ..benchmarks.stub_api import StubProductAPI
+from ..proxy import DeploymentProxy
+from ..wire import ACCEPT_ENCODING, CBOR, DECODERS, JSON, MSGPACK, \
+    accept_header
+
+
+class TestWireFormat(NIOTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._configuration = synthetic_configuration(50)
+        self._api = None
+        self._proxy = None
+
+    def tearDown(self):
+        if self._proxy:
+            self._proxy.close()
+        if self._api:
+            self._api.stop()
+        super().tearDown()
+
+    def _start(self, compact_encoding=True, **kwargs):
+        self._api = StubProductAPI(**kwargs).start()
+        self._api.add_configuration("config_id", "v1", self._configuration)
+        self._proxy = DeploymentProxy(
+            self._api.url, Mock(api_key="token", instance_id="instance"),
+            compact_encoding=compact_encoding)
+
+    def _assert_received(self):
+        """ Asserts configuration is received whole either way """
+        configuration = self._proxy.get_configuration("config_id", "v1")
+        configuration_data = configuration["configuration_data"]
+        if isinstance(configuration_data, str):
+            configuration_data = json.loads(configuration_data)
+        self.assertEqual(configuration_data, self._configuration)
+
+        sink = []
+        configuration = self._proxy.stream_configuration(
+            "config_id", "v1", sink=sink.append)
+        self.assertEqual(configuration["configuration_data"],
+                         self._configuration)
+        self.assertEqual(json.loads("".join(sink)), self._configuration)
+        self.assertEqual(self._proxy.bytes_received, self._api.bytes_sent)
+
+    def test_accept_header(self):
+        self.assertEqual(accept_header(compact=False), JSON)
+        header = accept_header()
+        self.assertTrue(header.endswith(JSON + ";q=0.5") or header == JSON)
+        for media_type in DECODERS:
+            self.assertIn(media_type, header)
+
+    def test_json(self):
+        """ JSON is received when compact encodings are not answered """
+        self._start(compress=True)
+        self._assert_received()
+
+    @skipIf(MSGPACK not in DECODERS, "msgpack is not installed")
+    def test_msgpack(self):
+        self._start(compact=MSGPACK)
+        self._assert_received()
+        json_size = len(self._api._configuration_body("config_id", "v1"))
+        self.assertLess(self._api.bytes_sent, json_size * 2)
+
+        # not accepted
+        self._proxy._configuration_headers["accept"] = accept_header(False)
+        self._assert_received()
+
+    @skipIf(CBOR not in DECODERS, "cbor2 is not installed")
+    def test_cbor(self):
+        self._start(compact=CBOR, compress="gzip")
+        self._assert_received()
+
+    @skipIf("zstd" not in ACCEPT_ENCODING, "zstd is not available")
+    def test_zstd(self):
+        self._start(compress="zstd")
+        self._assert_received()
+        body = self._api._configuration_body("config_id", "v1", JSON, "zstd")
+        self.assertEqual(self._api.bytes_sent, len(body) * 2)
+
+    def test_compact_disabled(self):
+        """ Compact encodings are not used when disabled """
+        self._start(compact_encoding=False, compact=True)
+        configuration = self._proxy.get_configuration("config_id", "v1")
+        self.assertIsInstance(configuration["configuration_data"], str)
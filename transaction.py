@@ -0,0 +1,206 @@
+"""
+
+   Transactional configuration updates
+
+"""
+import json
+
+from nio.util.logging import get_nio_logger
+
+from .diff import SECTIONS
+from .errors import UpdateErrors
+
+# sections in the order they are applied, block types before the blocks
+# using them and blocks before the services executing them
+STAGES = ("blockTypes", "blocks", "services")
+
+
+class ConfigurationTransaction(object):
+    """ Applies an update in dependency order and restores the objects it
+    touched when it fails
+
+    The update is handed over in stages, one for each section holding
+    objects, and stops at the first stage failing. Rolling back restores
+    the definitions the touched objects have in the running configuration,
+    the snapshot, so that it is proportional to the size of the change.
+    Objects the update added are not part of the snapshot, they are left in
+    place and listed in `added` for the caller to hand over the whole
+    configuration next time.
+
+    Services may be handed over in batches, a rolling update, the update
+    stops at the first batch failing whether it can be rolled back or not.
+
+    Updates deleting missing objects hold a whole configuration, these are
+    handed over at once and rolled back by restoring the whole running
+    configuration.
+    """
+
+    def __init__(self, update, snapshot=None, start_stop_services=True):
+        """ Create a transaction
+
+        Args:
+            update (callable): ConfigurationManager update
+            snapshot (str): running configuration, encoded, None when it is
+                not known in which case the update cannot be rolled back
+            start_stop_services (bool): whether services are started and
+                stopped by updates
+        """
+        super().__init__()
+        self.logger = get_nio_logger("DeploymentManager")
+
+        self._update = update
+        self._snapshot = snapshot
+        self._start_stop_services = start_stop_services
+        # objects handed over, as {section: [id, ...]}
+        self.touched = {section: [] for section in SECTIONS}
+        # number of objects restored by rolling back
+        self.restored = 0
+        # objects added by the update and left in place by rolling back, as
+        # {section: [id, ...]}
+        self.added = {section: [] for section in SECTIONS}
+        self._full = False
+
+    @property
+    def can_rollback(self):
+        return self._snapshot is not None
+
+    def apply(self, update_data, delete_missing, batch_size=0,
+              before_batch=None, after_batch=None):
+        """ Hands over an update
+
+        Args:
+            update_data (dict): configuration or configuration changes
+            delete_missing (bool): whether objects missing from
+                `update_data` are deleted, `update_data` then holds a whole
+                configuration
+            batch_size (int): number of services handed over at once, 0
+                hands them over together, not used when deleting missing
+                objects
+            before_batch (callable): optional, invoked with the ids of a
+                batch of services before it is handed over
+            after_batch (callable): optional, invoked with the ids of a
+                batch of services, its index and the number of batches
+                once it was handed over. Returns an update result with the
+                errors found checking the batch, merged with its result
+
+        Returns:
+            result (dict): update results of all stages
+        """
+        if delete_missing:
+            self._full = True
+            for section in SECTIONS:
+                self.touched[section] = list(update_data.get(section) or {})
+            return self._update(
+                update_data, self._start_stop_services, delete_missing)
+
+        stages = [section for section in STAGES if update_data.get(section)]
+        if not stages:
+            return self._update(
+                update_data, self._start_stop_services, delete_missing)
+
+        result = {}
+        for index, section in enumerate(stages):
+            stage_data = {key: value for key, value in update_data.items()
+                          if key not in SECTIONS and index == 0}
+            stage_data.update({key: {} for key in SECTIONS})
+            if section == "services":
+                stage_result = self._apply_batches(
+                    stage_data, update_data[section], batch_size,
+                    before_batch, after_batch)
+            else:
+                stage_data[section] = update_data[section]
+                self.touched[section] = list(update_data[section])
+                stage_result = self._update(
+                    stage_data, self._start_stop_services, False)
+            _merge(result, stage_result)
+            # without a snapshot stopping would leave the update half
+            # applied all the same
+            if self.can_rollback and index < len(stages) - 1 and \
+                    UpdateErrors(stage_result):
+                self.logger.warning(
+                    "Failed to update {}, {} are not updated".format(
+                        section, ", ".join(stages[index + 1:])))
+                break
+        return result
+
+    def _apply_batches(self, stage_data, services, batch_size, before_batch,
+                       after_batch):
+        """ Hands over services in batches """
+        service_ids = list(services)
+        batch_size = batch_size or len(service_ids)
+        batches = [service_ids[start:start + batch_size]
+                   for start in range(0, len(service_ids), batch_size)]
+        result = {}
+        for index, batch in enumerate(batches):
+            if before_batch:
+                before_batch(batch)
+            stage_data["services"] = {
+                service_id: services[service_id] for service_id in batch}
+            self.touched["services"].extend(batch)
+            batch_result = {}
+            _merge(batch_result, self._update(
+                stage_data, self._start_stop_services, False))
+            if after_batch:
+                _merge(batch_result, after_batch(batch, index, len(batches)))
+            _merge(result, batch_result)
+            if index < len(batches) - 1 and UpdateErrors(batch_result):
+                self.logger.warning(
+                    "Failed to update batch {} of {}, {} services are not "
+                    "updated".format(index + 1, len(batches), sum(
+                        len(rest) for rest in batches[index + 1:])))
+                break
+        return result
+
+    def rollback(self):
+        """ Restores objects touched by the update from the snapshot
+
+        Returns:
+            result (dict): update result of restoring the objects
+        """
+        running = json.loads(self._snapshot)
+        if self._full:
+            restore_data = running
+            delete_missing = True
+            count = sum(len(running.get(section) or {})
+                        for section in SECTIONS)
+        else:
+            restore_data = {key: value for key, value in running.items()
+                            if key not in SECTIONS}
+            count = 0
+            for section in SECTIONS:
+                objects = running.get(section) or {}
+                restore_data[section] = {
+                    object_id: objects[object_id]
+                    for object_id in self.touched[section]
+                    if object_id in objects}
+                self.added[section] = [
+                    object_id for object_id in self.touched[section]
+                    if object_id not in objects]
+                count += len(restore_data[section])
+            delete_missing = False
+            added = sum(len(ids) for ids in self.added.values())
+            if added:
+                self.logger.warning(
+                    "{} objects added by the update are left in "
+                    "place".format(added))
+        self.logger.info("Rolling back {} objects".format(count))
+        self.restored = count
+        return self._update(
+            restore_data, self._start_stop_services, delete_missing)
+
+
+def _merge(result, stage_result):
+    """ Adds a stage result to the results of the stages before it """
+    for key, value in stage_result.items():
+        current = result.get(key)
+        if not isinstance(current, dict) or not isinstance(value, dict):
+            result[key] = value
+            continue
+        merged = dict(current)
+        for name, entries in value.items():
+            if isinstance(merged.get(name), list) and \
+                    isinstance(entries, list):
+                merged[name] = merged[name] + entries
+            else:
+                merged[name] = entries
+        result[key] = merged
@@ -0,0 +1,196 @@
+"""
+
+   Configuration validation
+
+"""
+from nio.util.logging import get_nio_logger
+
+from .diff import SECTIONS
+
+
+class ConfigurationValidator(object):
+    """ Checks a configuration before it is handed over for an update
+
+    Checks that sections are objects holding objects keyed by their id,
+    that blocks are named and typed and that every block a service executes
+    or sends signals to is part of the configuration.
+
+    A block of a type missing from the block types the configuration
+    provides is only warned about, block types may be keyed differently
+    from the type blocks name, once per validation naming a few of them.
+    """
+
+    # unknown block types named in the warning at most
+    UNKNOWN_TYPES_LOGGED = 10
+
+    def __init__(self):
+        super().__init__()
+        self.logger = get_nio_logger("DeploymentManager")
+
+    def validate(self, configuration_data, allow_missing_blocks=False):
+        """ Validates a configuration
+
+        Args:
+            configuration_data (dict): configuration to validate
+            allow_missing_blocks (bool): when True services may reference
+                blocks missing from the configuration, as when those blocks
+                are kept on the instance
+
+        Returns:
+            errors (dict): errors by section, in update result format
+                {
+                    "blocks": {
+                        "error": [{"id": "..", "kind": "..",
+                                   "message": ".."}, ...]
+                    }, ...
+                }
+            empty when configuration is valid
+        """
+        if not isinstance(configuration_data, dict):
+            return {"configuration": {"error": [{
+                "kind": "invalid_configuration",
+                "message": "Configuration is not an object"}]}}
+
+        errors = {}
+        sections = {}
+        for section in SECTIONS:
+            objects = configuration_data.get(section)
+            if objects is None:
+                objects = {}
+            elif not isinstance(objects, dict):
+                self._add(errors, section, None, "invalid_section",
+                          "Section is not an object")
+                objects = {}
+            sections[section] = objects
+
+        blocks = sections["blocks"]
+        block_types = sections["blockTypes"]
+        context = {
+            "blocks": blocks,
+            "block_names": {
+                block.get("name") for block in blocks.values()
+                if isinstance(block, dict) and
+                isinstance(block.get("name"), str)},
+            "block_types": block_types,
+            "allow_missing_blocks": allow_missing_blocks,
+            # ids of blocks by unknown type
+            "unknown_types": {}
+        }
+
+        for section, check in (("blockTypes", None),
+                               ("blocks", self._check_block),
+                               ("services", self._check_service)):
+            section_errors = self._check_section(
+                context, sections[section], check)
+            if section_errors:
+                errors.setdefault(section, {"error": []})["error"].extend(
+                    section_errors)
+        self._warn_unknown_types(context["unknown_types"])
+        return errors
+
+    def _warn_unknown_types(self, unknown_types):
+        if not unknown_types:
+            return
+        types = sorted(unknown_types)
+        sample = ", ".join(types[:self.UNKNOWN_TYPES_LOGGED])
+        if len(types) > self.UNKNOWN_TYPES_LOGGED:
+            sample += ", ... ({} more)".format(
+                len(types) - self.UNKNOWN_TYPES_LOGGED)
+        self.logger.warning(
+            "{} blocks of {} types are not part of configuration: {}".format(
+                sum(len(ids) for ids in unknown_types.values()), len(types),
+                sample))
+
+    @staticmethod
+    def _add(errors, section, object_id, kind, message):
+        errors.setdefault(section, {"error": []})["error"].append(
+            ConfigurationValidator._error(object_id, kind, message))
+
+    @staticmethod
+    def _error(object_id, kind, message):
+        error = {"kind": kind, "message": message}
+        if object_id is not None:
+            error["id"] = object_id
+        return error
+
+    def _check_section(self, context, objects, check):
+        errors = []
+        for object_id, obj in objects.items():
+            if not isinstance(obj, dict):
+                errors.append(self._error(
+                    object_id, "invalid_object", "Object is not an object"))
+                continue
+            if obj.get("id", object_id) != object_id:
+                errors.append(self._error(
+                    object_id, "id_mismatch",
+                    "Object id {!r} does not match its key".format(
+                        obj.get("id"))))
+            if check:
+                check(context, object_id, obj, errors)
+        return errors
+
+    def _check_block(self, context, block_id, block, errors):
+        if not isinstance(block.get("name"), str) or not block["name"]:
+            errors.append(self._error(
+                block_id, "missing_name", "Block has no name"))
+        block_type = block.get("type")
+        if not isinstance(block_type, str) or not block_type:
+            errors.append(self._error(
+                block_id, "missing_type", "Block has no type"))
+        elif context["block_types"] and \
+                block_type not in context["block_types"]:
+            context["unknown_types"].setdefault(block_type, []).append(
+                block_id)
+
+    def _check_service(self, context, service_id, service, errors):
+        if not isinstance(service.get("name"), str) or not service["name"]:
+            errors.append(self._error(
+                service_id, "missing_name", "Service has no name"))
+        execution = service.get("execution")
+        if execution is None:
+            return
+        if not isinstance(execution, list):
+            errors.append(self._error(
+                service_id, "invalid_execution",
+                "Service execution is not a list"))
+            return
+        for entry in execution:
+            if not isinstance(entry, dict):
+                errors.append(self._error(
+                    service_id, "invalid_execution",
+                    "Service execution entry is not an object"))
+                continue
+            self._check_reference(context, service_id, entry, errors)
+            receivers = entry.get("receivers") or {}
+            if isinstance(receivers, list):
+                # receivers may be given without terminals
+                receivers = {None: receivers}
+            if not isinstance(receivers, dict):
+                errors.append(self._error(
+                    service_id, "invalid_execution",
+                    "Receivers of {} are not an object".format(
+                        entry.get("id") or entry.get("name"))))
+                continue
+            for terminal_receivers in receivers.values():
+                if not isinstance(terminal_receivers, list):
+                    terminal_receivers = [terminal_receivers]
+                for receiver in terminal_receivers:
+                    if isinstance(receiver, str):
+                        receiver = {"id": receiver}
+                    if isinstance(receiver, dict):
+                        self._check_reference(
+                            context, service_id, receiver, errors)
+
+    def _check_reference(self, context, service_id, entry, errors):
+        """ Checks an execution entry references a known block """
+        if context["allow_missing_blocks"]:
+            return
+        refs = [ref for ref in (entry.get("id"), entry.get("name"))
+                if isinstance(ref, str)]
+        for ref in refs:
+            if ref in context["blocks"] or ref in context["block_names"]:
+                return
+        errors.append(self._error(
+            service_id, "missing_block",
+            "Service references block {} which is not part of "
+            "configuration".format(refs[0] if refs else None)))
@@ -0,0 +1,81 @@
+"""
+
+   Configuration wire formats
+
+   Configurations are received as JSON unless a compact encoding is
+   available on both ends: msgpack and CBOR are used when their packages
+   (msgpack, cbor2) are installed, the configuration then being a map
+   rather than a JSON string within the envelope. Content encodings
+   accepted are those urllib3 decodes, zstd when its zstd module is
+   available (Python 3.14 or backports.zstd).
+
+"""
+import gzip
+from collections import OrderedDict
+
+from urllib3.util import make_headers
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+try:
+    from compression import zstd
+except ImportError:
+    try:
+        from backports import zstd
+    except ImportError:
+        zstd = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+CBOR = "application/cbor"
+
+# compact encodings available, in order of preference, by media type
+DECODERS = OrderedDict()
+ENCODERS = OrderedDict()
+if msgpack is not None:
+    DECODERS[MSGPACK] = lambda body: msgpack.unpackb(body, raw=False)
+    ENCODERS[MSGPACK] = msgpack.packb
+if cbor2 is not None:
+    DECODERS[CBOR] = cbor2.loads
+    ENCODERS[CBOR] = cbor2.dumps
+
+# content encodings decoded when received, e.g. "gzip, deflate, zstd"
+ACCEPT_ENCODING = make_headers(accept_encoding=True)["accept-encoding"]
+
+
+def accept_header(compact=True):
+    """ Provides the Accept header of configuration requests
+
+    Args:
+        compact (bool): whether available compact encodings are accepted
+
+    Returns:
+        header (str): media types accepted, JSON last
+    """
+    if not compact or not DECODERS:
+        return JSON
+    types = ["{};q={:.1f}".format(media_type, 1 - index / 10)
+             for index, media_type in enumerate(DECODERS)]
+    return ", ".join(types + ["{};q=0.5".format(JSON)])
+
+
+def media_type(headers):
+    """ Provides the media type of a response, without parameters """
+    return headers.get("content-type", JSON).split(";")[0].strip().lower()
+
+
+def compress(body, encoding):
+    """ Compresses a body with a content encoding, "gzip" or "zstd" """
+    if encoding == "gzip":
+        return gzip.compress(body, 6)
+    if encoding == "zstd" and zstd is not None:
+        return zstd.compress(body, level=3)
+    raise ValueError("Unsupported content encoding: {}".format(encoding))